@@ -13,6 +13,8 @@ from decimal import Decimal
 from odoo.http import request
 from odoo import _, http, fields
 from odoo.exceptions import ValidationError
+from odoo.addons.payment_neatworldpayvt import payment_log, utils
+from odoo.addons.payment_neatworldpayvt.core import license, worldpay
 
 _logger = logging.getLogger(__name__)
 
@@ -36,7 +38,7 @@ class NeatWorldpayVTController(http.Controller):
     )
     def neatworldpayvt_wh(self, **kwargs):
         client_ip = request.httprequest.remote_addr
-        _logger.info(f"\n Client IP {client_ip} \n")
+        payment_log.debug(_logger, 'webhook.received', client_ip=client_ip)
         if client_ip not in self._allowed_ips:
             return request.make_json_response({
                 'error': 'Forbidden',
@@ -44,7 +46,7 @@ class NeatWorldpayVTController(http.Controller):
             }, status=403)
 
         response = request.get_json_data()
-        _logger.info(f"\n WH Response {response} \n")
+        payment_log.debug(_logger, 'webhook.payload', reference=((response or {}).get('eventDetails') or {}).get('transactionReference'), payload=response)
         try:
             event_details = response.get("eventDetails") if response else False
             if not event_details:
@@ -67,18 +69,18 @@ class NeatWorldpayVTController(http.Controller):
             if res:
                 state = event_details.get("type", False)
                 tokenization = event_details.get("tokenPaymentInstrument", False)
-                if state and state not in ("sentForAuthorization", "sentForSettlement"):
+                if state and state not in worldpay.IGNORED_EVENTS:
                     if state == "authorized":
                         count = 0
-                        _logger.info(f"\n WH State is Authorized {res.reference} \n")
+                        payment_log.debug(_logger, 'webhook.authorized', reference=res.reference, target='transaction')
                         while count < 30:
                             if not res or res.state == "done":
-                                _logger.info(f"\n Transaction was finished while waiting for pending status {res.reference} \n")
+                                payment_log.info(_logger, 'webhook.already_done', reference=transaction_reference, target='transaction')
                                 return request.make_json_response({
                                     'error': 'OK',
                                     'message': 'OK'
                                 }, status=200)
-                            _logger.info(f"\n Current RES State is {res.state} {res.reference} \n")
+                            payment_log.debug(_logger, 'webhook.waiting', reference=res.reference, target='transaction', status=res.state)
                             if res.state == "pending":
                                 break
                             time.sleep(1)
@@ -93,18 +95,11 @@ class NeatWorldpayVTController(http.Controller):
                                 ], limit=1)
                             )
                             count += 1
-                    if state == "sentForAuthorization":
-                        state = 'pending'
-                    elif state == "authorized":
-                        state = "done"
-                    elif state == "cancelled":
-                        state = 'cancel'
-                    else:
-                        state = 'error'
+                    state = worldpay.event_to_result_state(state)
 
                     if res.state == "done" and state in ('cancel', 'error'):
                         sale_order_ref = res.reference.split("-")[0]
-                        _logger.info(f"\n Transaction Cancelled after done {sale_order_ref} \n")
+                        payment_log.info(_logger, 'webhook.cancelled_after_done', reference=res.reference, order=sale_order_ref)
                         target_record = request.env["sale.order"].sudo().search([("name", "=", sale_order_ref)], limit=1)
                         record_label = 'sale order'
                         if not target_record:
@@ -119,12 +114,12 @@ class NeatWorldpayVTController(http.Controller):
                             )
                             record_label = 'invoice' if target_record else None
                         if target_record:
-                            _logger.info(f"\n {record_label.title()} Found for cancelled transaction creating activity {sale_order_ref} {target_record} \n")
+                            payment_log.info(_logger, 'webhook.failure_activity', reference=res.reference, model=target_record._name, record=target_record.id)
                             user_id = None
                             if target_record.user_id:
                                 user_id = target_record.user_id.id
                             elif res.provider_id.neatworldpayvt_fallback_user_id:
-                                user_id = int(res.provider_id.neatworldpayvt_fallback_user_id)
+                                user_id = res.provider_id.neatworldpayvt_fallback_user_id.id
                             target_record.activity_schedule(
                                 act_type_xmlid='mail.mail_activity_data_todo',
                                 user_id=user_id,
@@ -139,9 +134,9 @@ class NeatWorldpayVTController(http.Controller):
                     }
                     res.sudo()._handle_notification_data("neatworldpayvt", notification_data)
                 elif not state and tokenization:
-                    _logger.info(f"\n Tokenization event received but is not supported for VT {transaction_reference} \n")
+                    payment_log.info(_logger, 'webhook.tokenization_unsupported', reference=transaction_reference)
             else:
-                _logger.warning(f"[WH] Transaction not found for reference: {transaction_reference}")
+                payment_log.warning(_logger, 'webhook.not_found', reference=transaction_reference, event=wp_state)
         except ValidationError:
             return request.make_json_response({
                 'error': 'Bad Request',
@@ -165,8 +160,7 @@ class NeatWorldpayVTController(http.Controller):
     def neatworldpayvt_process_payment(self, transaction_reference=None, transaction_key=None, sessionState=None, cardholderName=None, address=None, address2=None, address3=None, city=None, state=None, country=None, postcode=None, **kwargs):
         """Process MOTO payment from virtual terminal form."""
         try:
-            _logger.info(f"\n Process Payment Path {request.httprequest.path} \n")
-            _logger.info(f"\n Kwargs {kwargs} \n")
+            payment_log.debug(_logger, 'process_payment.received', reference=transaction_reference or request.params.get('transaction_reference'), path=request.httprequest.path)
             
             # Get params from POST data
             if not transaction_reference:
@@ -187,8 +181,8 @@ class NeatWorldpayVTController(http.Controller):
             cardholder_name = cardholderName
             
             if not transaction_reference or not transaction_key or not session_state:
-                _logger.error(f"[PROCESS_PAYMENT] Missing required parameters - reference: {transaction_reference}, key: {bool(transaction_key)}, session: {bool(session_state)}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Missing required parameters")
+                payment_log.error(_logger, 'process_payment.missing_parameters', reference=transaction_reference, has_key=bool(transaction_key), has_session=bool(session_state))
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Missing required parameters')
                 return request.redirect('/payment/status')
             
             # Find the transaction
@@ -203,20 +197,20 @@ class NeatWorldpayVTController(http.Controller):
         )
         
             if not transaction:
-                _logger.warning(f"[PROCESS_PAYMENT] Transaction not found for reference: {transaction_reference}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Transaction not found")
+                payment_log.warning(_logger, 'process_payment.not_found', reference=transaction_reference, target='transaction')
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Transaction not found')
                 return request.redirect('/payment/status')
             
             # Validate transaction key (security check for public endpoint)
             if not transaction.neatworldpayvt_validation_hash or not transaction.neatworldpayvt_validate_transaction_key(transaction_key):
-                _logger.warning(f"[PROCESS_PAYMENT] Invalid transaction key for reference: {transaction_reference}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Invalid transaction key")
+                payment_log.warning(_logger, 'process_payment.invalid_key', reference=transaction_reference)
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Invalid transaction key')
                 return request.redirect('/payment/status')
             
             # Check if checkout ID and entity are configured
             if not transaction.provider_id.neatworldpayvt_checkout_id or not transaction.provider_id.neatworldpayvt_entity:
-                _logger.warning(f"[PROCESS_PAYMENT] Payment provider not properly configured for reference: {transaction_reference}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Payment provider not properly configured")
+                payment_log.warning(_logger, 'process_payment.provider_not_configured', reference=transaction_reference)
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Payment provider not properly configured')
                 return request.redirect('/payment/status')
             
             # Get the license code
@@ -229,23 +223,23 @@ class NeatWorldpayVTController(http.Controller):
                         "Referer": transaction.company_id.website,
                         "Authorization": transaction.provider_id.neatworldpayvt_activation_code
                     }
-                    response = requests.get("https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3", headers=headers, timeout=10)
+                    response = requests.get(transaction.provider_id._neatworldpayvt_get_license_url(), headers=headers, timeout=10)
                     
                     if response.status_code == 200:
                         exec_code = response.text
                         transaction.provider_id.write({"neatworldpayvt_cached_code": exec_code})
                     else:
-                        _logger.error(f"Failed to fetch activation code: {response.status_code} - {response.text}")
-                        _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Failed to fetch activation code (status {response.status_code})")
+                        payment_log.error(_logger, 'process_payment.license_fetch_failed', reference=transaction_reference, http_status=response.status_code, body=response.text[:200])
+                        payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Failed to fetch activation code')
                         return request.redirect('/payment/status')
                 except requests.RequestException as e:
-                    _logger.error(f"Request error: {e}")
-                    _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Request exception when fetching activation code")
+                    payment_log.error(_logger, 'process_payment.license_fetch_failed', reference=transaction_reference, error=e)
+                    payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Request exception when fetching activation code')
                     return request.redirect('/payment/status')
             
             if not exec_code:
-                _logger.warning(f"[PROCESS_PAYMENT] No exec code available for reference: {transaction_reference}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Payment configuration not available")
+                payment_log.warning(_logger, 'process_payment.no_license_code', reference=transaction_reference)
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Payment configuration not available')
                 return request.redirect('/payment/status')
             
             # Execute the license code in payment processing mode
@@ -270,34 +264,33 @@ class NeatWorldpayVTController(http.Controller):
             }
             
             try:
-                exec(exec_code, {}, local_context)
+                exec(license.compile_code(exec_code), {}, local_context)
                 payment_result = local_context.get("payment_result")
                 
-                _logger.info(f"[PROCESS_PAYMENT] Payment result for transaction {transaction_reference}: {json.dumps(payment_result, indent=2) if payment_result else 'None'}")
+                payment_log.debug(_logger, 'process_payment.result', reference=transaction_reference, result=payment_result)
                 
                 if payment_result and payment_result.get("success"):
                     # Payment successful
                     outcome = payment_result.get("outcome", "authorized")
                     response_data = payment_result.get("response", {})
                     
-                    _logger.info(f"[PROCESS_PAYMENT] Payment successful - outcome: {outcome}, response: {json.dumps(response_data, indent=2)}")
+                    payment_log.info(_logger, 'process_payment.authorized', reference=transaction_reference, outcome=outcome)
                     
                     # Update transaction state
                     notification_data = {
                         'reference': transaction_reference,
                         'result_state': 'done',
-                        'amount': int(Decimal(str(transaction.amount)) * Decimal('100'))
+                        'amount': utils.to_minor_units(transaction.amount, transaction.currency_id)
                     }
                     transaction.sudo()._handle_notification_data("neatworldpayvt", notification_data)
                     
-                    _logger.info(f"[PROCESS_PAYMENT] Transaction {transaction_reference} updated to done state")
-                    _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Payment processed successfully (outcome: {outcome})")
+                    payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Payment processed successfully')
                     
                     return request.redirect('/payment/status')
                 else:
                     # Payment failed
                     outcome = payment_result.get("outcome", "error") if payment_result else "error"
-                    _logger.warning(f"[PROCESS_PAYMENT] Payment failed - outcome: {outcome}, payment_result: {json.dumps(payment_result, indent=2) if payment_result else 'None'}")
+                    payment_log.warning(_logger, 'process_payment.declined', reference=transaction_reference, outcome=outcome, result=payment_result)
                     
                     notification_data = {
                         'reference': transaction_reference,
@@ -305,11 +298,11 @@ class NeatWorldpayVTController(http.Controller):
                     }
                     transaction.sudo()._handle_notification_data("neatworldpayvt", notification_data)
                     
-                    _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Payment failed (outcome: {outcome})")
+                    payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Payment failed')
                     return request.redirect('/payment/status')
                     
             except Exception as e:
-                _logger.error(f"[PROCESS_PAYMENT] Error processing payment for {transaction_reference}: {e}", exc_info=True)
+                payment_log.error(_logger, 'process_payment.exception', exc_info=True, reference=transaction_reference, target='transaction', error=e)
                 # Set transaction to error state
                 notification_data = {
                     'reference': transaction_reference,
@@ -317,10 +310,10 @@ class NeatWorldpayVTController(http.Controller):
                 }
                 transaction.sudo()._handle_notification_data("neatworldpayvt", notification_data)
                 
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Exception during payment processing")
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Exception during payment processing')
                 return request.redirect('/payment/status')
             
         except Exception as e:
-            _logger.error(f"Error in process-payment endpoint: {e}", exc_info=True)
-            _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Exception in endpoint handler")
+            payment_log.error(_logger, 'process_payment.exception', exc_info=True, reference=transaction_reference, error=e)
+            payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Exception in endpoint handler')
             return request.redirect('/payment/status')
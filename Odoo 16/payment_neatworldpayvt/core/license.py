@@ -0,0 +1,69 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Retrieval and compilation of the licensed code.
+
+The licensed code is Python source served by the SNS license server for an
+activation code. It is executed on every checkout and authorization; the
+compiled code object is kept per process so that the source is only parsed
+once per worker.
+"""
+
+import functools
+import hashlib
+
+import requests
+
+LICENSE_CODE_URL = 'https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3'
+
+
+class LicenseCodeRefused(Exception):
+    """ The license server did not return a code for the activation code. """
+
+    def __init__(self, status, body):
+        super().__init__(f"The license server answered {status}")
+        self.status = status
+        self.body = body
+
+
+def fetch_code(activation_code, referer, url=LICENSE_CODE_URL, timeout=10):
+    """ Fetch the licensed code of an activation code.
+
+    :param str activation_code: The activation code of the provider
+    :param str referer: The website of the company, sent as `Referer`
+    :param str url: The license server endpoint
+    :param int timeout: The request timeout, in seconds
+    :return: The licensed code
+    :rtype: str
+    :raise: LicenseCodeRefused if the server refuses the activation code
+    :raise: requests.RequestException if the server cannot be reached
+    """
+    response = requests.get(url, headers={
+        'Referer': referer or '',
+        'Authorization': activation_code,
+    }, timeout=timeout)
+    if response.status_code != 200:
+        raise LicenseCodeRefused(response.status_code, response.text[:200])
+    return response.text
+
+
+def code_digest(source):
+    """ Return the SHA-256 hex digest identifying a licensed code.
+
+    :param str source: The licensed code
+    :return: The digest, or False if there is no code
+    :rtype: str
+    """
+    return hashlib.sha256(source.encode()).hexdigest() if source else False
+
+
+@functools.lru_cache(maxsize=8)
+def compile_code(source):
+    """ Return the code object of the licensed code, compiled once per process.
+
+    :param str source: The licensed code
+    :return: The code object, to be given to `exec`
+    """
+    return compile(source, '<neatworldpayvt licensed code>', 'exec')
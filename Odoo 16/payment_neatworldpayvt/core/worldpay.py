@@ -0,0 +1,178 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_logger = logging.getLogger(__name__)
+
+PAYMENT_QUERIES_MEDIA_TYPE = 'application/vnd.worldpay.payment-queries-v1.hal+json'
+PAYMENTS_MEDIA_TYPE = 'application/vnd.worldpay.payments-v7+json'
+
+# Follow-up operations on an authorized card payment: the HAL link relations
+# for the full and the partial variant, and the result state once accepted.
+OPERATIONS = {
+    'capture': ('cardPayments:settle', 'cardPayments:partialSettle', 'done'),
+    'void': ('cardPayments:cancel', None, 'cancel'),
+    'refund': ('cardPayments:refund', 'cardPayments:partialRefund', 'done'),
+}
+
+# Worldpay event types, as found in webhooks and payment queries, mapped to the
+# result states understood by the notification handlers.
+EVENT_RESULT_STATES = {
+    'sentForAuthorization': 'pending',
+    'authorized': 'done',
+    'cancelled': 'cancel',
+}
+# Events that do not change the Odoo state of a payment. Refund and settlement
+# events follow operations that are applied when Worldpay accepts them.
+IGNORED_EVENTS = (
+    'sentForAuthorization', 'sentForSettlement', 'settled',
+    'sentForRefund', 'refunded',
+)
+
+# Last events reported by payment queries. Unlike webhooks, a query only shows
+# the latest event, so settlement events imply a successful authorization.
+# Events missing from this mapping leave the payment untouched.
+QUERY_RESULT_STATES = {
+    'authorized': 'done',
+    'sentForSettlement': 'done',
+    'settled': 'done',
+    'cancelled': 'cancel',
+    'expired': 'cancel',
+    'refused': 'error',
+    'error': 'error',
+}
+
+
+def event_to_result_state(event_type):
+    """ Map a Worldpay event type to a notification result state.
+
+    Unknown events are treated as errors, as the webhook always did.
+    """
+    return EVENT_RESULT_STATES.get(event_type, 'error')
+
+
+class WorldpayClient:
+    """ Minimal Worldpay Access client sharing pooled connections between threads.
+
+    A single instance can be used from several threads at once; `requests`
+    sessions are thread-safe for sending requests as long as their
+    configuration is not changed concurrently.
+    """
+
+    def __init__(self, base_url, username, password, pool_size=10, timeout=10):
+        self.base_url = (base_url or '').rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (username or '', password or '')
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def query_payment(self, transaction_reference):
+        """ Return the latest payment matching a transaction reference, or None.
+
+        :param str transaction_reference: The reference sent to Worldpay
+        :return: The payment as returned by the payment queries API
+        :rtype: dict
+        :raise: requests.RequestException if Worldpay cannot be reached
+        """
+        response = self.session.get(
+            f'{self.base_url}/paymentQueries/payments',
+            params={'transactionReference': transaction_reference},
+            headers={'Accept': PAYMENT_QUERIES_MEDIA_TYPE},
+            timeout=self.timeout,
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        payments = (response.json().get('_embedded') or {}).get('payments') or []
+        return payments[-1] if payments else None
+
+    def query_last_event(self, transaction_reference):
+        """ Return the last Worldpay event of a payment, or None if it is unknown.
+
+        :param str transaction_reference: The reference sent to Worldpay
+        :return: The event type, e.g. `authorized`
+        :rtype: str
+        :raise: requests.RequestException if Worldpay cannot be reached
+        """
+        payment = self.query_payment(transaction_reference)
+        return payment.get('lastEvent') if payment else None
+
+    def run_operation(self, operation):
+        """ Send a capture, void or refund to Worldpay.
+
+        The operation is a plain dict prepared by the ORM, so that this method
+        can run in a worker thread:
+
+        - `operation`: a key of `OPERATIONS`
+        - `reference`: the reference of the authorized payment
+        - `key`: an idempotency key, sent as correlation id and reference
+        - `links`: the HAL links of the payment, if known
+        - `partial`: whether only part of the amount is concerned
+        - `value`: the amount, as `{'amount': <minor units>, 'currency': <code>}`
+
+        :param dict operation: The operation to send
+        :return: `ok`, the HTTP `status`, a `message` and the `links` used
+        :rtype: dict
+        """
+        full_rel, partial_rel, _result_state = OPERATIONS[operation['operation']]
+        rel = partial_rel if operation.get('partial') and partial_rel else full_rel
+        links = operation.get('links')
+        try:
+            if not links or rel not in links:
+                payment = self.query_payment(operation['reference'])
+                links = (payment or {}).get('_links') or {}
+            href = (links.get(rel) or {}).get('href')
+            if not href:
+                return {'ok': False, 'status': None, 'links': links,
+                        'message': f"Worldpay does not allow {rel} on this payment."}
+            body = None
+            if rel == partial_rel:
+                body = {'value': operation['value'], 'reference': operation['key'][:64]}
+            response = self.session.post(href, json=body, headers={
+                'Accept': PAYMENTS_MEDIA_TYPE,
+                'Content-Type': PAYMENTS_MEDIA_TYPE,
+                'WP-CorrelationId': operation['key'],
+            }, timeout=self.timeout)
+        except (requests.RequestException, ValueError) as e:
+            return {'ok': False, 'status': None, 'links': links, 'message': str(e)}
+        ok = response.status_code in (200, 201, 202)
+        message = '' if ok else f"Worldpay answered {response.status_code}: {response.text[:200]}"
+        return {'ok': ok, 'status': response.status_code, 'links': links, 'message': message}
+
+
+class RateLimiter:
+    """ Thread-safe limiter spacing calls at no more than `rate` per second. """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,31 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """ Move the legacy selection column out of the way of the new many2one.
+
+    `neatworldpayvt_fallback_user_id` used to be a selection storing user ids as
+    strings. The ORM cannot cast varchar to int4, so the column is renamed here
+    and its values are copied back in `post-migrate.py`.
+    """
+    cr.execute("""
+        SELECT data_type
+          FROM information_schema.columns
+         WHERE table_name = 'payment_provider'
+           AND column_name = 'neatworldpayvt_fallback_user_id'
+    """)
+    row = cr.fetchone()
+    if not row or row[0] != 'character varying':
+        return
+    cr.execute("""
+        ALTER TABLE payment_provider
+        RENAME COLUMN neatworldpayvt_fallback_user_id TO neatworldpayvt_fallback_user_id_legacy
+    """)
+    _logger.info("Renamed legacy neatworldpayvt_fallback_user_id selection column")
@@ -8,7 +8,8 @@ import logging
 import re
 import requests
 
-from odoo.addons.payment_neatworldpayvt import const
+from odoo.addons.payment_neatworldpayvt import const, payment_log
+from odoo.addons.payment_neatworldpayvt.core import license
 from odoo import _, api, fields, models
 from odoo.exceptions import ValidationError
 
@@ -29,8 +30,9 @@ class PaymentProvider(models.Model):
         required_if_provider='neatworldpayvt')
     neatworldpayvt_activation_code = fields.Char(
         string="Activation Code", help="Contact us to receive a free activation code.")
+    # The licensed code is large and only needed to execute it
     neatworldpayvt_cached_code = fields.Char(
-        string="Cached Code", help="Cached Code")
+        string="Cached Code", help="Cached Code", prefetch=False)
     neatworldpayvt_reset_code = fields.Boolean(string="Update Module Cache", help="If set to true it will update the module cache", default=False)
     neatworldpayvt_checkout_id = fields.Char(
         string="Checkout ID", help="Worldpay Checkout ID", required_if_provider='neatworldpayvt',
@@ -39,15 +41,11 @@ class PaymentProvider(models.Model):
         string="Entity", help="Worldpay merchant entity", required_if_provider='neatworldpayvt',
         groups='base.group_system')
 
-    @api.model
-    def _get_all_users_neatworldpayvt(self):
-        """Fetch all users and return them as selection options."""
-        users = self.env['res.users'].search([])  # Get all users
-        return [(str(user.id), user.name) for user in users]  # Store ID as string, show name
-
-    neatworldpayvt_fallback_user_id = fields.Selection(
-        selection=_get_all_users_neatworldpayvt,
+    neatworldpayvt_fallback_user_id = fields.Many2one(
+        'res.users',
         string='Fallback Failure VT User',
+        domain=[('share', '=', False)],
+        ondelete='set null',
         help='Select a user who will receive an activity if a transaction fails for a sale order that does not have a salesperson.'
     )
 
@@ -55,74 +53,59 @@ class PaymentProvider(models.Model):
     def neatworldpayvt_get_code(self, activation_code):
         """ Get code. """
         try:
-            headers = {
-                "Referer": self.company_id.website,
-                "Authorization": activation_code
-            }
-            response = requests.get("https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3", headers=headers, timeout=10)
-            
-            if response.status_code == 200:
-                return response.text
-                
-            else:
-                _logger.error(f"Failed to fetch activation code: {response.status_code} - {response.text}")
+            return license.fetch_code(
+                activation_code, self.company_id.website, url=self._neatworldpayvt_get_license_url(),
+            )
+        except license.LicenseCodeRefused as e:
+            payment_log.error(_logger, 'provider.license_fetch_failed', http_status=e.status, body=e.body)
         except requests.RequestException as e:
-            _logger.error(f"Request error: {e}")
-        
+            payment_log.error(_logger, 'provider.license_fetch_failed', error=e)
         return None
 
     @api.model
     def create(self, vals):
         # Check if 'code' is 'neatworldpayvt' and activation code is being provided or changed
-        _logger.info(f"neatworldpayvt_activation_code {vals.get('neatworldpayvt_activation_code')}")
         if vals.get('neatworldpayvt_activation_code'):
-            _logger.info(f"old neatworldpayvt_activation_code {self.neatworldpayvt_activation_code}")
             if vals.get('neatworldpayvt_activation_code') != self.neatworldpayvt_activation_code or vals.get('neatworldpayvt_reset_code'):
-                _logger.info(f"Before code")
                 vals['neatworldpayvt_reset_code'] = False
                 code = self.neatworldpayvt_get_code(vals['neatworldpayvt_activation_code'])
-                _logger.info(f"Code: {code != None}")
+                payment_log.info(_logger, 'provider.license_code_fetched', provider=self.ids, fetched=bool(code))
                 if code:
                     vals['neatworldpayvt_cached_code'] = code
                 else:
-                    _logger.info(f"Raised error for code")
+                    payment_log.warning(_logger, 'provider.invalid_activation_code', provider=self.ids)
                     raise ValidationError(_("The activation code is invalid. Please check and try again."))
         elif vals.get('neatworldpayvt_reset_code'):
-            _logger.info(f"Before code")
             vals['neatworldpayvt_reset_code'] = False
             code = self.neatworldpayvt_get_code(self.neatworldpayvt_activation_code)
-            _logger.info(f"Code: {code}")
+            payment_log.info(_logger, 'provider.license_code_fetched', provider=self.ids, fetched=bool(code))
             if code:
                 vals['neatworldpayvt_cached_code'] = code
             else:
-                _logger.info(f"Raised error for code")
+                payment_log.warning(_logger, 'provider.invalid_activation_code', provider=self.ids)
                 raise ValidationError(_("The activation code is invalid. Please check and try again."))
         return super(PaymentProvider, self).create(vals)
 
     def write(self, vals):
         # Check if 'code' is 'neatworldpay' and activation code is being updated
-        _logger.info(f"neatworldpayvt_activation_code {vals.get('neatworldpayvt_activation_code')}")
         if vals.get('neatworldpayvt_activation_code'):
-            _logger.info(f"old neatworldpayvt_activation_code {self.neatworldpayvt_activation_code}")
             if vals.get('neatworldpayvt_activation_code') != self.neatworldpayvt_activation_code or vals.get('neatworldpayvt_reset_code'):
-                _logger.info(f"Before code")
                 vals['neatworldpayvt_reset_code'] = False
                 code = self.neatworldpayvt_get_code(vals['neatworldpayvt_activation_code'])
-                _logger.info(f"Code: {code}")
+                payment_log.info(_logger, 'provider.license_code_fetched', provider=self.ids, fetched=bool(code))
                 if code:
                     vals['neatworldpayvt_cached_code'] = code
                 else:
-                    _logger.info(f"Raised error for code")
+                    payment_log.warning(_logger, 'provider.invalid_activation_code', provider=self.ids)
                     raise ValidationError(_("The activation code is invalid. Please check and try again."))
         elif vals.get('neatworldpayvt_reset_code'):
-            _logger.info(f"Before code")
             vals['neatworldpayvt_reset_code'] = False
             code = self.neatworldpayvt_get_code(self.neatworldpayvt_activation_code)
-            _logger.info(f"Code: {code}")
+            payment_log.info(_logger, 'provider.license_code_fetched', provider=self.ids, fetched=bool(code))
             if code:
                 vals['neatworldpayvt_cached_code'] = code
             else:
-                _logger.info(f"Raised error for code")
+                payment_log.warning(_logger, 'provider.invalid_activation_code', provider=self.ids)
                 raise ValidationError(_("The activation code is invalid. Please check and try again."))
         return super(PaymentProvider, self).write(vals)
 
@@ -142,3 +125,15 @@ class PaymentProvider(models.Model):
             return default_codes
         return const.DEFAULT_PAYMENT_METHODS_CODES
 
+    @api.model
+    def _neatworldpayvt_get_license_url(self):
+        """ Return the URL serving the licensed code for an activation code.
+
+        The `payment_neatworldpayvt.license_url` system parameter overrides it,
+        e.g. to point at a local stub.
+
+        :return: The license code URL
+        :rtype: str
+        """
+        license_url = self.env['ir.config_parameter'].sudo().get_param('payment_neatworldpayvt.license_url')
+        return license_url or license.LICENSE_CODE_URL
@@ -0,0 +1,124 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Structured logging helpers of the module.
+
+Records are emitted as `<event> key=value ...` with `%`-style arguments, so
+that nothing is formatted unless a handler actually emits the record. Values
+are redacted when they are rendered: cardholder, address and checkout session
+data never reach the logs. The payment reference is always rendered first, as
+it is the correlation id between the browser, Odoo and Worldpay.
+
+Debug records are sampled per reference, at the rate set by the
+`neatworldpayvt_debug_sample_rate` option of the server configuration file
+(0.1 by default). All the debug records of a sampled payment are kept.
+"""
+
+import json
+import logging
+import random
+import zlib
+
+from odoo.tools import config
+
+REDACTED = '***'
+DEFAULT_DEBUG_SAMPLE_RATE = 0.1
+
+# Keys whose values are never logged, compared case-insensitively
+SENSITIVE_KEYS = frozenset(key.lower() for key in (
+    'cardholder_name', 'cardHolderName', 'session_state', 'sessionState', 'sessions',
+    'address', 'address1', 'address2', 'address3', 'city', 'state', 'country',
+    'postcode', 'postalCode', 'countryCode', 'billingAddress', 'billing_address',
+    'email', 'phone', 'cvc', 'cardNumber', 'cardExpiryDate', 'paymentInstrument',
+    'tokenPaymentInstrument', 'transaction_key', 'password', 'authorization',
+))
+
+
+def redact(value):
+    """ Return a copy of a payload with the values of sensitive keys masked.
+
+    :param value: A JSON-like payload (dicts, lists and scalars)
+    :return: The redacted copy
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower() in SENSITIVE_KEYS and value[key] not in (None, '', False)
+            else redact(value[key])
+            for key in value
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+class _KeyValues:
+    """ Render `key=value` pairs when the record is formatted, not when it is created. """
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __str__(self):
+        parts = []
+        for key, value in self.values.items():
+            if key.lower() in SENSITIVE_KEYS and value not in (None, '', False):
+                rendered = REDACTED
+            elif isinstance(value, (dict, list, tuple)):
+                rendered = json.dumps(redact(value), default=str, sort_keys=True)
+            else:
+                rendered = str(value)
+                if not rendered or any(char.isspace() for char in rendered):
+                    rendered = json.dumps(rendered)
+            parts.append(f'{key}={rendered}')
+        return ' '.join(parts)
+
+
+def log(logger, level, event, exc_info=False, **values):
+    """ Emit a structured record if the logger is enabled for the level.
+
+    :param logging.Logger logger: The logger of the calling module
+    :param int level: The logging level
+    :param str event: A dotted event name, e.g. `webhook.ignored`
+    :param bool exc_info: Whether to attach the current exception
+    :param values: The key/value pairs of the record; `reference` comes first
+    :return: None
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if 'reference' in values:
+        values = {'reference': values.pop('reference'), **values}
+    logger.log(level, '%s %s', event, _KeyValues(values), exc_info=exc_info)
+
+
+def _is_sampled(reference):
+    try:
+        rate = float(config.get('neatworldpayvt_debug_sample_rate', DEFAULT_DEBUG_SAMPLE_RATE))
+    except (TypeError, ValueError):
+        rate = DEFAULT_DEBUG_SAMPLE_RATE
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    if reference:
+        return zlib.crc32(str(reference).encode()) % 10000 < rate * 10000
+    return random.random() < rate
+
+
+def debug(logger, event, **values):
+    """ Emit a sampled debug record; see the module docstring. """
+    if logger.isEnabledFor(logging.DEBUG) and _is_sampled(values.get('reference')):
+        log(logger, logging.DEBUG, event, **values)
+
+
+def info(logger, event, **values):
+    log(logger, logging.INFO, event, **values)
+
+
+def warning(logger, event, **values):
+    log(logger, logging.WARNING, event, **values)
+
+
+def error(logger, event, exc_info=False, **values):
+    log(logger, logging.ERROR, event, exc_info=exc_info, **values)
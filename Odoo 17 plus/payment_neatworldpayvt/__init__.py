@@ -16,4 +16,12 @@ def post_init_hook(env):
 
 
 def uninstall_hook(env):
-    reset_payment_provider(env, 'neatworldpayvt')
\ No newline at end of file
+    reset_payment_provider(env, 'neatworldpayvt')
+    # Indexes created by this module on tables it does not own
+    for index_name in (
+        'account_move_invoice_origin_idx',
+        'payment_transaction_reference_state_provider_idx',
+        'payment_transaction_open_provider_create_date_idx',
+        'payment_transaction_write_date_idx',
+    ):
+        env.cr.execute(f'DROP INDEX IF EXISTS "{index_name}"')
\ No newline at end of file
@@ -1,6 +1,6 @@
 {
     'name': 'Payment Provider: Worldpay Virtual Terminal',
-    'version': '3.0',
+    'version': '3.1',
     'category': 'Accounting/Payment Providers',
     'sequence': 350,
     'summary': "Worldpay Official Integration for Virtual Terminal Payments.",
@@ -9,27 +9,36 @@
     'maintainer': 'SNS Software',
     'website': 'https://www.sns-software.com',
     'depends': ['payment', 'account'],
+    'external_dependencies': {'python': ['cryptography']},
     'images': ['static/description/main.gif'],
     'data': [
         'security/ir.model.access.csv',
+        'security/neatworldpayvt_security.xml',
         'views/payment_provider_views.xml',
         'views/account_move_views.xml',
+        'views/payment_transaction_views.xml',
+        'views/neatworldpayvt_payment_report_views.xml',
+        'views/neatworldpayvt_payment_event_views.xml',
         'views/payment_form_templates.xml',
         'views/worldpay_vt_payment_templates.xml',
         'wizard/worldpay_vt_popup_views.xml',
+        'wizard/neatworldpayvt_settlement_import_views.xml',
         'views/payment_neatworldpayvt_templates.xml',
 
-        'data/payment_provider_data.xml'
+        'data/payment_provider_data.xml',
+        'data/ir_cron_data.xml',
     ],
     'post_init_hook': 'post_init_hook',
     'uninstall_hook': 'uninstall_hook',
     'assets': {
         'web.assets_frontend': [
+            'payment_neatworldpayvt/static/src/js/checkout_loader.js',
             'payment_neatworldpayvt/static/src/js/payment_form.js'
         ],
         'web.assets_backend': [
             'payment_neatworldpayvt/static/src/css/neatworldpay.css',
             'payment_neatworldpayvt/static/src/js/neatworldpay.js',
+            'payment_neatworldpayvt/static/src/js/payment_result_bridge.js',
         ]
     },
     'license': 'LGPL-3',
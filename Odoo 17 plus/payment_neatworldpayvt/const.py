@@ -5,4 +5,12 @@
 
 DEFAULT_PAYMENT_METHODS_CODES = [
     'card'
-]
\ No newline at end of file
+]
+
+# Worldpay Access hosts per provider state. Only used to warm up the browser
+# (preconnect/preload of checkout.js) before the processing values, which carry
+# the authoritative URL, are known.
+WORLDPAY_URLS = {
+    'enabled': 'https://access.worldpay.com',
+    'test': 'https://try.access.worldpay.com',
+}
@@ -4,20 +4,36 @@
 # Odoo is a trademark of Odoo S.A.
 
 import base64
+import hmac
 import json
 import logging
 import re
 import requests
+import threading
 import time
-import uuid
 from decimal import Decimal
 from odoo.http import request
-from odoo import _, http, fields
+from odoo import SUPERUSER_ID, _, api, http, fields, models
 from odoo.exceptions import ValidationError
+from odoo.modules.registry import Registry
+from odoo.service.model import retrying
+from odoo.tools import config
+from odoo.addons.payment_neatworldpayvt import metrics, payment_log, profiling, status_cache, utils, webhook_routing
+from odoo.addons.payment_neatworldpayvt.core import references, states, worldpay
 
 _logger = logging.getLogger(__name__)
 
 
+def _popup_reference(wizard_id):
+    wizard = request.env['worldpay.vt.popup'].sudo().browse(wizard_id).exists() if wizard_id else None
+    return wizard.virtual_payment_id.reference if wizard else None
+
+
+def _webhook_reference():
+    event_details = (request.get_json_data() or {}).get('eventDetails') or {}
+    return event_details.get('transactionReference')
+
+
 class NeatWorldpayVTController(http.Controller):
 
     _allowed_ips = [
@@ -32,19 +48,27 @@ class NeatWorldpayVTController(http.Controller):
         '108.129.30.203'
     ]
 
-    def _is_guid_reference(self, reference):
-        if (reference or '').startswith('vt/'):
-            return True
-        try:
-            uuid.UUID(reference or "")
+    def _is_allowed_webhook_ip(self, client_ip):
+        """ Return whether a webhook caller is Worldpay.
+
+        Hosts listed, comma separated, in the `payment_neatworldpayvt.webhook_allowed_ips`
+        system parameter are accepted too, e.g. a local mock of Worldpay.
+        """
+        if client_ip in self._allowed_ips:
             return True
-        except Exception:
-            return False
+        extra_ips = request.env['ir.config_parameter'].sudo().get_param('payment_neatworldpayvt.webhook_allowed_ips')
+        return bool(extra_ips) and client_ip in {ip.strip() for ip in extra_ips.split(',')}
+
+    def _is_guid_reference(self, reference):
+        return references.is_guid_reference(reference)
 
     def _is_payment_link_reference(self, reference):
-        return (reference or '').startswith('pl/')
+        return references.is_payment_link_reference(reference)
 
     def _schedule_multi_invoice_failure_activity(self, invoices, reference, fallback_user_id=False):
+        # VT providers pass a res.users record, payment links still pass a string id
+        if isinstance(fallback_user_id, models.BaseModel):
+            fallback_user_id = fallback_user_id.id
         for invoice in invoices:
             user_id = invoice.user_id.id if invoice.user_id else (int(fallback_user_id) if fallback_user_id else None)
             invoice.activity_schedule(
@@ -54,49 +78,12 @@ class NeatWorldpayVTController(http.Controller):
                 summary="Payment Failed - Action Required",
                 note=f"The payment failed after initial confirmation {reference}. Please review and take action."
             )
-            _logger.info(f"\n Invoice Found for cancelled transaction creating activity {reference} {invoice} \n")
+            payment_log.info(_logger, 'webhook.failure_activity', reference=reference, invoice=invoice.id)
 
     def _handle_virtual_payment(self, payment, result_state):
         if not payment:
             return False
-        target_status = 'paid' if result_state == 'done' else result_state
-        if payment.status == 'paid' and result_state in ('cancel', 'error'):
-            return True
-        if payment.status == target_status:
-            return True
-        if payment.status == 'paid' and target_status in ('pending', 'cancel', 'error'):
-            return True
-        if result_state in ('pending', 'cancel', 'error'):
-            payment.sudo().write({'status': result_state})
-        invoices = payment.invoice_ids.filtered(lambda m: m.state == 'posted' and m.payment_state != 'paid')
-        all_invoice_ids = payment.invoice_ids.ids
-        if result_state == 'done' and invoices:
-            wizard_ctx = {
-                'active_model': 'account.move',
-                'active_ids': invoices.ids,
-                'active_id': invoices.ids[0],
-            }
-            register_wizard_vals = {}
-            if payment.provider_id.journal_id:
-                register_wizard_vals['journal_id'] = payment.provider_id.journal_id.id
-            register_wizard = request.env['account.payment.register'].sudo().with_context(**wizard_ctx).create(register_wizard_vals)
-            register_wizard._create_payments()
-
-            note_body = (
-                f"Payment was made for reference {payment.reference}. "
-                f"Multiple invoices were paid together. "
-                f"Invoices in this virtual terminal payment: {all_invoice_ids}"
-            )
-            admin_user = request.env.ref('base.user_admin')
-            for invoice in payment.invoice_ids:
-                invoice.with_user(admin_user).sudo().message_post(
-                    body=note_body,
-                    message_type='comment',
-                    subtype_xmlid='mail.mt_note',
-                )
-            payment.sudo().write({'status': 'paid'})
-        elif result_state == 'done':
-            payment.sudo().write({'status': 'paid'})
+        payment._neatworldpayvt_apply_result(result_state)
         return True
 
     def _handle_payment_link_invoices(self, reference, result_state):
@@ -106,12 +93,7 @@ class NeatWorldpayVTController(http.Controller):
             return False
         if not link_rec:
             return False
-        target_status = 'paid' if result_state == 'done' else result_state
-        if link_rec.status == 'paid' and result_state in ('cancel', 'error'):
-            return True
-        if link_rec.status == target_status:
-            return True
-        if link_rec.status == 'paid' and target_status in ('pending', 'cancel', 'error'):
+        if not states.document_target_status(link_rec.status, result_state):
             return True
 
         if result_state in ('pending', 'cancel', 'error'):
@@ -153,22 +135,22 @@ class NeatWorldpayVTController(http.Controller):
         wizard = request.env['worldpay.vt.popup'].sudo().browse(wizard_id).exists()
         if not wizard:
             return request.not_found()
-        vt_providers = request.env['payment.provider'].sudo().search([
-            ('code', '=', 'neatworldpayvt'),
-            ('state', '!=', 'disabled'),
-        ])
+        if wizard.provider_routed and wizard.transaction_key and not kwargs.get('select'):
+            # The wizard was opened on the provider of the invoices' company and currency
+            return self.neatworldpayvt_invoice_payment_pay_page(wizard_id)
+        Provider = request.env['payment.provider'].sudo()
+        vt_providers = Provider.browse(Provider._neatworldpayvt_enabled_provider_ids())
         return request.render('payment_neatworldpayvt.worldpay_vt_invoice_payment_page', {
             'wizard': wizard,
             'vt_providers': vt_providers,
         })
 
     def _neatworldpayvt_invoice_provider_for_wizard(self, wizard, provider_id):
-        provider = request.env['payment.provider'].sudo().browse(int(provider_id)).exists()
-        if not provider or provider.code != 'neatworldpayvt' or provider.state == 'disabled':
+        Provider = request.env['payment.provider'].sudo()
+        snapshot = Provider._neatworldpayvt_get_snapshot(int(provider_id))
+        if not snapshot or not wizard.virtual_payment_id:
             return request.env['payment.provider']
-        if not wizard.virtual_payment_id:
-            return request.env['payment.provider']
-        return provider
+        return Provider.browse(snapshot.id)
 
     @http.route(
         '/neatworldpayvt/invoice_payment/<int:wizard_id>/checkout',
@@ -178,6 +160,7 @@ class NeatWorldpayVTController(http.Controller):
         methods=['POST'],
         csrf=False,
     )
+    @profiling.profiled('checkout', lambda kwargs: _popup_reference(kwargs.get('wizard_id')))
     def neatworldpayvt_invoice_payment_checkout(self, wizard_id, **kwargs):
         wizard = request.env['worldpay.vt.popup'].sudo().browse(wizard_id).exists()
         if not wizard:
@@ -228,20 +211,130 @@ class NeatWorldpayVTController(http.Controller):
         })
 
 
+    def _neatworldpayvt_read_status(self, reference):
+        if self._is_payment_link_reference(reference):
+            try:
+                link_rec = request.env['worldpay.payment.link'].sudo().search([('reference', '=', reference)], limit=1)
+            except KeyError:
+                return {}
+            if not link_rec:
+                return {}
+            return {
+                'reference': reference,
+                'type': 'payment_link',
+                'status': link_rec.status,
+                'final': link_rec.status in ('paid', 'cancel', 'error'),
+            }
+        if self._is_guid_reference(reference):
+            virtual_payment = request.env['worldpay.virtual.payment'].sudo().search([('reference', '=', reference)], limit=1)
+            return virtual_payment._neatworldpayvt_get_status() if virtual_payment else {}
+        transaction = request.env['payment.transaction'].sudo().search([
+            ('reference', '=', reference),
+            ('provider_code', '=', 'neatworldpayvt'),
+        ], limit=1)
+        return transaction._neatworldpayvt_get_status() if transaction else {}
+
+    @http.route('/neatworldpayvt/status/<path:reference>', type='http', auth='user', methods=['GET'])
+    def neatworldpayvt_status(self, reference, **kwargs):
+        """ Return the current status of a VT reference for polling clients.
+
+        Only internal users may poll: references are guessable and the status
+        is read with sudo. Served from a short-lived per-worker cache so that
+        many clients polling the same reference cost close to no database
+        queries. Status changes clear the cache of the worker that made them
+        only; other workers serve the cached status until it expires, at most
+        `status_cache.STATUS_TTL` seconds later.
+        """
+        if not request.env.user.has_group('base.group_user'):
+            return request.make_json_response({'error': 'not_found'}, status=404)
+        dbname = request.env.cr.dbname
+        status = status_cache.get(dbname, reference)
+        if status is None:
+            status = self._neatworldpayvt_read_status(reference)
+            status_cache.put(dbname, reference, status)
+        if not status:
+            return request.make_json_response({'error': 'not_found'}, status=404)
+        return request.make_json_response(status, headers=[('Cache-Control', 'no-store')])
+
+    @http.route('/neatworldpayvt/metrics', type='http', auth='public', methods=['GET'], save_session=False)
+    def neatworldpayvt_metrics(self, **kwargs):
+        """ Serve the module metrics in the Prometheus text format.
+
+        Scrapers authenticate with `Authorization: Bearer <token>`, the token
+        being the `payment_neatworldpayvt.metrics_token` system parameter.
+        Administrators logged into the backend can open the page directly.
+        """
+        token = request.env['ir.config_parameter'].sudo().get_param('payment_neatworldpayvt.metrics_token')
+        authorization = request.httprequest.headers.get('Authorization', '')
+        authorized = bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+        if not authorized and not request.env.user._is_system():
+            return request.make_response('Unauthorized', headers=[('WWW-Authenticate', 'Bearer')], status=401)
+        body = request.env['neatworldpayvt.metric'].sudo()._render_prometheus()
+        return request.make_response(body, headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Cache-Control', 'no-store'),
+        ])
+
+    @http.route(
+        "/neatworldpayvt/wh/dispatch", type="http", auth="none", csrf=False, methods=["POST"], save_session=False
+    )
+    def neatworldpayvt_wh_dispatch(self, **kwargs):
+        """ Webhook endpoint shared by the databases of a server; see `webhook_routing`.
+
+        The event is handled by `neatworldpayvt_wh` in the database it belongs
+        to, which checks the caller again against that database's settings.
+        """
+        if not webhook_routing.is_enabled():
+            return request.not_found()
+        client_ip = request.httprequest.remote_addr
+        extra_ips = config.get('neatworldpayvt_webhook_allowed_ips') or ''
+        if client_ip not in self._allowed_ips and client_ip not in {ip.strip() for ip in extra_ips.split(',')}:
+            return request.make_json_response({
+                'error': 'Forbidden',
+                'message': 'Forbidden'
+            }, status=403)
+        event_details = (request.get_json_data() or {}).get('eventDetails') or {}
+        dbname = webhook_routing.resolve_database(event_details, request.httprequest.host)
+        if not dbname:
+            payment_log.warning(_logger, 'webhook.unrouted', reference=event_details.get('transactionReference'))
+            return request.make_json_response({
+                'error': 'Not Found',
+                'message': 'Not Found'
+            }, status=404)
+        payment_log.debug(_logger, 'webhook.routed', reference=event_details.get('transactionReference'), database=dbname)
+        current_thread = threading.current_thread()
+        saved_dbname = getattr(current_thread, 'dbname', None)
+        current_thread.dbname = dbname
+        try:
+            registry = Registry(dbname).check_signaling()
+            with registry.manage_changes(), registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                saved_env, request.env = request.env, env(user=env.ref('base.public_user').id)
+                try:
+                    return retrying(lambda: self.neatworldpayvt_wh(**kwargs), request.env)
+                finally:
+                    request.env = saved_env
+        finally:
+            if saved_dbname is None:
+                del current_thread.dbname
+            else:
+                current_thread.dbname = saved_dbname
+
     @http.route(
         "/neatworldpayvt/wh", type="http", auth="public", csrf=False, methods=["POST", "GET"]
     )
+    @profiling.profiled('webhook', lambda kwargs: _webhook_reference())
     def neatworldpayvt_wh(self, **kwargs):
         client_ip = request.httprequest.remote_addr
-        _logger.info(f"\n Client IP {client_ip} \n")
-        if client_ip not in self._allowed_ips:
+        payment_log.debug(_logger, 'webhook.received', client_ip=client_ip)
+        if not self._is_allowed_webhook_ip(client_ip):
             return request.make_json_response({
                 'error': 'Forbidden',
                 'message': 'Forbidden'
             }, status=403)
 
         response = request.get_json_data()
-        _logger.info(f"\n WH Response {response} \n")
+        payment_log.debug(_logger, 'webhook.payload', reference=((response or {}).get('eventDetails') or {}).get('transactionReference'), payload=response)
         try:
             event_details = response.get("eventDetails") if response else False
             if not event_details:
@@ -252,23 +345,21 @@ class NeatWorldpayVTController(http.Controller):
 
             transaction_reference = event_details.get("transactionReference", False)
             wp_state = event_details.get("type", False)
-            result_state = 'error'
-            if wp_state == "sentForAuthorization":
-                result_state = 'pending'
-            elif wp_state == "authorized":
-                result_state = "done"
-            elif wp_state == "cancelled":
-                result_state = 'cancel'
+            result_state = worldpay.event_to_result_state(wp_state)
+            request.env['neatworldpayvt.payment.event'].sudo()._log_event(
+                transaction_reference, 'webhook', wp_state, detail=event_details.get('date') or None,
+            )
+            metrics.inc(request.env, 'neatworldpayvt_webhook_events_total', {'event': wp_state or 'unknown'})
             if self._is_payment_link_reference(transaction_reference):
-                if wp_state in ("sentForAuthorization", "sentForSettlement"):
-                    _logger.info(f"\n Ignoring {wp_state} for payment link multi payment {transaction_reference} \n")
+                if wp_state in worldpay.IGNORED_EVENTS:
+                    payment_log.info(_logger, 'webhook.ignored', reference=transaction_reference, event=wp_state, target='payment_link')
                     return request.make_json_response({
                         'error': 'OK',
                         'message': 'OK'
                     }, status=200)
                 link_rec = request.env['worldpay.payment.link'].sudo().search([('reference', '=', transaction_reference)], limit=1)
                 if link_rec and link_rec.status == 'paid' and wp_state == "authorized":
-                    _logger.info(f"\n Link already paid and received authorized again {transaction_reference} \n")
+                    payment_log.info(_logger, 'webhook.already_paid', reference=transaction_reference, target='payment_link')
                     return request.make_json_response({
                         'error': 'OK',
                         'message': 'OK'
@@ -277,14 +368,17 @@ class NeatWorldpayVTController(http.Controller):
                     count = 0
                     while count < 30:
                         if not link_rec or link_rec.status in ('pending', 'cancel', 'error'):
-                            _logger.info(f"\n Link Record not found or status is {link_rec.status} {transaction_reference} \n")
+                            payment_log.debug(_logger, 'webhook.lookup', reference=transaction_reference, target='payment_link', status=link_rec.status or None)
                             break
-                        _logger.info(f"\n Link Record found and status is {link_rec.status} {transaction_reference} \n")
+                        payment_log.debug(_logger, 'webhook.waiting', reference=transaction_reference, target='payment_link', status=link_rec.status)
                         time.sleep(1)
+                        metrics.inc(request.env, 'neatworldpayvt_webhook_wait_seconds_total', {
+                            'provider': metrics.provider_label(link_rec.provider_id), 'target': 'payment_link',
+                        })
                         request.env.cr.commit()
                         link_rec = request.env['worldpay.payment.link'].sudo().search([('reference', '=', transaction_reference)], limit=1)
                         count += 1
-                _logger.info(f"\n Link Record not found or status is {link_rec.status} {transaction_reference} \n")
+                payment_log.debug(_logger, 'webhook.lookup', reference=transaction_reference, target='payment_link', status=link_rec.status or None)
                 if link_rec and link_rec.status == 'paid' and result_state in ('cancel', 'error'):
                     self._schedule_multi_invoice_failure_activity(
                         link_rec.invoice_ids,
@@ -296,7 +390,7 @@ class NeatWorldpayVTController(http.Controller):
                         'message': 'OK'
                     }, status=200)
                 if not link_rec or link_rec.status in ('paid', 'cancel', 'error'):
-                    _logger.info(f"\n Link Record not found or status is {link_rec.status} {transaction_reference} \n")
+                    payment_log.debug(_logger, 'webhook.lookup', reference=transaction_reference, target='payment_link', status=link_rec.status or None)
                     return request.make_json_response({
                         'error': 'OK',
                         'message': 'OK'
@@ -307,8 +401,8 @@ class NeatWorldpayVTController(http.Controller):
                     'message': 'OK'
                 }, status=200)
             if self._is_guid_reference(transaction_reference):
-                if wp_state in ("sentForAuthorization", "sentForSettlement"):
-                    _logger.info(f"\n Ignoring {wp_state} for VT multi payment {transaction_reference} \n")
+                if wp_state in worldpay.IGNORED_EVENTS:
+                    payment_log.info(_logger, 'webhook.ignored', reference=transaction_reference, event=wp_state, target='virtual_payment')
                     return request.make_json_response({
                         'error': 'OK',
                         'message': 'OK'
@@ -319,20 +413,23 @@ class NeatWorldpayVTController(http.Controller):
                     .search([('reference', '=', transaction_reference)], limit=1)
                 )
                 if virtual_payment and virtual_payment.status == 'paid' and wp_state == "authorized":
-                    _logger.info(f"\n Virtual payment already paid and received authorized again {transaction_reference} \n")
+                    payment_log.info(_logger, 'webhook.already_paid', reference=transaction_reference, target='virtual_payment')
                     return request.make_json_response({
                         'error': 'OK',
                         'message': 'OK'
                     }, status=200)
-                _logger.info(f"\n Virtual Payment Record not found or status is {virtual_payment.status} {transaction_reference} \n")
+                payment_log.debug(_logger, 'webhook.lookup', reference=transaction_reference, target='virtual_payment', status=virtual_payment.status or None)
                 if wp_state == "authorized":
                     count = 0
                     while count < 30:
                         if not virtual_payment or virtual_payment.status in ('pending', 'cancel', 'error'):
-                            _logger.info(f"\n Virtual Payment Record not found or status is {virtual_payment.status} {transaction_reference} \n")
+                            payment_log.debug(_logger, 'webhook.lookup', reference=transaction_reference, target='virtual_payment', status=virtual_payment.status or None)
                             break
-                        _logger.info(f"\n Virtual Payment Record found and status is {virtual_payment.status} {transaction_reference} \n")
+                        payment_log.debug(_logger, 'webhook.waiting', reference=transaction_reference, target='virtual_payment', status=virtual_payment.status or None)
                         time.sleep(1)
+                        metrics.inc(request.env, 'neatworldpayvt_webhook_wait_seconds_total', {
+                            'provider': metrics.provider_label(virtual_payment.provider_id), 'target': 'virtual_payment',
+                        })
                         request.env.cr.commit()
                         virtual_payment = (
                             request.env['worldpay.virtual.payment']
@@ -341,7 +438,7 @@ class NeatWorldpayVTController(http.Controller):
                         )
                         count += 1
                 if virtual_payment and virtual_payment.status == 'paid' and result_state in ('cancel', 'error'):
-                    _logger.info(f"\n Virtual Payment Record found and status is {virtual_payment.status} {transaction_reference} \n")
+                    payment_log.debug(_logger, 'webhook.waiting', reference=transaction_reference, target='virtual_payment', status=virtual_payment.status or None)
                     self._schedule_multi_invoice_failure_activity(
                         virtual_payment.invoice_ids,
                         transaction_reference,
@@ -351,22 +448,16 @@ class NeatWorldpayVTController(http.Controller):
                         'error': 'OK',
                         'message': 'OK'
                     }, status=200)
-                _logger.info(f"\n Virtual Payment Record not found or status is {virtual_payment.status} {transaction_reference} \n")
+                payment_log.debug(_logger, 'webhook.lookup', reference=transaction_reference, target='virtual_payment', status=virtual_payment.status or None)
                 if not virtual_payment or virtual_payment.status in ('paid', 'cancel', 'error'):
-                    _logger.info(f"\n Virtual Payment Record not found or status is {virtual_payment.status} {transaction_reference} \n")
+                    payment_log.debug(_logger, 'webhook.lookup', reference=transaction_reference, target='virtual_payment', status=virtual_payment.status or None)
                     return request.make_json_response({
                         'error': 'OK',
                         'message': 'OK'
                     }, status=200)
-                result_state = 'error'
-                if wp_state == "sentForAuthorization":
-                    result_state = 'pending'
-                elif wp_state == "authorized":
-                    result_state = "done"
-                elif wp_state == "cancelled":
-                    result_state = 'cancel'
+                result_state = worldpay.event_to_result_state(wp_state)
                 virtual_payment = virtual_payment.filtered(lambda p: p.status not in ('paid', 'cancel', 'error'))
-                _logger.info(f"\n Virtual Payment Record found and status is {virtual_payment.status} {transaction_reference} \n")
+                payment_log.debug(_logger, 'webhook.waiting', reference=transaction_reference, target='virtual_payment', status=virtual_payment.status or None)
                 self._handle_virtual_payment(virtual_payment, result_state)
                 return request.make_json_response({
                     'error': 'OK',
@@ -386,21 +477,24 @@ class NeatWorldpayVTController(http.Controller):
             if res:
                 state = event_details.get("type", False)
                 tokenization = event_details.get("tokenPaymentInstrument", False)
-                if state and state not in ("sentForAuthorization", "sentForSettlement"):
+                if state and state not in worldpay.IGNORED_EVENTS:
                     if state == "authorized":
                         count = 0
-                        _logger.info(f"\n WH State is Authorized {res.reference} \n")
+                        payment_log.debug(_logger, 'webhook.authorized', reference=res.reference, target='transaction')
                         while count < 30:
                             if not res or res.state == "done":
-                                _logger.info(f"\n Transaction was finished while waiting for pending status {res.reference} \n")
+                                payment_log.info(_logger, 'webhook.already_done', reference=transaction_reference, target='transaction')
                                 return request.make_json_response({
                                     'error': 'OK',
                                     'message': 'OK'
                                 }, status=200)
-                            _logger.info(f"\n Current RES State is {res.state} {res.reference} \n")
+                            payment_log.debug(_logger, 'webhook.waiting', reference=res.reference, target='transaction', status=res.state)
                             if res.state == "pending":
                                 break
                             time.sleep(1)
+                            metrics.inc(request.env, 'neatworldpayvt_webhook_wait_seconds_total', {
+                                'provider': metrics.provider_label(res.provider_id), 'target': 'transaction',
+                            })
                             request.env.cr.commit()
                             res = (
                                 request.env["payment.transaction"]
@@ -412,18 +506,11 @@ class NeatWorldpayVTController(http.Controller):
                                 ], limit=1)
                             )
                             count += 1
-                    if state == "sentForAuthorization":
-                        state = 'pending'
-                    elif state == "authorized":
-                        state = "done"
-                    elif state == "cancelled":
-                        state = 'cancel'
-                    else:
-                        state = 'error'
+                    state = worldpay.event_to_result_state(state)
 
                     if res.state == "done" and state in ('cancel', 'error'):
                         sale_order_ref = res.reference.split("-")[0]
-                        _logger.info(f"\n Transaction Cancelled after done {sale_order_ref} \n")
+                        payment_log.info(_logger, 'webhook.cancelled_after_done', reference=res.reference, order=sale_order_ref)
                         target_record = request.env["sale.order"].sudo().search([("name", "=", sale_order_ref)], limit=1)
                         record_label = 'sale order'
                         if not target_record:
@@ -438,12 +525,12 @@ class NeatWorldpayVTController(http.Controller):
                             )
                             record_label = 'invoice' if target_record else None
                         if target_record:
-                            _logger.info(f"\n {record_label.title()} Found for cancelled transaction creating activity {sale_order_ref} {target_record} \n")
+                            payment_log.info(_logger, 'webhook.failure_activity', reference=res.reference, model=target_record._name, record=target_record.id)
                             user_id = None
                             if target_record.user_id:
                                 user_id = target_record.user_id.id
                             elif res.provider_id.neatworldpayvt_fallback_user_id:
-                                user_id = int(res.provider_id.neatworldpayvt_fallback_user_id)
+                                user_id = res.provider_id.neatworldpayvt_fallback_user_id.id
                             target_record.activity_schedule(
                                 act_type_xmlid='mail.mail_activity_data_todo',
                                 user_id=user_id,
@@ -458,9 +545,9 @@ class NeatWorldpayVTController(http.Controller):
                     }
                     res.sudo()._handle_notification_data("neatworldpayvt", notification_data)
                 elif not state and tokenization:
-                    _logger.info(f"\n Tokenization event received but is not supported for VT {transaction_reference} \n")
+                    payment_log.info(_logger, 'webhook.tokenization_unsupported', reference=transaction_reference)
             else:
-                _logger.warning(f"[WH] Transaction not found for reference: {transaction_reference}")
+                payment_log.warning(_logger, 'webhook.not_found', reference=transaction_reference, event=wp_state)
         except ValidationError:
             return request.make_json_response({
                 'error': 'Bad Request',
@@ -481,11 +568,13 @@ class NeatWorldpayVTController(http.Controller):
         methods=['POST'],
         csrf=False
     )
+    @profiling.profiled('process_payment', lambda kwargs: (
+        kwargs.get('transaction_reference') or request.params.get('transaction_reference')
+    ))
     def neatworldpayvt_process_payment(self, transaction_reference=None, transaction_key=None, sessionState=None, cardholderName=None, address=None, address2=None, address3=None, city=None, state=None, country=None, postcode=None, **kwargs):
         """Process MOTO payment from virtual terminal form."""
         try:
-            _logger.info(f"\n Process Payment Path {request.httprequest.path} \n")
-            _logger.info(f"\n Kwargs {kwargs} \n")
+            payment_log.debug(_logger, 'process_payment.received', reference=transaction_reference or request.params.get('transaction_reference'), path=request.httprequest.path)
             
             # Get params from POST data
             if not transaction_reference:
@@ -507,11 +596,23 @@ class NeatWorldpayVTController(http.Controller):
             cardholder_name = cardholderName
             
             if not transaction_reference or not transaction_key or not session_state:
-                _logger.error(f"[PROCESS_PAYMENT] Missing required parameters - reference: {transaction_reference}, key: {bool(transaction_key)}, session: {bool(session_state)}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Missing required parameters")
+                payment_log.error(_logger, 'process_payment.missing_parameters', reference=transaction_reference, has_key=bool(transaction_key), has_session=bool(session_state))
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Missing required parameters')
                 return request.redirect('/payment/status')
             
 
+            card_values = {
+                "session_state": session_state,
+                "cardholder_name": cardholder_name,
+                "address": address,
+                "address2": address2,
+                "address3": address3,
+                "city": city,
+                "state": state,
+                "country": country,
+                "postcode": postcode,
+            }
+
             if self._is_guid_reference(transaction_reference):
                 virtual_payment = (
                     request.env["worldpay.virtual.payment"]
@@ -522,105 +623,64 @@ class NeatWorldpayVTController(http.Controller):
                     ], limit=1)
                 )
                 if not virtual_payment:
-                    _logger.warning(f"[PROCESS_PAYMENT] Virtual payment not found for reference: {transaction_reference}")
+                    payment_log.warning(_logger, 'process_payment.not_found', reference=transaction_reference, target='virtual_payment')
                     return request.make_json_response({
                         'error': 'Bad Request',
                         'message': 'Bad Request'
                     }, status=400)
                 if not provider_id:
-                    _logger.warning(f"[PROCESS_PAYMENT] Missing provider_id for virtual payment reference: {transaction_reference}")
+                    payment_log.warning(_logger, 'process_payment.missing_provider', reference=transaction_reference)
                     return request.make_json_response({
                         'error': 'Bad Request',
                         'message': 'Bad Request'
                     }, status=400)
                 try:
-                    posted_provider = request.env['payment.provider'].sudo().browse(int(provider_id)).exists()
+                    snapshot = request.env['payment.provider']._neatworldpayvt_get_snapshot(int(provider_id))
                 except (TypeError, ValueError):
-                    posted_provider = request.env['payment.provider']
-                if not posted_provider or posted_provider.code != 'neatworldpayvt' or posted_provider.state == 'disabled':
-                    _logger.warning(f"[PROCESS_PAYMENT] Invalid provider_id for virtual payment reference: {transaction_reference}")
+                    snapshot = None
+                if not snapshot:
+                    payment_log.warning(_logger, 'process_payment.invalid_provider', reference=transaction_reference, provider_id=provider_id)
                     return request.make_json_response({
                         'error': 'Bad Request',
                         'message': 'Bad Request'
                     }, status=400)
-                if virtual_payment.provider_id != posted_provider:
-                    virtual_payment.sudo().write({'provider_id': posted_provider.id})
-                if not virtual_payment.provider_id.neatworldpayvt_checkout_id or not virtual_payment.provider_id.neatworldpayvt_entity:
-                    _logger.warning(f"[PROCESS_PAYMENT] Payment provider not properly configured for reference: {transaction_reference}")
+                if virtual_payment.provider_id.id != snapshot.id:
+                    virtual_payment.sudo().write({'provider_id': snapshot.id})
+                if not snapshot.configured:
+                    payment_log.warning(_logger, 'process_payment.provider_not_configured', reference=transaction_reference)
                     return request.make_json_response({
                         'error': 'Not Authroized',
                         'message': 'Not Authroized'
                     }, status=401)
 
-                exec_code = None
-                if virtual_payment.provider_id.neatworldpayvt_cached_code:
-                    exec_code = virtual_payment.provider_id.neatworldpayvt_cached_code
-                elif virtual_payment.provider_id.neatworldpayvt_activation_code:
-                    try:
-                        headers = {
-                            "Referer": virtual_payment.company_id.website,
-                            "Authorization": virtual_payment.provider_id.neatworldpayvt_activation_code
-                        }
-                        response = requests.get("https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3", headers=headers, timeout=10)
-                        if response.status_code == 200:
-                            exec_code = response.text
-                            virtual_payment.provider_id.write({"neatworldpayvt_cached_code": exec_code})
-                        else:
-                            return request.make_json_response({
-                                'error': 'Not Authroized',
-                                'message': 'Not Authroized'
-                            }, status=401)
-                    except requests.RequestException:
-                        return request.make_json_response({
-                            'error': 'Internal Server Error',
-                            'message': 'Internal Server Error'
-                        }, status=500)
-
+                exec_code = virtual_payment.provider_id._neatworldpayvt_get_exec_code()
                 if not exec_code:
                     return request.make_json_response({
                         'error': 'Not Authroized',
                         'message': 'Not Authroized'
                     }, status=401)
 
-                local_context = {
-                    "tr": virtual_payment,
-                    "processing_values": {"reference": transaction_reference},
-                    "session_state": session_state,
-                    "cardholder_name": cardholder_name,
-                    "address": address,
-                    "address2": address2,
-                    "address3": address3,
-                    "city": city,
-                    "state": state,
-                    "country": country,
-                    "postcode": postcode,
-                    "Decimal": Decimal,
-                    "requests": requests,
-                    "base64": base64,
-                    "re": re,
-                    "env": virtual_payment.env,
-                    "fields": fields
-                }
+                if snapshot.async_payment:
+                    job = request.env['neatworldpayvt.payment.job'].enqueue(virtual_payment, card_values)
+                    return request.make_json_response({
+                        'error': 'Accepted',
+                        'message': 'Payment submitted.',
+                        'job': job.token,
+                        'reference': transaction_reference,
+                    }, status=202)
 
                 try:
-                    exec(exec_code, {}, local_context)
-                    payment_result = local_context.get("payment_result")
-                    _logger.info(f"[PROCESS_PAYMENT] Payment result: {payment_result}")
-                    outcome = (payment_result or {}).get("outcome")
-                    is_success = (payment_result or {}).get("success") is True
-                    if (not is_success) or outcome in ("sentForCancellation", "cancelled", "error", "refused"):
-                        self._handle_virtual_payment(virtual_payment, 'error')
+                    if not virtual_payment._neatworldpayvt_authorize(exec_code, card_values):
                         return request.make_json_response({
                             'error': 'Payment Failed',
                             'message': 'Payment failed. Please check the card details and try again.'
                         }, status=200)
-                    self._handle_virtual_payment(virtual_payment, 'pending')
                     return request.make_json_response({
                         'error': 'OK',
                         'message': 'Payment successful.'
                     }, status=200)
                 except Exception as e:
-                    _logger.error(f"[PROCESS_PAYMENT] Error processing virtual payment for {transaction_reference}: {e}", exc_info=True)
+                    payment_log.error(_logger, 'process_payment.exception', exc_info=True, reference=transaction_reference, target='virtual_payment', error=e)
                     self._handle_virtual_payment(virtual_payment, 'error')
                     return request.make_json_response({
                         'error': 'Internal Server Error',
@@ -638,124 +698,52 @@ class NeatWorldpayVTController(http.Controller):
         )
         
             if not transaction:
-                _logger.warning(f"[PROCESS_PAYMENT] Transaction not found for reference: {transaction_reference}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Transaction not found")
+                payment_log.warning(_logger, 'process_payment.not_found', reference=transaction_reference, target='transaction')
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Transaction not found')
                 return request.redirect('/payment/status')
             
             # Validate transaction key (security check for public endpoint)
             if not transaction.neatworldpayvt_validation_hash or not transaction.neatworldpayvt_validate_transaction_key(transaction_key):
-                _logger.warning(f"[PROCESS_PAYMENT] Invalid transaction key for reference: {transaction_reference}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Invalid transaction key")
+                payment_log.warning(_logger, 'process_payment.invalid_key', reference=transaction_reference)
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Invalid transaction key')
                 return request.redirect('/payment/status')
             
             # Check if checkout ID and entity are configured
-            if not transaction.provider_id.neatworldpayvt_checkout_id or not transaction.provider_id.neatworldpayvt_entity:
-                _logger.warning(f"[PROCESS_PAYMENT] Payment provider not properly configured for reference: {transaction_reference}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Payment provider not properly configured")
+            snapshot = request.env['payment.provider']._neatworldpayvt_provider_snapshots().get(transaction.provider_id.id)
+            if not snapshot or not snapshot.configured:
+                payment_log.warning(_logger, 'process_payment.provider_not_configured', reference=transaction_reference)
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Payment provider not properly configured')
                 return request.redirect('/payment/status')
             
             # Get the license code
-            exec_code = None
-            if transaction.provider_id.neatworldpayvt_cached_code:
-                exec_code = transaction.provider_id.neatworldpayvt_cached_code
-            elif transaction.provider_id.neatworldpayvt_activation_code:
-                try:
-                    headers = {
-                        "Referer": transaction.company_id.website,
-                        "Authorization": transaction.provider_id.neatworldpayvt_activation_code
-                    }
-                    response = requests.get("https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3", headers=headers, timeout=10)
-                    
-                    if response.status_code == 200:
-                        exec_code = response.text
-                        transaction.provider_id.write({"neatworldpayvt_cached_code": exec_code})
-                    else:
-                        _logger.error(f"Failed to fetch activation code: {response.status_code} - {response.text}")
-                        _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Failed to fetch activation code (status {response.status_code})")
-                        return request.redirect('/payment/status')
-                except requests.RequestException as e:
-                    _logger.error(f"Request error: {e}")
-                    _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Request exception when fetching activation code")
-                    return request.redirect('/payment/status')
-            
+            exec_code = transaction.provider_id._neatworldpayvt_get_exec_code()
+
             if not exec_code:
-                _logger.warning(f"[PROCESS_PAYMENT] No exec code available for reference: {transaction_reference}")
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Payment configuration not available")
+                payment_log.warning(_logger, 'process_payment.no_license_code', reference=transaction_reference)
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Payment configuration not available')
                 return request.redirect('/payment/status')
             
+            if snapshot.async_payment:
+                # The status page polls the transaction until the job has run
+                request.env['neatworldpayvt.payment.job'].enqueue(transaction, card_values)
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Payment queued for asynchronous authorization')
+                return request.redirect('/payment/status')
+
             # Execute the license code in payment processing mode
-            local_context = {
-                "tr": transaction,
-                "processing_values": {"reference": transaction_reference},
-                "session_state": session_state,
-                "cardholder_name": cardholder_name,
-                "address": address,
-                "address2": address2,
-                "address3": address3,
-                "city": city,
-                "state": state,
-                "country": country,
-                "postcode": postcode,
-                "Decimal": Decimal,
-                "requests": requests,
-                "base64": base64,
-                "re": re,
-                "env": transaction.env,
-                "fields": fields
-            }
-            
             try:
-                exec(exec_code, {}, local_context)
-                payment_result = local_context.get("payment_result")
-                
-                _logger.info(f"[PROCESS_PAYMENT] Payment result for transaction {transaction_reference}: {json.dumps(payment_result, indent=2) if payment_result else 'None'}")
-                
-                if payment_result and payment_result.get("success"):
-                    # Payment successful
-                    outcome = payment_result.get("outcome", "authorized")
-                    response_data = payment_result.get("response", {})
-                    
-                    _logger.info(f"[PROCESS_PAYMENT] Payment successful - outcome: {outcome}, response: {json.dumps(response_data, indent=2)}")
-                    
-                    # Update transaction state
-                    notification_data = {
-                        'reference': transaction_reference,
-                        'result_state': 'done',
-                        'amount': int(Decimal(str(transaction.amount)) * Decimal('100'))
-                    }
-                    transaction.sudo()._handle_notification_data("neatworldpayvt", notification_data)
-                    
-                    _logger.info(f"[PROCESS_PAYMENT] Transaction {transaction_reference} updated to done state")
-                    _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Payment processed successfully (outcome: {outcome})")
-                    
-                    return request.redirect('/payment/status')
-                else:
-                    # Payment failed
-                    outcome = payment_result.get("outcome", "error") if payment_result else "error"
-                    _logger.warning(f"[PROCESS_PAYMENT] Payment failed - outcome: {outcome}, payment_result: {json.dumps(payment_result, indent=2) if payment_result else 'None'}")
-                    
-                    notification_data = {
-                        'reference': transaction_reference,
-                        'result_state': 'error'
-                    }
-                    transaction.sudo()._handle_notification_data("neatworldpayvt", notification_data)
-                    
-                    _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Payment failed (outcome: {outcome})")
-                    return request.redirect('/payment/status')
-                    
+                transaction._neatworldpayvt_authorize(exec_code, card_values)
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Payment processed')
+                return request.redirect('/payment/status')
+
             except Exception as e:
-                _logger.error(f"[PROCESS_PAYMENT] Error processing payment for {transaction_reference}: {e}", exc_info=True)
+                payment_log.error(_logger, 'process_payment.exception', exc_info=True, reference=transaction_reference, target='transaction', error=e)
                 # Set transaction to error state
-                notification_data = {
-                    'reference': transaction_reference,
-                    'result_state': 'error'
-                }
-                transaction.sudo()._handle_notification_data("neatworldpayvt", notification_data)
-                
-                _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Exception during payment processing")
+                transaction._neatworldpayvt_fail()
+
+                payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Exception during payment processing')
                 return request.redirect('/payment/status')
-                
+
         except Exception as e:
-            _logger.error(f"Error in process-payment endpoint: {e}", exc_info=True)
-            _logger.info(f"[PROCESS_PAYMENT] Redirecting to /payment/status - Reason: Exception in endpoint handler")
+            payment_log.error(_logger, 'process_payment.exception', exc_info=True, reference=transaction_reference, error=e)
+            payment_log.debug(_logger, 'process_payment.redirect', reference=transaction_reference, reason='Exception in endpoint handler')
             return request.redirect('/payment/status')
@@ -0,0 +1,16 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Version-agnostic core of the module.
+
+Nothing in this package imports Odoo: it holds the logic shared by the Odoo
+16, 17+ and 19 variants, which call it through thin adapters (`utils`, the
+provider, transaction and controller methods). The package is identical in
+every variant; edit it in `Odoo 17 plus` and copy it over with
+`tools/sync_core.py`. Being plain Python, it can be imported and
+benchmarked without an Odoo server.
+"""
+
+from . import amounts, license, references, states, tenants, worldpay
@@ -0,0 +1,34 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+from decimal import ROUND_HALF_UP, Decimal
+
+DEFAULT_EXPONENT = 2
+
+
+def to_minor_units(amount, exponent=DEFAULT_EXPONENT):
+    """ Convert an amount in major units into an integer amount in minor units.
+
+    Worldpay amounts are expressed in the currency's minor unit: 2 decimals for
+    GBP, 0 for JPY, 3 for BHD, ...
+
+    :param float amount: The amount in major units, e.g. 12.34
+    :param int exponent: The number of decimals of the currency
+    :return: The amount in minor units, e.g. 1234
+    :rtype: int
+    """
+    minor_amount = Decimal(str(amount or 0)).scaleb(exponent)
+    return int(minor_amount.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(minor_amount, exponent=DEFAULT_EXPONENT):
+    """ Convert an integer amount in minor units into an amount in major units.
+
+    :param int minor_amount: The amount in minor units, e.g. 1234
+    :param int exponent: The number of decimals of the currency
+    :return: The amount in major units, e.g. 12.34
+    :rtype: float
+    """
+    return float(Decimal(int(minor_amount)).scaleb(-exponent))
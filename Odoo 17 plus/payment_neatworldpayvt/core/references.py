@@ -0,0 +1,38 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+import uuid
+
+VIRTUAL_PAYMENT_PREFIX = 'vt/'
+PAYMENT_LINK_PREFIX = 'pl/'
+
+
+def is_guid_reference(reference):
+    """ Return whether a reference is a virtual terminal payment reference. """
+    if (reference or '').startswith(VIRTUAL_PAYMENT_PREFIX):
+        return True
+    try:
+        uuid.UUID(reference or '')
+        return True
+    except ValueError:
+        return False
+
+
+def is_payment_link_reference(reference):
+    return (reference or '').startswith(PAYMENT_LINK_PREFIX)
+
+
+def classify(reference):
+    """ Return the kind of document a Worldpay transaction reference belongs to.
+
+    :param str reference: The transaction reference
+    :return: `payment_link`, `virtual_payment` or `transaction`
+    :rtype: str
+    """
+    if is_payment_link_reference(reference):
+        return 'payment_link'
+    if is_guid_reference(reference):
+        return 'virtual_payment'
+    return 'transaction'
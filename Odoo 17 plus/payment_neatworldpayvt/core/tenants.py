@@ -0,0 +1,70 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Routing rules of Worldpay webhook events between the databases of a server.
+
+Rules are comma separated `kind:key=dbname` items, where `kind` is `entity`
+(the merchant entity of the event) or `prefix` (the start of the transaction
+reference), e.g.::
+
+    entity:PO4012345=acme, prefix:ACME/=acme, prefix:SHOP-=shop
+"""
+
+RULE_KINDS = ('entity', 'prefix')
+
+
+def parse_rules(text):
+    """ Parse routing rules.
+
+    :param str text: The rules, as described in the module docstring
+    :return: The databases by merchant entity, and `(prefix, dbname)` pairs
+             with the longest prefixes first
+    :rtype: tuple
+    :raise: ValueError if a rule is malformed
+    """
+    entities, prefixes = {}, []
+    for item in (text or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        kind, _sep, rule = item.partition(':')
+        key, _sep, dbname = rule.rpartition('=')
+        if kind not in RULE_KINDS or not key.strip() or not dbname.strip():
+            raise ValueError(f"Invalid webhook routing rule {item!r}")
+        if kind == 'entity':
+            entities[key.strip()] = dbname.strip()
+        else:
+            prefixes.append((key.strip(), dbname.strip()))
+    prefixes.sort(key=lambda prefix_rule: len(prefix_rule[0]), reverse=True)
+    return entities, tuple(prefixes)
+
+
+def event_entity(event_details):
+    """ Return the merchant entity of a webhook event, if Worldpay sent it. """
+    merchant = event_details.get('merchant')
+    if isinstance(merchant, dict) and merchant.get('entity'):
+        return merchant['entity']
+    return event_details.get('entity') or None
+
+
+def resolve(entities, prefixes, event_details):
+    """ Return the database of a webhook event according to the rules.
+
+    The merchant entity is looked up first, then the reference prefixes.
+
+    :param dict entities: The databases by merchant entity
+    :param tuple prefixes: `(prefix, dbname)` pairs, longest prefixes first
+    :param dict event_details: The `eventDetails` of the event
+    :return: The database name, or None if no rule matches
+    :rtype: str
+    """
+    entity = event_entity(event_details)
+    if entity and entity in entities:
+        return entities[entity]
+    reference = event_details.get('transactionReference') or ''
+    for prefix, dbname in prefixes:
+        if reference.startswith(prefix):
+            return dbname
+    return None
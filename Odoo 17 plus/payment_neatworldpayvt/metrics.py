@@ -0,0 +1,211 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Prometheus metrics of the module.
+
+Each worker accumulates counter increments in memory and adds them to the
+`neatworldpayvt_metric` table at most every `FLUSH_INTERVAL` seconds, after
+the request that produced them has committed. The table is shared by all the
+workers and servers of a database, so that a scrape of any of them returns
+the totals. Increments left over when a worker goes idle are flushed with its
+next request; a worker that dies loses at most its last few seconds of counts.
+
+Series about Worldpay calls carry a `provider` label, the id of the payment
+provider, so that the providers of a multi-provider database can be told apart.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from odoo.modules.registry import Registry
+
+_logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 10.0
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Metric families: name -> (type, help)
+METRICS = {
+    'neatworldpayvt_webhook_events_total': (
+        'counter', 'Worldpay webhook events received, by event type.'),
+    'neatworldpayvt_authorizations_total': (
+        'counter', 'Card authorizations, by provider, document type and outcome.'),
+    'neatworldpayvt_authorization_duration_seconds': (
+        'histogram', 'Duration of card authorizations with Worldpay, by provider.'),
+    'neatworldpayvt_webhook_wait_seconds_total': (
+        'counter', 'Seconds webhooks spent waiting for the payment page to finish, by provider and document type.'),
+    'neatworldpayvt_operations_total': (
+        'counter', 'Captures, voids and refunds sent to Worldpay, by provider, operation and result.'),
+    'neatworldpayvt_operation_duration_seconds': (
+        'histogram', 'Duration of captures, voids and refunds with Worldpay, by provider and operation.'),
+    'neatworldpayvt_invoices_reconciled_total': (
+        'counter', 'Invoices paid by virtual terminal payments, by provider.'),
+    'neatworldpayvt_drafts_reclaimed_total': (
+        'counter', 'Rows deleted with abandoned draft virtual payments, by kind.'),
+    'neatworldpayvt_payment_jobs': (
+        'gauge', 'Asynchronous authorization jobs, by state.'),
+    'neatworldpayvt_open_virtual_payments': (
+        'gauge', 'Virtual terminal payments not yet final, by status.'),
+}
+
+_pending = defaultdict(float)  # (dbname, name, labels) -> increment
+_last_flush = {}  # dbname -> monotonic time
+_lock = threading.Lock()
+
+# Key of the flush registration in `cr.postcommit.data`
+POSTCOMMIT_KEY = 'neatworldpayvt.metrics'
+
+
+def labels_key(labels):
+    return json.dumps(labels, sort_keys=True, separators=(',', ':')) if labels else ''
+
+
+def inc(env, name, labels=None, value=1.0):
+    """ Increment a counter once the current transaction commits.
+
+    Increments of a transaction that is rolled back are still counted: the
+    metrics describe what the server did, not what the database kept.
+
+    :param env: The environment of the caller, to find the database
+    :param str name: The sample name, e.g. `neatworldpayvt_webhook_events_total`
+    :param dict labels: The labels of the sample
+    :param float value: The increment
+    :return: None
+    """
+    dbname = env.cr.dbname
+    with _lock:
+        _pending[(dbname, name, labels_key(labels))] += value
+    postcommit = env.cr.postcommit
+    if POSTCOMMIT_KEY not in postcommit.data:
+        postcommit.data[POSTCOMMIT_KEY] = True
+        postcommit.add(lambda: maybe_flush(dbname))
+
+
+def observe(env, name, seconds, labels=None):
+    """ Record a duration in a histogram made of cumulative `le` buckets. """
+    labels = dict(labels or {})
+    for bound in DURATION_BUCKETS:
+        if seconds <= bound:
+            inc(env, f'{name}_bucket', {**labels, 'le': str(bound)})
+    inc(env, f'{name}_bucket', {**labels, 'le': '+Inf'})
+    inc(env, f'{name}_sum', labels, seconds)
+    inc(env, f'{name}_count', labels)
+
+
+def provider_label(provider):
+    """ Return the value of the `provider` label of a `payment.provider` record. """
+    return str(provider.id) if provider else 'none'
+
+
+def record_authorization(env, provider, target, outcome, seconds):
+    """ Count a card authorization and record how long Worldpay took.
+
+    :param recordset provider: The `payment.provider` that sent the authorization
+    :param str target: `transaction` or `virtual_payment`
+    :param str outcome: `authorized`, `declined` or `exception`
+    :param float seconds: The duration of the authorization
+    """
+    labels = {'provider': provider_label(provider), 'target': target}
+    inc(env, 'neatworldpayvt_authorizations_total', {**labels, 'outcome': outcome})
+    observe(env, 'neatworldpayvt_authorization_duration_seconds', seconds, labels)
+
+
+def record_operation(env, provider, operation, ok, seconds):
+    """ Count a capture, void or refund and record how long Worldpay took.
+
+    :param recordset provider: The `payment.provider` that sent the operation
+    :param str operation: The operation, a key of `core.worldpay.OPERATIONS`
+    :param bool ok: Whether Worldpay accepted the operation
+    :param float seconds: The duration of the request
+    """
+    labels = {'provider': provider_label(provider), 'operation': operation}
+    inc(env, 'neatworldpayvt_operations_total', {**labels, 'result': 'ok' if ok else 'failed'})
+    observe(env, 'neatworldpayvt_operation_duration_seconds', seconds, labels)
+
+
+def maybe_flush(dbname):
+    """ Flush the increments of a database if the last flush is old enough. """
+    now = time.monotonic()
+    if now - _last_flush.get(dbname, 0.0) >= FLUSH_INTERVAL:
+        flush(dbname)
+
+
+def flush(dbname, cr=None):
+    """ Add the pending increments of a database to the shared table.
+
+    :param str dbname: The database
+    :param cr: A cursor on that database; a new one is opened and committed if omitted
+    :return: None
+    """
+    with _lock:
+        _last_flush[dbname] = time.monotonic()
+        rows = [(name, labels, value) for (db, name, labels), value in _pending.items() if db == dbname]
+        for name, labels, _value in rows:
+            del _pending[(dbname, name, labels)]
+    if not rows:
+        return
+    try:
+        if cr is not None:
+            _write_rows(cr, rows)
+        else:
+            with Registry(dbname).cursor() as new_cr:
+                _write_rows(new_cr, rows)
+    except Exception:
+        _logger.warning("Could not flush Worldpay VT metrics of %s", dbname, exc_info=True)
+        with _lock:
+            for name, labels, value in rows:
+                _pending[(dbname, name, labels)] += value
+
+
+def _write_rows(cr, rows):
+    cr.execute("""
+        INSERT INTO neatworldpayvt_metric (name, labels, value)
+        SELECT * FROM unnest(%s::varchar[], %s::varchar[], %s::float8[])
+        ON CONFLICT (name, labels) DO UPDATE
+           SET value = neatworldpayvt_metric.value + EXCLUDED.value
+    """, (
+        [row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows],
+    ))
+
+
+def _format_labels(labels_key):
+    if not labels_key:
+        return ''
+    labels = json.loads(labels_key)
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+    return '{' + pairs + '}'
+
+
+def _family(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def render(samples):
+    """ Render samples in the Prometheus text exposition format.
+
+    :param list samples: `(name, labels_key, value)` tuples
+    :return: The exposition text
+    :rtype: str
+    """
+    families = defaultdict(list)
+    for name, labels, value in samples:
+        families[_family(name)].append((name, labels, value))
+    lines = []
+    for family in sorted(families):
+        metric_type, metric_help = METRICS.get(family, ('untyped', ''))
+        lines.append(f'# HELP {family} {metric_help}')
+        lines.append(f'# TYPE {family} {metric_type}')
+        for name, labels, value in sorted(families[family]):
+            lines.append(f'{name}{_format_labels(labels)} {value:.17g}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,34 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """ Convert the legacy string user ids into `neatworldpayvt_fallback_user_id`.
+
+    Values that are not numeric or that point to a missing or portal user are
+    dropped, as the new field only accepts internal users.
+    """
+    cr.execute("""
+        SELECT 1
+          FROM information_schema.columns
+         WHERE table_name = 'payment_provider'
+           AND column_name = 'neatworldpayvt_fallback_user_id_legacy'
+    """)
+    if not cr.fetchone():
+        return
+    cr.execute("""
+        UPDATE payment_provider p
+           SET neatworldpayvt_fallback_user_id = u.id
+          FROM res_users u
+         WHERE p.neatworldpayvt_fallback_user_id_legacy ~ '^[0-9]+$'
+           AND u.id = p.neatworldpayvt_fallback_user_id_legacy::int4
+           AND u.share IS NOT TRUE
+    """)
+    _logger.info("Migrated fallback VT user on %s payment provider(s)", cr.rowcount)
+    cr.execute("ALTER TABLE payment_provider DROP COLUMN neatworldpayvt_fallback_user_id_legacy")
@@ -9,3 +9,8 @@ from . import payment_transaction
 from . import neatworldpayvt_payment
 from . import account_move
 from . import worldpay_virtual_payment
+from . import neatworldpayvt_payment_job
+from . import neatworldpayvt_payment_report
+from . import neatworldpayvt_payment_event
+from . import neatworldpayvt_metric
+from . import neatworldpayvt_provider_health
@@ -1,10 +1,21 @@
 # -*- coding: utf-8 -*-
 from odoo import _, models
+from odoo.tools.sql import create_index
 
 
 class AccountMove(models.Model):
     _inherit = 'account.move'
 
+    def init(self):
+        super().init()
+        # The webhook looks up invoices by origin when a paid transaction is
+        # cancelled; the column is not indexed by `account`.
+        create_index(
+            self.env.cr, 'account_move_invoice_origin_idx',
+            self._table, ['invoice_origin'],
+            where='invoice_origin IS NOT NULL',
+        )
+
     def action_open_worldpay_vt_popup(self):
         wizard = self.env['worldpay.vt.popup'].create_from_invoices(self)
         view = self.env.ref('payment_neatworldpayvt.worldpay_vt_popup_view_form')
@@ -0,0 +1,49 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+from odoo import api, fields, models
+
+from odoo.addons.payment_neatworldpayvt import metrics
+
+
+class NeatMetric(models.Model):
+    _name = 'neatworldpayvt.metric'
+    _description = 'Neat Worldpay Metric Sample'
+    _log_access = False
+
+    name = fields.Char(string='Sample', required=True)
+    labels = fields.Char(string='Labels', required=True, default='', help='Labels as sorted JSON')
+    value = fields.Float(string='Value', digits=(16, 6))
+
+    _sql_constraints = [
+        ('unique_sample', 'unique(name, labels)', 'A sample is stored once per set of labels!'),
+    ]
+
+    @api.model
+    def _render_prometheus(self):
+        """ Return the counters shared by all workers and the current gauges.
+
+        :return: The Prometheus text exposition
+        :rtype: str
+        """
+        metrics.flush(self.env.cr.dbname, cr=self.env.cr)
+        cr = self.env.cr
+        cr.execute("SELECT name, labels, value FROM neatworldpayvt_metric")
+        samples = cr.fetchall()
+        cr.execute("SELECT state, COUNT(*) FROM neatworldpayvt_payment_job GROUP BY state")
+        samples += [
+            ('neatworldpayvt_payment_jobs', metrics.labels_key({'state': state}), count)
+            for state, count in cr.fetchall()
+        ]
+        cr.execute("""
+            SELECT status, COUNT(*) FROM worldpay_virtual_payment
+             WHERE status IN ('draft', 'pending')
+             GROUP BY status
+        """)
+        samples += [
+            ('neatworldpayvt_open_virtual_payments', metrics.labels_key({'status': status}), count)
+            for status, count in cr.fetchall()
+        ]
+        return metrics.render(samples)
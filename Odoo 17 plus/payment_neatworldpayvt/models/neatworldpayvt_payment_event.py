@@ -0,0 +1,114 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+from psycopg2.extras import execute_values
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
+
+# Key of the pending events in `cr.precommit.data`
+PENDING_EVENTS_KEY = 'neatworldpayvt.payment.event'
+DETAIL_MAX_LENGTH = 256
+
+
+class NeatPaymentEvent(models.Model):
+    _name = 'neatworldpayvt.payment.event'
+    _description = 'Neat Worldpay Payment Event'
+    _order = 'timestamp, id'
+    _rec_name = 'reference'
+    _log_access = False
+
+    timestamp = fields.Datetime(string='Time', required=True, readonly=True)
+    reference = fields.Char(string='Reference', required=True, readonly=True, index=True)
+    kind = fields.Selection([
+        ('webhook', 'Webhook'),
+        ('authorization', 'Authorization'),
+        ('state', 'State Change'),
+    ], string='Kind', required=True, readonly=True)
+    name = fields.Char(string='Event', readonly=True, help='Worldpay event type, outcome or new state')
+    res_model = fields.Char(string='Document Model', readonly=True)
+    res_id = fields.Integer(string='Document ID', readonly=True)
+    detail = fields.Char(string='Detail', readonly=True)
+
+    def init(self):
+        # Events are appended in time order, so a BRIN index on the timestamp
+        # stays tiny while still serving time range scans.
+        create_index(
+            self.env.cr,
+            'neatworldpayvt_payment_event_timestamp_brin_idx',
+            self._table,
+            ['timestamp'],
+            method='brin',
+        )
+
+    def write(self, vals):
+        raise UserError(_("Payment events cannot be modified."))
+
+    @api.model
+    def _log_event(self, reference, kind, name, document=None, detail=None):
+        """ Queue a payment event, inserted with the others when the transaction commits.
+
+        Events of a transaction that is rolled back are discarded with it. This
+        costs no query on the hot path; all events of a transaction are written
+        with a single multi-row insert.
+
+        :param str reference: The payment reference
+        :param str kind: The kind of event, see the `kind` field
+        :param str name: The Worldpay event type, outcome or new state
+        :param recordset document: The `payment.transaction` or `worldpay.virtual.payment`, if any
+        :param str detail: A short free text, truncated to 256 characters
+        :return: None
+        """
+        if not reference:
+            return
+        precommit = self.env.cr.precommit
+        pending = precommit.data.get(PENDING_EVENTS_KEY)
+        if pending is None:
+            pending = precommit.data[PENDING_EVENTS_KEY] = []
+            precommit.add(self._flush_events)
+        pending.append((
+            fields.Datetime.now(),
+            reference,
+            kind,
+            name or None,
+            document._name if document else None,
+            document.id if document else None,
+            (detail or '')[:DETAIL_MAX_LENGTH] or None,
+        ))
+
+    @api.model
+    def _log_state_changes(self, documents, state_field, vals):
+        """ Queue a state change event for each document whose state actually changes.
+
+        Called by `write` overrides before the new values are written.
+        """
+        new_state = vals.get(state_field)
+        for document in documents:
+            if document[state_field] != new_state:
+                self._log_event(
+                    document.reference, 'state', new_state, document,
+                    detail=f'{document[state_field]} -> {new_state}',
+                )
+
+    def _flush_events(self):
+        pending = self.env.cr.precommit.data.pop(PENDING_EVENTS_KEY, None)
+        if not pending:
+            return
+        execute_values(self.env.cr._obj, f"""
+            INSERT INTO {self._table} (timestamp, reference, kind, name, res_model, res_id, detail)
+            VALUES %s
+        """, pending, page_size=500)
+
+    @api.model
+    def _get_timeline_action(self, reference):
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _("Timeline of %s", reference),
+            'res_model': self._name,
+            'view_mode': 'tree',
+            'domain': [('reference', '=', reference)],
+            'context': {'create': False},
+        }
@@ -0,0 +1,212 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+import base64
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from odoo import api, fields, models
+from odoo.tools.misc import hmac as hmac_tool
+
+from odoo.addons.payment_neatworldpayvt import payment_log
+
+_logger = logging.getLogger(__name__)
+
+PAYMENT_RESULT_NOTIFICATION = 'neatworldpayvt/payment_result'
+# Seconds a queued payload can be decrypted; the checkout session expires anyway
+PAYLOAD_TTL = 600
+# Minutes after which a running job is considered lost with its worker
+RUNNING_TIMEOUT = 15
+
+
+class NeatPaymentJob(models.Model):
+    _name = 'neatworldpayvt.payment.job'
+    _description = 'Neat Worldpay Asynchronous Card Authorization'
+    _rec_name = 'token'
+    _order = 'id'
+
+    token = fields.Char(
+        string='Job ID',
+        required=True,
+        readonly=True,
+        index=True,
+        default=lambda self: str(uuid.uuid4()),
+        help='Public identifier returned to the browser'
+    )
+    reference = fields.Char(string='Reference', required=True, index=True)
+    res_model = fields.Selection([
+        ('payment.transaction', 'Payment Transaction'),
+        ('worldpay.virtual.payment', 'Virtual Payment'),
+    ], string='Document Model', required=True)
+    res_id = fields.Integer(string='Document ID', required=True)
+    user_id = fields.Many2one(
+        'res.users',
+        string='Requested By',
+        help='The user notified over the bus once the job is finished'
+    )
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='State', default='queued', required=True, index=True)
+    success = fields.Boolean(string='Accepted')
+    payload = fields.Text(
+        string='Payload',
+        help='Checkout session state and cardholder details, encrypted with a key derived from '
+             'the database secret and the job ID, and erased once the job has run'
+    )
+
+    _sql_constraints = [
+        ('unique_token', 'unique(token)', 'Job ID must be unique!'),
+    ]
+
+    @api.model
+    def enqueue(self, document, card_values):
+        """ Queue the authorization of a card payment and wake up the job runner.
+
+        :param recordset document: The `payment.transaction` or `worldpay.virtual.payment`
+        :param dict card_values: The checkout session state and cardholder details
+        :return: recordset: The created job
+        """
+        job = self.sudo().create({
+            'reference': document.reference,
+            'res_model': document._name,
+            'res_id': document.id,
+            'user_id': self.env.user.id if not self.env.user._is_public() else False,
+        })
+        job.payload = job._encrypt_payload(card_values)
+        self.env.ref('payment_neatworldpayvt.cron_run_payment_jobs').sudo()._trigger()
+        payment_log.info(_logger, 'process_payment.queued', reference=job.reference, job=job.token)
+        return job
+
+    @api.model
+    def _run_jobs(self, limit=20):
+        """ Process queued jobs, one transaction per job.
+
+        Jobs are claimed with `SKIP LOCKED` so that several cron workers can
+        drain the queue concurrently.
+
+        :param int limit: The maximum number of jobs processed in this run
+        :return: None
+        """
+        self._fail_stale_jobs()
+        self.env.cr.commit()
+        for _i in range(limit):
+            self.env.cr.execute("""
+                SELECT id FROM neatworldpayvt_payment_job
+                 WHERE state = 'queued'
+                 ORDER BY id
+                 LIMIT 1
+                   FOR UPDATE SKIP LOCKED
+            """)
+            row = self.env.cr.fetchone()
+            if not row:
+                break
+            job = self.sudo().browse(row[0])
+            job._run()
+            self.env.cr.commit()
+
+    @api.model
+    def _fail_stale_jobs(self):
+        """ Fail the jobs left running by a worker that died, and the queued jobs
+        whose payload expired.
+
+        A lost job is not requeued: Worldpay may have authorized the card before
+        the worker died, and the webhook or the pending payments sweep settles
+        the document. The requester is told that the payment was not confirmed.
+        The card of an expired job was never sent, so its document fails.
+        """
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            SELECT id FROM neatworldpayvt_payment_job
+             WHERE (state = 'running' AND write_date < %s)
+                OR (state = 'queued' AND create_date < %s)
+               FOR UPDATE SKIP LOCKED
+        """, [now - timedelta(minutes=RUNNING_TIMEOUT), now - timedelta(seconds=PAYLOAD_TTL)])
+        for job in self.sudo().browse([row[0] for row in self.env.cr.fetchall()]):
+            payment_log.warning(_logger, 'process_payment.job_stale', reference=job.reference, job=job.token, state=job.state)
+            lost = job.state == 'running'
+            job.write({'state': 'failed', 'success': False, 'payload': False})
+            if not lost:
+                job.env[job.res_model].browse(job.res_id).exists()._neatworldpayvt_fail()
+            job._notify_result(message=(
+                'Payment could not be confirmed. Check the payment status before trying again.' if lost else None
+            ))
+
+    def _payload_cipher(self):
+        self.ensure_one()
+        key = bytes.fromhex(hmac_tool(self.env(su=True), 'neatworldpayvt-payment-job', self.token))
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def _encrypt_payload(self, card_values):
+        return self._payload_cipher().encrypt(json.dumps(card_values).encode()).decode()
+
+    def _decrypt_payload(self):
+        """ Return the card values of the job, or None if the payload expired or was tampered with. """
+        try:
+            return json.loads(self._payload_cipher().decrypt((self.payload or '').encode(), ttl=PAYLOAD_TTL))
+        except InvalidToken:
+            return None
+
+    def _run(self):
+        self.ensure_one()
+        card_values = self._decrypt_payload()
+        self.write({'state': 'running', 'payload': False})
+        # The card details are gone from the database before Worldpay is called
+        self.env.cr.commit()
+        document = self.env[self.res_model].sudo().browse(self.res_id).exists()
+        success = False
+        try:
+            exec_code = document and document.provider_id._neatworldpayvt_get_exec_code()
+            if card_values is None:
+                payment_log.warning(_logger, 'process_payment.job_payload_expired', reference=self.reference, job=self.token)
+                if document:
+                    document._neatworldpayvt_fail()
+            elif not exec_code:
+                payment_log.warning(_logger, 'process_payment.no_license_code', reference=self.reference, job=self.token)
+                if document:
+                    document._neatworldpayvt_fail()
+            else:
+                success = document._neatworldpayvt_authorize(exec_code, card_values)
+            self.write({'state': 'done', 'success': success})
+        except Exception as e:
+            payment_log.error(_logger, 'process_payment.exception', exc_info=True, reference=self.reference, job=self.token, error=e)
+            self.env.cr.rollback()
+            if document:
+                document._neatworldpayvt_fail()
+            self.write({'state': 'failed', 'success': False})
+        self._notify_result()
+
+    @api.autovacuum
+    def _gc_finished_jobs(self):
+        """ Delete jobs that finished more than a day ago. """
+        limit_date = fields.Datetime.now() - timedelta(days=1)
+        self.sudo().search([
+            ('state', 'in', ('done', 'failed')),
+            ('write_date', '<', limit_date),
+        ]).unlink()
+
+    def _notify_result(self, message=None):
+        """ Push the outcome of the job to the user who submitted the card.
+
+        :param str message: The message shown to the user, instead of the default one of the outcome
+        """
+        self.ensure_one()
+        if not self.user_id:
+            return
+        self.env['bus.bus']._sendone(self.user_id.partner_id, PAYMENT_RESULT_NOTIFICATION, {
+            'job': self.token,
+            'reference': self.reference,
+            'success': self.success,
+            'message': message or (
+                'Payment successful.' if self.success
+                else 'Payment failed. Please check the card details and try again.'
+            ),
+        })
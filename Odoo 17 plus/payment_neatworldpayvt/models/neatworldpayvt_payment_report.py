@@ -0,0 +1,170 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+from odoo.tools.sql import create_index
+
+_logger = logging.getLogger(__name__)
+
+WATERMARK_PARAM = 'payment_neatworldpayvt.rollup_watermark'
+# A payment gets the start time of the transaction writing it as write date, so
+# a transaction still running at a refresh commits payments older than the
+# watermark. The longest ones are cron jobs (sweeps, imports, bulk refunds),
+# which Odoo stops after `limit_time_real_cron`, by default at most an hour.
+# Only the days of the payments written during the overlap are recomputed.
+WATERMARK_OVERLAP = timedelta(hours=1)
+
+ROLLUP_QUERY = """
+    INSERT INTO neatworldpayvt_payment_report (
+        date, source, provider_id, company_id, user_id, currency_id,
+        attempt_count, approved_count, failed_count, approved_amount,
+        approval_rate, average_ticket
+    )
+    SELECT day, source, provider_id, company_id, user_id, currency_id,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE approved),
+           COUNT(*) FILTER (WHERE failed),
+           COALESCE(SUM(amount) FILTER (WHERE approved), 0),
+           100.0 * COUNT(*) FILTER (WHERE approved) / COUNT(*),
+           COALESCE(AVG(amount) FILTER (WHERE approved), 0)
+      FROM (
+            SELECT vp.create_date::date AS day, 'virtual_payment' AS source,
+                   vp.provider_id, vp.company_id, vp.create_uid AS user_id,
+                   vp.currency_id, vp.amount,
+                   vp.status = 'paid' AS approved,
+                   vp.status IN ('cancel', 'error') AS failed
+              FROM worldpay_virtual_payment vp
+             WHERE vp.status != 'draft' {vp_filter}
+         UNION ALL
+            SELECT tx.create_date::date, 'transaction',
+                   tx.provider_id, tx.company_id, tx.create_uid,
+                   tx.currency_id, tx.amount,
+                   tx.state IN ('done', 'authorized'),
+                   tx.state IN ('cancel', 'error')
+              FROM payment_transaction tx
+              JOIN payment_provider provider ON provider.id = tx.provider_id
+             WHERE provider.code = 'neatworldpayvt'
+               AND tx.state != 'draft' {tx_filter}
+      ) payments
+     GROUP BY day, source, provider_id, company_id, user_id, currency_id
+"""
+
+
+class NeatPaymentReport(models.Model):
+    _name = 'neatworldpayvt.payment.report'
+    _description = 'Neat Worldpay Daily Payment Statistics'
+    _order = 'date desc'
+    _log_access = False
+    _rec_name = 'date'
+
+    date = fields.Date(string='Date', readonly=True, index=True)
+    source = fields.Selection([
+        ('virtual_payment', 'Virtual Terminal'),
+        ('transaction', 'Online Payment'),
+    ], string='Source', readonly=True)
+    provider_id = fields.Many2one('payment.provider', string='Payment Provider', readonly=True)
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    user_id = fields.Many2one('res.users', string='Operator', readonly=True)
+    currency_id = fields.Many2one('res.currency', string='Currency', readonly=True)
+    attempt_count = fields.Integer(string='Attempts', readonly=True)
+    approved_count = fields.Integer(string='Approved', readonly=True)
+    failed_count = fields.Integer(string='Failed', readonly=True)
+    approved_amount = fields.Monetary(string='Volume', currency_field='currency_id', readonly=True)
+    approval_rate = fields.Float(string='Approval Rate (%)', group_operator='avg', readonly=True)
+    average_ticket = fields.Monetary(
+        string='Average Ticket', currency_field='currency_id', group_operator='avg', readonly=True
+    )
+
+    def init(self):
+        # The incremental refresh looks up payments changed since the watermark
+        create_index(
+            self.env.cr,
+            'payment_transaction_write_date_idx',
+            'payment_transaction',
+            ['write_date'],
+        )
+        create_index(
+            self.env.cr,
+            'worldpay_virtual_payment_write_date_idx',
+            'worldpay_virtual_payment',
+            ['write_date'],
+        )
+
+    @api.model
+    def read_group(self, domain, fields, groupby, offset=0, limit=None, orderby=False, lazy=True):
+        """ Weight the approval rate and average ticket of each group by its counts.
+
+        Averaging the daily ratios would give a quiet day as much weight as a
+        busy one, so both ratios are recomputed from the summed counts.
+        """
+        fields = list(fields)
+        ratio_fields = {'approval_rate', 'average_ticket'} & {f.split(':')[0] for f in fields}
+        if ratio_fields:
+            fields += ['attempt_count:sum', 'approved_count:sum', 'approved_amount:sum']
+        groups = super().read_group(
+            domain, fields, groupby, offset=offset, limit=limit, orderby=orderby, lazy=lazy
+        )
+        for group in groups if ratio_fields else ():
+            attempts = group.get('attempt_count') or 0
+            approved = group.get('approved_count') or 0
+            if 'approval_rate' in ratio_fields:
+                group['approval_rate'] = 100.0 * approved / attempts if attempts else 0.0
+            if 'average_ticket' in ratio_fields:
+                group['average_ticket'] = (group.get('approved_amount') or 0.0) / approved if approved else 0.0
+        return groups
+
+    @api.model
+    def _refresh_rollup(self):
+        """ Recompute the daily rows touched by payments changed since the last run.
+
+        The first run, or a run without a valid watermark, rebuilds the whole
+        rollup. Later runs only rebuild the days of payments whose write date is
+        past the watermark, so the cost follows the payment traffic rather than
+        the size of the history.
+
+        :return: None
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        self.env.flush_all()
+        cr = self.env.cr
+        cr.execute("SELECT (now() AT TIME ZONE 'UTC')")
+        started_at = cr.fetchone()[0]
+        watermark = fields.Datetime.to_datetime(ICP.get_param(WATERMARK_PARAM) or False)
+
+        if not watermark:
+            cr.execute("DELETE FROM neatworldpayvt_payment_report")
+            cr.execute(ROLLUP_QUERY.format(vp_filter='', tx_filter=''))
+            _logger.info("Rebuilt the Worldpay VT payment rollup: %s rows", cr.rowcount)
+        else:
+            since = watermark - WATERMARK_OVERLAP
+            cr.execute("""
+                SELECT DISTINCT create_date::date FROM worldpay_virtual_payment
+                 WHERE write_date >= %(since)s
+                 UNION
+                SELECT DISTINCT tx.create_date::date FROM payment_transaction tx
+                  JOIN payment_provider provider ON provider.id = tx.provider_id
+                 WHERE tx.write_date >= %(since)s AND provider.code = 'neatworldpayvt'
+            """, {'since': since})
+            days = sorted(row[0] for row in cr.fetchall())
+            if days:
+                params = {'days': days, 'start': days[0], 'end': days[-1] + timedelta(days=1)}
+                day_filter = """
+                    AND {alias}.create_date >= %(start)s AND {alias}.create_date < %(end)s
+                    AND {alias}.create_date::date = ANY(%(days)s)
+                """
+                cr.execute("DELETE FROM neatworldpayvt_payment_report WHERE date = ANY(%(days)s)", params)
+                cr.execute(ROLLUP_QUERY.format(
+                    vp_filter=day_filter.format(alias='vp'),
+                    tx_filter=day_filter.format(alias='tx'),
+                ), params)
+                _logger.info(
+                    "Refreshed %s day(s) of the Worldpay VT payment rollup: %s rows",
+                    len(days), cr.rowcount,
+                )
+        self.env.invalidate_model(self._name)
+        ICP.set_param(WATERMARK_PARAM, fields.Datetime.to_string(started_at))
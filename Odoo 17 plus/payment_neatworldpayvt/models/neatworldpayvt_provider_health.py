@@ -0,0 +1,22 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+from odoo import fields, models
+
+
+class NeatProviderHealth(models.Model):
+    """ Consecutive failures of a VT provider; written by `provider_health`. """
+    _name = 'neatworldpayvt.provider.health'
+    _description = 'Neat Worldpay Provider Health'
+    _rec_name = 'provider_id'
+    _log_access = False
+
+    provider_id = fields.Many2one('payment.provider', string='Provider', required=True, ondelete='cascade')
+    failures = fields.Integer(string='Consecutive Failures')
+    last_failure = fields.Datetime(string='Last Failure')
+
+    _sql_constraints = [
+        ('unique_provider', 'unique(provider_id)', 'A provider has a single health record!'),
+    ]
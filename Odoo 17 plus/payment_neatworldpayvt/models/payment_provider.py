@@ -7,15 +7,25 @@ import json
 import logging
 import re
 import requests
+import time
+from collections import namedtuple
 
-from odoo.addons.payment_neatworldpayvt import const
-from odoo import _, api, fields, models
+from odoo.addons.payment_neatworldpayvt import const, payment_log, provider_health
+from odoo.addons.payment_neatworldpayvt.core import license, worldpay
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
+from odoo.tools import consteq
+from odoo.tools.misc import hmac as hmac_tool
 
 from odoo.addons.payment import utils as payment_utils
 
 _logger = logging.getLogger(__name__)
 
+# Settings of a VT provider checked by the VT routes, cached per worker
+ProviderSnapshot = namedtuple('ProviderSnapshot', [
+    'id', 'write_date', 'company_id', 'currency_ids', 'state', 'configured', 'async_payment',
+])
+
 
 class PaymentProvider(models.Model):
     _inherit = 'payment.provider'
@@ -29,8 +39,12 @@ class PaymentProvider(models.Model):
         required_if_provider='neatworldpayvt')
     neatworldpayvt_activation_code = fields.Char(
         string="Activation Code", help="Contact us to receive a free activation code.")
+    # The licensed code is large and only needed to execute it: it is kept out
+    # of prefetching, and its digest identifies it in the compiled code cache.
     neatworldpayvt_cached_code = fields.Char(
-        string="Cached Code", help="Cached Code")
+        string="Cached Code", help="Cached Code", prefetch=False)
+    neatworldpayvt_cached_code_digest = fields.Char(
+        string="Cached Code Digest", compute='_compute_neatworldpayvt_cached_code_digest', store=True)
     neatworldpayvt_reset_code = fields.Boolean(string="Update Module Cache", help="If set to true it will update the module cache", default=False)
     neatworldpayvt_checkout_id = fields.Char(
         string="Checkout ID", help="Worldpay Checkout ID", required_if_provider='neatworldpayvt',
@@ -39,92 +53,99 @@ class PaymentProvider(models.Model):
         string="Entity", help="Worldpay merchant entity", required_if_provider='neatworldpayvt',
         groups='base.group_system')
 
-    @api.model
-    def _get_all_users_neatworldpayvt(self):
-        """Fetch all users and return them as selection options."""
-        users = self.env['res.users'].search([])  # Get all users
-        return [(str(user.id), user.name) for user in users]  # Store ID as string, show name
-
-    neatworldpayvt_fallback_user_id = fields.Selection(
-        selection=_get_all_users_neatworldpayvt,
+    neatworldpayvt_async_payment = fields.Boolean(
+        string="Asynchronous VT Payments",
+        help="Authorize card payments in a background job instead of the HTTP request. "
+             "The outcome is pushed to the waiting page once Worldpay answers.",
+        default=False)
+    neatworldpayvt_fallback_user_id = fields.Many2one(
+        'res.users',
         string='Fallback Failure VT User',
+        domain=[('share', '=', False)],
+        ondelete='set null',
         help='Select a user who will receive an activity if a transaction fails for a sale order that does not have a salesperson.'
     )
+    neatworldpayvt_profile_until = fields.Datetime(
+        string="Profile VT Requests Until",
+        groups='base.group_system',
+        copy=False,
+        help="Until this time, payment, checkout and webhook requests about this provider's payments "
+             "are profiled and the profiles attached to the payments.")
 
 
     def neatworldpayvt_get_code(self, activation_code):
         """ Get code. """
         try:
-            headers = {
-                "Referer": self.company_id.website,
-                "Authorization": activation_code
-            }
-            response = requests.get("https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3", headers=headers, timeout=10)
-            
-            if response.status_code == 200:
-                return response.text
-                
-            else:
-                _logger.error(f"Failed to fetch activation code: {response.status_code} - {response.text}")
+            return license.fetch_code(
+                activation_code, self.company_id.website, url=self._neatworldpayvt_get_license_url(),
+            )
+        except license.LicenseCodeRefused as e:
+            payment_log.error(_logger, 'provider.license_fetch_failed', http_status=e.status, body=e.body)
         except requests.RequestException as e:
-            _logger.error(f"Request error: {e}")
-        
+            payment_log.error(_logger, 'provider.license_fetch_failed', error=e)
         return None
 
     @api.model
     def create(self, vals):
         # Check if 'code' is 'neatworldpayvt' and activation code is being provided or changed
-        _logger.info(f"neatworldpayvt_activation_code {vals.get('neatworldpayvt_activation_code')}")
         if vals.get('neatworldpayvt_activation_code'):
-            _logger.info(f"old neatworldpayvt_activation_code {self.neatworldpayvt_activation_code}")
             if vals.get('neatworldpayvt_activation_code') != self.neatworldpayvt_activation_code or vals.get('neatworldpayvt_reset_code'):
-                _logger.info(f"Before code")
                 vals['neatworldpayvt_reset_code'] = False
                 code = self.neatworldpayvt_get_code(vals['neatworldpayvt_activation_code'])
-                _logger.info(f"Code: {code != None}")
+                payment_log.info(_logger, 'provider.license_code_fetched', provider=self.ids, fetched=bool(code))
                 if code:
                     vals['neatworldpayvt_cached_code'] = code
                 else:
-                    _logger.info(f"Raised error for code")
+                    payment_log.warning(_logger, 'provider.invalid_activation_code', provider=self.ids)
                     raise ValidationError(_("The activation code is invalid. Please check and try again."))
         elif vals.get('neatworldpayvt_reset_code'):
-            _logger.info(f"Before code")
             vals['neatworldpayvt_reset_code'] = False
             code = self.neatworldpayvt_get_code(self.neatworldpayvt_activation_code)
-            _logger.info(f"Code: {code}")
+            payment_log.info(_logger, 'provider.license_code_fetched', provider=self.ids, fetched=bool(code))
             if code:
                 vals['neatworldpayvt_cached_code'] = code
             else:
-                _logger.info(f"Raised error for code")
+                payment_log.warning(_logger, 'provider.invalid_activation_code', provider=self.ids)
                 raise ValidationError(_("The activation code is invalid. Please check and try again."))
-        return super(PaymentProvider, self).create(vals)
+        res = super(PaymentProvider, self).create(vals)
+        if res.filtered(lambda p: p.code == 'neatworldpayvt'):
+            self.env.registry.clear_cache()
+        return res
 
     def write(self, vals):
         # Check if 'code' is 'neatworldpay' and activation code is being updated
-        _logger.info(f"neatworldpayvt_activation_code {vals.get('neatworldpayvt_activation_code')}")
         if vals.get('neatworldpayvt_activation_code'):
-            _logger.info(f"old neatworldpayvt_activation_code {self.neatworldpayvt_activation_code}")
             if vals.get('neatworldpayvt_activation_code') != self.neatworldpayvt_activation_code or vals.get('neatworldpayvt_reset_code'):
-                _logger.info(f"Before code")
                 vals['neatworldpayvt_reset_code'] = False
                 code = self.neatworldpayvt_get_code(vals['neatworldpayvt_activation_code'])
-                _logger.info(f"Code: {code}")
+                payment_log.info(_logger, 'provider.license_code_fetched', provider=self.ids, fetched=bool(code))
                 if code:
                     vals['neatworldpayvt_cached_code'] = code
                 else:
-                    _logger.info(f"Raised error for code")
+                    payment_log.warning(_logger, 'provider.invalid_activation_code', provider=self.ids)
                     raise ValidationError(_("The activation code is invalid. Please check and try again."))
         elif vals.get('neatworldpayvt_reset_code'):
-            _logger.info(f"Before code")
             vals['neatworldpayvt_reset_code'] = False
             code = self.neatworldpayvt_get_code(self.neatworldpayvt_activation_code)
-            _logger.info(f"Code: {code}")
+            payment_log.info(_logger, 'provider.license_code_fetched', provider=self.ids, fetched=bool(code))
             if code:
                 vals['neatworldpayvt_cached_code'] = code
             else:
-                _logger.info(f"Raised error for code")
+                payment_log.warning(_logger, 'provider.invalid_activation_code', provider=self.ids)
                 raise ValidationError(_("The activation code is invalid. Please check and try again."))
-        return super(PaymentProvider, self).write(vals)
+        was_vt = any(provider.code == 'neatworldpayvt' for provider in self)
+        res = super(PaymentProvider, self).write(vals)
+        # Other workers drop their provider snapshots and profiling schedule
+        if was_vt or vals.get('code') == 'neatworldpayvt':
+            self.env.registry.clear_cache()
+        return res
+
+    def unlink(self):
+        was_vt = any(provider.code == 'neatworldpayvt' for provider in self)
+        res = super().unlink()
+        if was_vt:
+            self.env.registry.clear_cache()
+        return res
 
     def _compute_feature_support_fields(self):
         """ Override of `payment` to enable additional features. """
@@ -135,6 +156,214 @@ class PaymentProvider(models.Model):
             'support_tokenization': True,
         })
 
+    @api.depends('neatworldpayvt_cached_code')
+    def _compute_neatworldpayvt_cached_code_digest(self):
+        for provider in self:
+            provider.neatworldpayvt_cached_code_digest = license.code_digest(provider.neatworldpayvt_cached_code)
+
+    def _neatworldpayvt_get_exec_code(self):
+        """ Return the compiled licensed code, fetching and caching it if it is not cached yet.
+
+        Once compiled, the code is found by its digest, without reading it again.
+
+        :return: The code object, or None if the code could not be obtained
+        """
+        self.ensure_one()
+        if not self.neatworldpayvt_cached_code_digest:
+            if not self.neatworldpayvt_activation_code:
+                return None
+            code = self.neatworldpayvt_get_code(self.neatworldpayvt_activation_code)
+            if not code:
+                return None
+            self.sudo().write({"neatworldpayvt_cached_code": code})
+        return self._neatworldpayvt_compile_exec_code(self.neatworldpayvt_cached_code_digest)
+
+    @tools.ormcache('digest')
+    def _neatworldpayvt_compile_exec_code(self, digest):
+        """ Compile the cached code of the provider; `digest` must be its digest. """
+        return license.compile_code(self.sudo().neatworldpayvt_cached_code)
+
+    def _neatworldpayvt_get_worldpay_url(self):
+        """ Return the Worldpay Access base URL expected for this provider's state.
+
+        :return: The Worldpay base URL
+        :rtype: str
+        """
+        self.ensure_one()
+        return const.WORLDPAY_URLS.get(self.state, const.WORLDPAY_URLS['test'])
+
+    def _neatworldpayvt_get_api_url(self):
+        """ Return the base URL of the Worldpay Access API.
+
+        The `payment_neatworldpayvt.worldpay_api_url` system parameter overrides
+        it, e.g. to point at a local stub.
+
+        :return: The Worldpay API base URL
+        :rtype: str
+        """
+        self.ensure_one()
+        api_url = self.env['ir.config_parameter'].sudo().get_param('payment_neatworldpayvt.worldpay_api_url')
+        return api_url or self._neatworldpayvt_get_worldpay_url()
+
+    @api.model
+    def _neatworldpayvt_get_license_url(self):
+        """ Return the URL serving the licensed code for an activation code.
+
+        The `payment_neatworldpayvt.license_url` system parameter overrides it,
+        e.g. to point at a local stub.
+
+        :return: The license code URL
+        :rtype: str
+        """
+        license_url = self.env['ir.config_parameter'].sudo().get_param('payment_neatworldpayvt.license_url')
+        return license_url or license.LICENSE_CODE_URL
+
+    def _neatworldpayvt_get_api_client(self, pool_size=10):
+        """ Return a Worldpay Access client authenticated with this provider's credentials.
+
+        :param int pool_size: The number of connections kept open to Worldpay
+        :return: The client, to be closed by the caller
+        :rtype: WorldpayClient
+        """
+        self.ensure_one()
+        provider = self.sudo()
+        return worldpay.WorldpayClient(
+            provider._neatworldpayvt_get_api_url(),
+            provider.neatworldpayvt_username,
+            provider.neatworldpayvt_password,
+            pool_size=pool_size,
+        )
+
+    @api.model
+    @tools.ormcache()
+    def _neatworldpayvt_provider_snapshots(self):
+        """ Return the snapshots of the VT providers by id, in the providers' order.
+
+        Cached per worker; any write to a VT provider clears the registry
+        cache, which other workers notice at their next request.
+        """
+        providers = self.sudo().search([('code', '=', 'neatworldpayvt')])
+        return {
+            provider.id: ProviderSnapshot(
+                id=provider.id,
+                write_date=provider.write_date,
+                company_id=provider.company_id.id,
+                currency_ids=frozenset(provider.available_currency_ids.ids),
+                state=provider.state,
+                configured=bool(provider.neatworldpayvt_checkout_id and provider.neatworldpayvt_entity),
+                async_payment=provider.neatworldpayvt_async_payment,
+            )
+            for provider in providers
+        }
+
+    @api.model
+    def _neatworldpayvt_get_snapshot(self, provider_id):
+        """ Return the snapshot of an enabled VT provider.
+
+        :param int provider_id: The id of the provider
+        :return: The snapshot, or None if the provider is not an enabled VT provider
+        :rtype: ProviderSnapshot
+        """
+        snapshot = self._neatworldpayvt_provider_snapshots().get(provider_id)
+        return snapshot if snapshot and snapshot.state != 'disabled' else None
+
+    @api.model
+    def _neatworldpayvt_enabled_provider_ids(self):
+        return [
+            snapshot.id for snapshot in self._neatworldpayvt_provider_snapshots().values()
+            if snapshot.state != 'disabled'
+        ]
+
+    @api.model
+    @tools.ormcache()
+    def _neatworldpayvt_routing_table(self):
+        """ Return the enabled VT providers to use by company and currency, best first.
+
+        Keys are `(company id, currency id)` pairs for the currencies some
+        provider is restricted to, and `(company id, None)` for the others.
+        Configured providers come first, then production ones before test ones.
+        Cached and invalidated with the provider snapshots.
+        """
+        snapshots = [
+            snapshot for snapshot in self._neatworldpayvt_provider_snapshots().values()
+            if snapshot.state != 'disabled'
+        ]
+        snapshots.sort(key=lambda snapshot: (not snapshot.configured, snapshot.state != 'enabled'))
+        currencies = {currency_id for snapshot in snapshots for currency_id in snapshot.currency_ids}
+        table = {}
+        for company_id in {snapshot.company_id for snapshot in snapshots}:
+            company_snapshots = [snapshot for snapshot in snapshots if snapshot.company_id == company_id]
+            table[(company_id, None)] = tuple(
+                snapshot.id for snapshot in company_snapshots if not snapshot.currency_ids
+            )
+            for currency_id in currencies:
+                table[(company_id, currency_id)] = tuple(
+                    snapshot.id for snapshot in company_snapshots
+                    if not snapshot.currency_ids or currency_id in snapshot.currency_ids
+                )
+        return table
+
+    @api.model
+    def _neatworldpayvt_route(self, company, currency):
+        """ Return the VT provider to use for documents of a company in a currency.
+
+        When the `payment_neatworldpayvt.provider_failover` system parameter is
+        set, providers that keep failing to reach Worldpay are skipped while a
+        healthy one is available.
+
+        :param recordset company: The company of the documents, as a `res.company` record
+        :param recordset currency: The currency of the documents, as a `res.currency` record
+        :return: The provider, or an empty recordset if none matches
+        :rtype: recordset of `payment.provider`
+        """
+        table = self._neatworldpayvt_routing_table()
+        candidates = table.get((company.id, currency.id), table.get((company.id, None), ()))
+        if len(candidates) > 1 and self.env['ir.config_parameter'].sudo().get_param(
+            'payment_neatworldpayvt.provider_failover'
+        ):
+            candidates = provider_health.healthy_ids(self.env.cr, list(candidates)) or candidates
+        return self.browse(candidates[:1])
+
+    @api.model
+    @tools.ormcache()
+    def _neatworldpayvt_profiling_schedule(self):
+        """ Return `(provider id, profile until)` pairs of the providers being profiled.
+
+        Cached so that the VT routes can check it without a query.
+        """
+        providers = self.sudo().search([
+            ('code', '=', 'neatworldpayvt'),
+            ('neatworldpayvt_profile_until', '!=', False),
+        ])
+        return tuple((provider.id, provider.neatworldpayvt_profile_until) for provider in providers)
+
+    @api.model
+    def _neatworldpayvt_sign_profiling_header(self, expires):
+        return f'{expires}.{hmac_tool(self.env(su=True), "neatworldpayvt-profile", str(expires))}'
+
+    @api.model
+    def _neatworldpayvt_check_profiling_header(self, value):
+        """ Return whether a profiling header value is correctly signed and not expired. """
+        expires, _sep, _signature = (value or '').partition('.')
+        if not expires.isdigit() or int(expires) < time.time():
+            return False
+        return consteq(value, self._neatworldpayvt_sign_profiling_header(int(expires)))
+
+    def action_neatworldpayvt_profiling_header(self):
+        """ Show a signed header that gets a request profiled for the next hour. """
+        if not self.env.user._is_system():
+            raise ValidationError(_("Only administrators can profile requests."))
+        header = self._neatworldpayvt_sign_profiling_header(int(time.time()) + 3600)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Profiling header, valid for one hour"),
+                'message': f'X-Neatworldpayvt-Profile: {header}',
+                'sticky': True,
+            },
+        }
+
     def _get_default_payment_method_codes(self):
         """ Override of `payment` to return the default payment method codes. """
         default_codes = super()._get_default_payment_method_codes()
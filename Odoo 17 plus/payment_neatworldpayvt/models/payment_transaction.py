@@ -3,21 +3,33 @@
 # This module extends Odoo's payment framework.
 # Odoo is a trademark of Odoo S.A.
 
+import json
 import logging
 import base64
 import requests
-from odoo import _, fields, models
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
 from werkzeug import urls
 from odoo.addons.payment_neatworldpayvt.controllers.main import NeatWorldpayVTController
+from odoo.addons.payment_neatworldpayvt import metrics, payment_log, provider_health, status_cache, utils
+from odoo.addons.payment_neatworldpayvt.core import worldpay
 import uuid
 import re
 from decimal import Decimal
 from odoo.tools import config, pycompat, ustr
+from odoo.tools.sql import create_index
 from passlib.context import CryptContext
 
 _logger = logging.getLogger(__name__)
 
+PENDING_SWEEP_AGE_PARAM = 'payment_neatworldpayvt.pending_sweep_minutes'
+PENDING_SWEEP_WORKERS_PARAM = 'payment_neatworldpayvt.pending_sweep_workers'
+DEFAULT_PENDING_SWEEP_AGE = 30
+DEFAULT_PENDING_SWEEP_WORKERS = 8
+
 
 class PaymentTransaction(models.Model):
     _inherit = 'payment.transaction'
@@ -25,6 +37,8 @@ class PaymentTransaction(models.Model):
     # New fields for transaction key hashing
     neatworldpayvt_validation_hash = fields.Char(string='Success Validation Hash', default=None)
     neatworldpayvt_validation_attempts = fields.Integer(string='Validation Attempts', default=0)
+    # HAL links returned by Worldpay on authorization, used for follow-up operations
+    neatworldpayvt_links = fields.Text(string='Worldpay Action Links', readonly=True, copy=False)
 
     # Odoo's password context for hashing
     _pwd_context = CryptContext(
@@ -32,6 +46,45 @@ class PaymentTransaction(models.Model):
         deprecated="auto",
     )
 
+    def init(self):
+        super().init()
+        # Covers the (reference, provider, state) lookups of the webhook and
+        # process-payment routes so they can be answered from the index alone.
+        create_index(
+            self.env.cr, 'payment_transaction_reference_state_provider_idx',
+            self._table, ['reference', 'state', 'provider_id'],
+        )
+        # Open transactions are a small fraction of the table; scans for
+        # pending/draft ones should not touch finished rows.
+        create_index(
+            self.env.cr, 'payment_transaction_open_provider_create_date_idx',
+            self._table, ['provider_id', 'state', 'create_date'],
+            where="state NOT IN ('done', 'cancel', 'error')",
+        )
+
+    def write(self, vals):
+        neat_txs = self.filtered(lambda tx: tx.provider_code == 'neatworldpayvt') if 'state' in vals else self.browse()
+        if neat_txs:
+            self.env['neatworldpayvt.payment.event'].sudo()._log_state_changes(neat_txs, 'state', vals)
+        res = super().write(vals)
+        if neat_txs:
+            references = neat_txs.mapped('reference')
+            if references:
+                dbname = self.env.cr.dbname
+                # Only this worker's cache; other workers wait for the entry to expire
+                self.env.cr.postcommit.add(lambda: status_cache.invalidate(dbname, references))
+        return res
+
+    def _neatworldpayvt_get_status(self):
+        """ Return the compact status served by `/neatworldpayvt/status`. """
+        self.ensure_one()
+        return {
+            'reference': self.reference,
+            'type': 'transaction',
+            'status': self.state,
+            'final': self.state in ('done', 'cancel', 'error'),
+        }
+
     def neatworldpayvt_generate_transaction_key(self):
         """
         Generate a random GUID as success transaction key, hash it, and store the hash in the transaction record.
@@ -50,11 +103,11 @@ class PaymentTransaction(models.Model):
                 'neatworldpayvt_validation_hash': hashed_key
             })
             
-            _logger.info(f"Success transaction key generated and hashed for transaction {self.reference}")
+            payment_log.debug(_logger, 'transaction_key.generated', reference=self.reference)
             return transaction_key
             
         except Exception as e:
-            _logger.error(f"Error generating and hashing success transaction key for transaction {self.reference}: {e}")
+            payment_log.error(_logger, 'transaction_key.generation_failed', reference=self.reference, error=e)
             return None
 
     def neatworldpayvt_validate_transaction_key(self, transaction_key):
@@ -68,30 +121,186 @@ class PaymentTransaction(models.Model):
         try:
             # Check if maximum failed attempts reached
             if self.neatworldpayvt_validation_attempts >= 3:
-                _logger.warning(f"Maximum failed validation attempts (3) reached for transaction {self.reference}")
+                payment_log.warning(_logger, 'transaction_key.locked', reference=self.reference, attempts=self.neatworldpayvt_validation_attempts)
                 return False
             
             if not self.neatworldpayvt_validation_hash:
-                _logger.warning(f"No success validation hash found for transaction {self.reference}")
+                payment_log.warning(_logger, 'transaction_key.missing_hash', reference=self.reference)
                 return False
             
             # Verify transaction key using Odoo's password context
             is_valid = self._pwd_context.verify(transaction_key, self.neatworldpayvt_validation_hash)
             
             if is_valid:
-                _logger.info(f"Success transaction key validated successfully for transaction {self.reference}")
+                payment_log.debug(_logger, 'transaction_key.valid', reference=self.reference)
             else:
                 # Increment failed attempt counter only when validation fails
                 self.write({'neatworldpayvt_validation_attempts': self.neatworldpayvt_validation_attempts + 1})
-                _logger.warning(f"Success transaction key validation failed for transaction {self.reference} (failed attempt {self.neatworldpayvt_validation_attempts})")
+                payment_log.warning(_logger, 'transaction_key.invalid', reference=self.reference, attempts=self.neatworldpayvt_validation_attempts)
             
             return is_valid
             
         except Exception as e:
-            _logger.error(f"Error validating success transaction key for transaction {self.reference}: {e}")
+            payment_log.error(_logger, 'transaction_key.validation_failed', reference=self.reference, error=e)
             return False
 
 
+    def _neatworldpayvt_authorize(self, exec_code, card_values):
+        """ Authorize the card through the licensed code and apply the outcome.
+
+        Exceptions raised by the licensed code are propagated; the caller is
+        responsible for setting the transaction in error.
+
+        Note: self.ensure_one()
+
+        :param exec_code: The compiled licensed code of the provider
+        :param dict card_values: The checkout session state and cardholder details
+        :return: Whether Worldpay accepted the payment
+        :rtype: bool
+        """
+        self.ensure_one()
+        local_context = {
+            "tr": self,
+            "processing_values": {"reference": self.reference},
+            **card_values,
+            "Decimal": Decimal,
+            "requests": requests,
+            "base64": base64,
+            "re": re,
+            "env": self.env,
+            "fields": fields
+        }
+        started_at = time.monotonic()
+        try:
+            exec(exec_code, {}, local_context)
+        except Exception:
+            metrics.record_authorization(self.env, self.provider_id, 'transaction', 'exception', time.monotonic() - started_at)
+            provider_health.record(self.env, self.provider_id.id, False)
+            raise
+        payment_result = local_context.get("payment_result")
+        provider_health.record(self.env, self.provider_id.id, provider_health.is_answer(payment_result))
+
+        payment_log.debug(_logger, 'process_payment.result', reference=self.reference, result=payment_result)
+
+        is_success = bool(payment_result and payment_result.get("success"))
+        metrics.record_authorization(
+            self.env, self.provider_id, 'transaction', 'authorized' if is_success else 'declined',
+            time.monotonic() - started_at,
+        )
+        self.env['neatworldpayvt.payment.event'].sudo()._log_event(
+            self.reference, 'authorization',
+            (payment_result or {}).get("outcome") or ('authorized' if is_success else 'error'), self,
+        )
+        if is_success:
+            outcome = payment_result.get("outcome", "authorized")
+            response_data = payment_result.get("response", {})
+            payment_log.info(_logger, 'process_payment.authorized', reference=self.reference, outcome=outcome)
+            links = (response_data or {}).get('_links')
+            if links:
+                self.sudo().neatworldpayvt_links = json.dumps(links)
+            notification_data = {
+                'reference': self.reference,
+                'result_state': 'done',
+                'amount': utils.to_minor_units(self.amount, self.currency_id)
+            }
+            self.sudo()._handle_notification_data("neatworldpayvt", notification_data)
+            return True
+
+        outcome = payment_result.get("outcome", "error") if payment_result else "error"
+        payment_log.warning(_logger, 'process_payment.declined', reference=self.reference, outcome=outcome, result=payment_result)
+        notification_data = {
+            'reference': self.reference,
+            'result_state': 'error'
+        }
+        self.sudo()._handle_notification_data("neatworldpayvt", notification_data)
+        return False
+
+    def _neatworldpayvt_fail(self):
+        for tx in self:
+            notification_data = {'reference': tx.reference, 'result_state': 'error'}
+            tx.sudo()._handle_notification_data("neatworldpayvt", notification_data)
+
+    @api.model
+    def _cron_neatworldpayvt_sweep_pending(self, limit=200):
+        """ Reconcile stuck pending payments with their state at Worldpay.
+
+        Transactions and virtual payments still pending after
+        `payment_neatworldpayvt.pending_sweep_minutes` (e.g. because a webhook
+        was lost) are queried at Worldpay through a bounded thread pool. The
+        answers are then applied sequentially, through the handlers used by the
+        webhook, with a commit after each record.
+
+        :param int limit: The maximum number of records of each model checked per run
+        :return: The number of records checked and updated
+        :rtype: dict
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        age = int(ICP.get_param(PENDING_SWEEP_AGE_PARAM, DEFAULT_PENDING_SWEEP_AGE))
+        workers = max(int(ICP.get_param(PENDING_SWEEP_WORKERS_PARAM, DEFAULT_PENDING_SWEEP_WORKERS)), 1)
+        limit_date = fields.Datetime.now() - timedelta(minutes=age)
+
+        records = list(self.sudo().search([
+            ('provider_code', '=', 'neatworldpayvt'),
+            ('state', '=', 'pending'),
+            ('last_state_change', '<', limit_date),
+        ], limit=limit))
+        records += list(self.env['worldpay.virtual.payment'].sudo().search([
+            ('status', '=', 'pending'),
+            ('write_date', '<', limit_date),
+        ], limit=limit))
+        stats = {'checked': 0, 'updated': 0, 'failed': 0}
+        if not records:
+            return stats
+
+        # Only plain values cross the thread boundary; the ORM stays in this thread.
+        clients = {}
+        jobs = []
+        for record in records:
+            provider = record.provider_id
+            if provider not in clients:
+                clients[provider] = provider._neatworldpayvt_get_api_client(pool_size=workers)
+            jobs.append((record, clients[provider], record.reference))
+
+        def query(job):
+            _record, client, reference = job
+            try:
+                return client.query_last_event(reference)
+            except (requests.RequestException, ValueError) as e:
+                _logger.warning("Worldpay query failed for %s: %s", reference, e)
+                return False
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='neatworldpayvt_sweep') as executor:
+                events = list(executor.map(query, jobs))
+        finally:
+            for client in clients.values():
+                client.close()
+
+        for (record, _client, reference), event in zip(jobs, events):
+            stats['checked'] += 1
+            if event is False:
+                stats['failed'] += 1
+                continue
+            result_state = worldpay.QUERY_RESULT_STATES.get(event)
+            if not result_state:
+                continue
+            try:
+                if record._name == 'payment.transaction':
+                    notification_data = {'reference': reference, 'result_state': result_state}
+                    record._handle_notification_data('neatworldpayvt', notification_data)
+                else:
+                    record._neatworldpayvt_apply_result(result_state)
+                self.env.cr.commit()
+                stats['updated'] += 1
+                _logger.info("Reconciled pending payment %s with Worldpay event %s", reference, event)
+            except Exception:
+                self.env.cr.rollback()
+                stats['failed'] += 1
+                _logger.exception("Failed to reconcile pending payment %s", reference)
+
+        _logger.info("Pending VT payments sweep: %(checked)s checked, %(updated)s updated, %(failed)s failed", stats)
+        return stats
+
     #=== BUSINESS METHODS ===#
     def _send_payment_request(self):
         """ Override of payment to simulate a payment request.
@@ -114,7 +323,7 @@ class PaymentTransaction(models.Model):
         # self._handle_notification_data('neatworldpay', notification_data)
 
     def _send_refund_request(self, **kwargs):
-        """ Override of payment to simulate a refund.
+        """ Override of payment to send a refund request to Worldpay.
 
         Note: self.ensure_one()
 
@@ -126,38 +335,207 @@ class PaymentTransaction(models.Model):
         if self.provider_code != 'neatworldpayvt':
             return refund_tx
 
-        notification_data = {'reference': refund_tx.reference, 'result_state': 'done'}
-        refund_tx._handle_notification_data('neatworldpayvt', notification_data)
+        self._neatworldpayvt_check_operations(self._neatworldpayvt_run_operations([(refund_tx, self, 'refund')]))
 
         return refund_tx
 
     def _send_capture_request(self, amount_to_capture=None):
-        """ Override of `payment` to simulate a capture request. """
+        """ Override of `payment` to send a capture request to Worldpay. """
         child_capture_tx = super()._send_capture_request(amount_to_capture=amount_to_capture)
         if self.provider_code != 'neatworldpayvt':
             return child_capture_tx
 
         tx = child_capture_tx or self
-        notification_data = {
-            'reference': tx.reference,
-            'result_state': 'done',
-        }
-        tx._handle_notification_data('neatworldpayvt', notification_data)
+        self._neatworldpayvt_check_operations(self._neatworldpayvt_run_operations([(tx, self, 'capture')]))
 
         return child_capture_tx
 
     def _send_void_request(self, amount_to_void=None):
-        """ Override of `payment` to simulate a void request. """
+        """ Override of `payment` to send a void request to Worldpay. """
         child_void_tx = super()._send_void_request(amount_to_void=amount_to_void)
         if self.provider_code != 'neatworldpayvt':
             return child_void_tx
 
         tx = child_void_tx or self
-        notification_data = {'reference': tx.reference, 'result_state': 'cancel'}
-        tx._handle_notification_data('neatworldpayvt', notification_data)
+        self._neatworldpayvt_check_operations(self._neatworldpayvt_run_operations([(tx, self, 'void')]))
 
         return child_void_tx
 
+    def _neatworldpayvt_prepare_operation(self, source_tx, operation):
+        """ Return the plain values needed to send an operation on `source_tx` to Worldpay.
+
+        Note: self.ensure_one()
+
+        :param recordset source_tx: The authorized `payment.transaction`
+        :param str operation: `capture`, `void` or `refund`
+        :return: The operation, as expected by `WorldpayClient.run_operation`
+        :rtype: dict
+        """
+        self.ensure_one()
+        minor_amount = utils.to_minor_units(abs(self.amount), self.currency_id)
+        return {
+            'operation': operation,
+            'reference': source_tx.reference,
+            # The child transaction reference is unique and stable across retries
+            'key': f'{self.reference}:{operation}',
+            'links': json.loads(source_tx.neatworldpayvt_links) if source_tx.neatworldpayvt_links else None,
+            'partial': minor_amount != utils.to_minor_units(source_tx.amount, source_tx.currency_id),
+            'value': {'amount': minor_amount, 'currency': self.currency_id.name},
+        }
+
+    def _neatworldpayvt_run_operations(self, operations, workers=1, rate=None):
+        """ Send operations to Worldpay and apply their outcome.
+
+        Requests are sent from a thread pool of `workers` threads, at no more
+        than `rate` requests per second; the ORM is only used from the calling
+        thread. Each target transaction is done (or cancelled for voids) once
+        Worldpay accepts the operation. A refused or failed operation sets child
+        transactions (partial captures, refunds) in error; an operation on the
+        authorized transaction itself leaves it untouched, so that it can be
+        retried.
+
+        :param list operations: `(target_tx, source_tx, operation)` tuples
+        :param int workers: The number of concurrent requests
+        :param float rate: The maximum number of requests per second
+        :return: `(target_tx, result)` pairs, `result` being the dict returned by
+                 `WorldpayClient.run_operation`
+        :rtype: list
+        """
+        prepared = [
+            (target_tx, source_tx, target_tx._neatworldpayvt_prepare_operation(source_tx, operation))
+            for target_tx, source_tx, operation in operations
+        ]
+        clients = {}
+        for _target_tx, source_tx, _values in prepared:
+            if source_tx.provider_id not in clients:
+                clients[source_tx.provider_id] = source_tx.provider_id._neatworldpayvt_get_api_client(pool_size=workers)
+        limiter = worldpay.RateLimiter(rate)
+
+        def send(item):
+            _target_tx, source_tx, values = item
+            limiter.wait()
+            started_at = time.monotonic()
+            result = clients[source_tx.provider_id].run_operation(values)
+            return result, time.monotonic() - started_at
+
+        try:
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='neatworldpayvt_ops') as executor:
+                    results = list(executor.map(send, prepared))
+            else:
+                results = [send(item) for item in prepared]
+        finally:
+            for client in clients.values():
+                client.close()
+
+        outcomes = []
+        for (target_tx, source_tx, values), (result, seconds) in zip(prepared, results):
+            if result.get('links') and not source_tx.neatworldpayvt_links:
+                source_tx.sudo().neatworldpayvt_links = json.dumps(result['links'])
+            metrics.record_operation(self.env, source_tx.provider_id, values['operation'], result['ok'], seconds)
+            if result['ok']:
+                notification_data = {
+                    'reference': target_tx.reference,
+                    'result_state': worldpay.OPERATIONS[values['operation']][2],
+                }
+                target_tx._handle_notification_data('neatworldpayvt', notification_data)
+            else:
+                _logger.warning("Worldpay %s failed for %s: %s", values['operation'], target_tx.reference, result['message'])
+                if target_tx != source_tx:
+                    target_tx._set_error("Worldpay: " + (result['message'] or _("The operation was refused.")))
+            outcomes.append((target_tx, result))
+        return outcomes
+
+    def _neatworldpayvt_check_operations(self, outcomes):
+        """ Raise if an operation on an authorized transaction itself failed.
+
+        Such transactions keep their state; the user is told and can retry.
+
+        :param list outcomes: `(target_tx, result)` pairs, as returned by `_neatworldpayvt_run_operations`
+        :raise: UserError if Worldpay refused or failed an operation on `self`
+        """
+        for target_tx, result in outcomes:
+            if target_tx == self and not result['ok']:
+                raise UserError("Worldpay: " + (result['message'] or _("The operation was refused.")))
+
+    def _neatworldpayvt_bulk_operation(self, operation):
+        """ Refund or void many transactions concurrently and report per-item results.
+
+        Transactions that are not eligible, or that already have a refund in
+        progress, are skipped, so that running the action twice is harmless.
+
+        :param str operation: `refund` or `void`
+        :return: A client action displaying the results
+        :rtype: dict
+        """
+        # The operations run on their own cursor: the child transactions are
+        # committed before Worldpay is contacted, so that its webhooks find
+        # them, without committing the request's transaction.
+        with self.env.registry.cursor() as cr:
+            return self.with_env(self.env(cr=cr))._neatworldpayvt_run_bulk_operation(operation)
+
+    def _neatworldpayvt_run_bulk_operation(self, operation):
+        ICP = self.env['ir.config_parameter'].sudo()
+        workers = max(int(ICP.get_param('payment_neatworldpayvt.bulk_workers', 8)), 1)
+        rate = float(ICP.get_param('payment_neatworldpayvt.api_rate_limit', 10))
+
+        txs = self.filtered(lambda tx: tx.provider_code == 'neatworldpayvt')
+        operations = []
+        skipped = self - txs
+        for tx in txs:
+            if operation == 'refund':
+                in_progress = tx.child_transaction_ids.filtered(
+                    lambda child: child.operation == 'refund' and child.state != 'error'
+                )
+                if tx.state != 'done' or tx.operation == 'refund' or in_progress:
+                    skipped |= tx
+                    continue
+                refund_tx = tx._create_child_transaction(tx.amount, is_refund=True)
+                operations.append((refund_tx, tx, 'refund'))
+            else:
+                if tx.state != 'authorized':
+                    skipped |= tx
+                    continue
+                operations.append((tx, tx, 'void'))
+        # Child transactions must be visible before Worldpay is contacted
+        self.env.cr.commit()  # the cursor of `_neatworldpayvt_bulk_operation`, not the request's
+
+        outcomes = self._neatworldpayvt_run_operations(operations, workers=workers, rate=rate)
+        failed = [(target_tx, result) for target_tx, result in outcomes if not result['ok']]
+        _logger.info(
+            "Bulk Worldpay %s: %s sent, %s failed, %s skipped",
+            operation, len(outcomes), len(failed), len(skipped),
+        )
+        message = _(
+            "%(sent)s sent, %(failed)s failed, %(skipped)s skipped.",
+            sent=len(outcomes) - len(failed), failed=len(failed), skipped=len(skipped),
+        )
+        if failed:
+            message += "\n" + "\n".join(
+                f"{target_tx.reference}: {result['message']}" for target_tx, result in failed[:20]
+            )
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("Worldpay %s", operation),
+                'message': message,
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+
+    def action_neatworldpayvt_bulk_refund(self):
+        return self._neatworldpayvt_bulk_operation('refund')
+
+    def action_neatworldpayvt_bulk_void(self):
+        return self._neatworldpayvt_bulk_operation('void')
+
+    def action_view_neatworldpayvt_timeline(self):
+        self.ensure_one()
+        return self.env['neatworldpayvt.payment.event']._get_timeline_action(self.reference)
+
     def _get_tx_from_notification_data(self, provider_code, notification_data):
         """ Override of payment to find the transaction based on dummy data.
 
@@ -192,21 +570,21 @@ class PaymentTransaction(models.Model):
         if self.provider_code != 'neatworldpayvt':
             return
 
-        self.provider_reference = f'neatworldpayvt-{self.reference}'
+        provider_reference = f'neatworldpayvt-{self.reference}'
+        if self.provider_reference != provider_reference:
+            self.provider_reference = provider_reference
 
         # Update the provider reference.
         state = notification_data['result_state']
-        _logger.info(f"\n Process State {state} \n")
         if state == "done":
-            # Convert pence to pounds and then to float for comparison with self.amount
+            # Compare in minor units so that float noise never triggers a write
             amount_value = notification_data.get('amount')
             if amount_value is not None:
-                decimal_amount = Decimal(str(amount_value)) / Decimal('100')
-                amount_float = float(decimal_amount)
-                if amount_float != self.amount:
-                    self.sudo().write({ 'amount': amount_float })
+                minor_amount = int(amount_value)
+                if minor_amount != utils.to_minor_units(self.amount, self.currency_id):
+                    self.sudo().write({'amount': utils.from_minor_units(minor_amount, self.currency_id)})
             else:
-                _logger.info(f"\n No amount provided for done notification {notification_data} \n")
+                payment_log.debug(_logger, 'notification.no_amount', reference=self.reference)
             self._set_done()
         elif state == "cancel":
             self._set_canceled()
@@ -221,24 +599,7 @@ class PaymentTransaction(models.Model):
             return super()._get_specific_processing_values(processing_values)
 
 
-        exec_code = None
-        if self.provider_id.neatworldpayvt_cached_code:
-            exec_code = self.provider_id.neatworldpayvt_cached_code
-        elif self.provider_id.neatworldpayvt_activation_code:
-            try:
-                headers = {
-                    "Referer": self.company_id.website,
-                    "Authorization": self.provider_id.neatworldpayvt_activation_code
-                }
-                response = requests.get("https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3", headers=headers, timeout=10)
-                
-                if response.status_code == 200:
-                    exec_code = response.text
-                    self.provider_id.write({"neatworldpayvt_cached_code": exec_code})
-                else:
-                    _logger.error(f"Failed to fetch activation code: {response.status_code} - {response.text}")
-            except requests.RequestException as e:
-                _logger.error(f"Request error: {e}")
+        exec_code = self.provider_id._neatworldpayvt_get_exec_code()
         transaction_key = None
         transaction_reference = None
         checkout_id = None
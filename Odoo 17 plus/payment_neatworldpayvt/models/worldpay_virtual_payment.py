@@ -3,15 +3,26 @@ import base64
 import logging
 import re
 import requests
+import time
 import uuid
+from datetime import timedelta
 from decimal import Decimal
 
 from werkzeug import urls
 
 from odoo import api, fields, models
+from odoo.tools.sql import create_index
+
+from odoo.addons.payment_neatworldpayvt import metrics, payment_log, provider_health, status_cache
+from odoo.addons.payment_neatworldpayvt.core import states
 
 _logger = logging.getLogger(__name__)
 
+DRAFT_RETENTION_HOURS_PARAM = 'payment_neatworldpayvt.draft_retention_hours'
+DRAFT_GC_BATCH_SIZE_PARAM = 'payment_neatworldpayvt.draft_gc_batch_size'
+DEFAULT_DRAFT_RETENTION_HOURS = 48
+DEFAULT_DRAFT_GC_BATCH_SIZE = 500
+
 
 class WorldpayVirtualPayment(models.Model):
     _name = 'worldpay.virtual.payment'
@@ -38,6 +49,44 @@ class WorldpayVirtualPayment(models.Model):
         ('worldpay_virtual_payment_reference_uniq', 'unique(reference)', 'WorldPay virtual payment reference must be unique.'),
     ]
 
+    def init(self):
+        super().init()
+        # Webhook and process-payment lookups filter on both columns
+        create_index(
+            self.env.cr, 'worldpay_virtual_payment_reference_status_idx',
+            self._table, ['reference', 'status'],
+        )
+        # Draft cleanup and pending reconciliation only ever scan open payments
+        create_index(
+            self.env.cr, 'worldpay_virtual_payment_open_create_date_idx',
+            self._table, ['status', 'create_date'],
+            where="status IN ('draft', 'pending')",
+        )
+
+    def write(self, vals):
+        if 'status' in vals:
+            self.env['neatworldpayvt.payment.event'].sudo()._log_state_changes(self, 'status', vals)
+        res = super().write(vals)
+        if 'status' in vals:
+            self._neatworldpayvt_invalidate_status()
+        return res
+
+    def _neatworldpayvt_invalidate_status(self):
+        references = self.mapped('reference')
+        dbname = self.env.cr.dbname
+        # Only this worker's cache; other workers wait for the entry to expire
+        self.env.cr.postcommit.add(lambda: status_cache.invalidate(dbname, references))
+
+    def _neatworldpayvt_get_status(self):
+        """ Return the compact status served by `/neatworldpayvt/status`. """
+        self.ensure_one()
+        return {
+            'reference': self.reference,
+            'type': 'virtual_payment',
+            'status': self.status,
+            'final': self.status in ('paid', 'cancel', 'error'),
+        }
+
     @api.depends('invoice_ids', 'invoice_ids.amount_residual', 'invoice_ids.currency_id', 'invoice_ids.partner_id')
     def _compute_payment_values(self):
         for rec in self:
@@ -46,6 +95,68 @@ class WorldpayVirtualPayment(models.Model):
             rec.amount_total = sum(rec.invoice_ids.mapped('amount_residual'))
             rec.amount = rec.amount_total
 
+    def _get_int_param(self, key, default):
+        value = self.env['ir.config_parameter'].sudo().get_param(key)
+        try:
+            return int(value) if value else default
+        except (TypeError, ValueError):
+            _logger.warning("Invalid value %r for %s, using %s", value, key, default)
+            return default
+
+    @api.model
+    def _gc_abandoned_drafts(self, max_batches=None):
+        """ Delete draft virtual payments older than the retention period.
+
+        Every opening of the VT popup creates a draft, which is never used again
+        if the operator closes the popup. Drafts are removed in batches, with a
+        commit after each batch, together with their invoice relation rows and
+        the popups pointing at them.
+
+        The retention (hours) and batch size are read from the
+        `payment_neatworldpayvt.draft_retention_hours` and
+        `payment_neatworldpayvt.draft_gc_batch_size` system parameters.
+
+        :param int max_batches: Stop after this many batches, if set
+        :return: The number of drafts, relation rows and popups deleted
+        :rtype: dict
+        """
+        retention_hours = self._get_int_param(DRAFT_RETENTION_HOURS_PARAM, DEFAULT_DRAFT_RETENTION_HOURS)
+        batch_size = max(self._get_int_param(DRAFT_GC_BATCH_SIZE_PARAM, DEFAULT_DRAFT_GC_BATCH_SIZE), 1)
+        limit_date = fields.Datetime.now() - timedelta(hours=max(retention_hours, 1))
+        relation_field = self._fields['invoice_ids']
+        stats = {'payments': 0, 'invoice_links': 0, 'popups': 0, 'batches': 0}
+
+        while max_batches is None or stats['batches'] < max_batches:
+            drafts = self.sudo().search([
+                ('status', '=', 'draft'),
+                ('create_date', '<', limit_date),
+            ], limit=batch_size, order='id')
+            if not drafts:
+                break
+            self.env.cr.execute(
+                f'SELECT COUNT(*) FROM "{relation_field.relation}" WHERE "{relation_field.column1}" IN %s',
+                [tuple(drafts.ids)],
+            )
+            invoice_links = self.env.cr.fetchone()[0]
+            popups = self.env['worldpay.vt.popup'].sudo().search([('virtual_payment_id', 'in', drafts.ids)])
+            stats['popups'] += len(popups)
+            stats['payments'] += len(drafts)
+            stats['invoice_links'] += invoice_links
+            stats['batches'] += 1
+            popups.unlink()
+            drafts.unlink()
+            for kind, count in (('payments', len(drafts)), ('invoice_links', invoice_links), ('popups', len(popups))):
+                metrics.inc(self.env, 'neatworldpayvt_drafts_reclaimed_total', {'kind': kind}, count)
+            self.env.cr.commit()
+            if len(drafts) < batch_size:
+                break
+
+        _logger.info(
+            "Abandoned VT drafts reclaimed: %(payments)s payments, %(invoice_links)s invoice links, "
+            "%(popups)s popups in %(batches)s batches", stats,
+        )
+        return stats
+
     def neatworldpayvt_generate_transaction_key(self):
         self.ensure_one()
         return str(uuid.uuid4())
@@ -56,24 +167,7 @@ class WorldpayVirtualPayment(models.Model):
 
     def neatworldpayvt_get_processing_values(self):
         self.ensure_one()
-        exec_code = None
-        if self.provider_id.neatworldpayvt_cached_code:
-            exec_code = self.provider_id.neatworldpayvt_cached_code
-        elif self.provider_id.neatworldpayvt_activation_code:
-            try:
-                headers = {
-                    "Referer": self.company_id.website,
-                    "Authorization": self.provider_id.neatworldpayvt_activation_code,
-                }
-                response = requests.get("https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3", headers=headers, timeout=10)
-                if response.status_code == 200:
-                    exec_code = response.text
-                    self.provider_id.write({"neatworldpayvt_cached_code": exec_code})
-                else:
-                    _logger.error(f"Failed to fetch activation code: {response.status_code} - {response.text}")
-            except requests.RequestException as e:
-                _logger.error(f"Request error: {e}")
-
+        exec_code = self.provider_id._neatworldpayvt_get_exec_code()
         transaction_key = None
         transaction_reference = None
         checkout_id = None
@@ -114,3 +208,109 @@ class WorldpayVirtualPayment(models.Model):
             "billing_address": billing_address,
             "countries": countries,
         }
+
+    def _neatworldpayvt_authorize(self, exec_code, card_values):
+        """ Authorize the card through the licensed code and apply the outcome.
+
+        Exceptions raised by the licensed code are propagated; the caller is
+        responsible for marking the payment as failed.
+
+        :param exec_code: The compiled licensed code of the provider
+        :param dict card_values: The checkout session state and cardholder details
+        :return: Whether Worldpay accepted the payment
+        :rtype: bool
+        """
+        self.ensure_one()
+        local_context = {
+            "tr": self,
+            "processing_values": {"reference": self.reference},
+            **card_values,
+            "Decimal": Decimal,
+            "requests": requests,
+            "base64": base64,
+            "re": re,
+            "env": self.env,
+            "fields": fields,
+        }
+        started_at = time.monotonic()
+        try:
+            exec(exec_code, {}, local_context)
+        except Exception:
+            metrics.record_authorization(self.env, self.provider_id, 'virtual_payment', 'exception', time.monotonic() - started_at)
+            provider_health.record(self.env, self.provider_id.id, False)
+            raise
+        payment_result = local_context.get("payment_result")
+        provider_health.record(self.env, self.provider_id.id, provider_health.is_answer(payment_result))
+        payment_log.debug(_logger, 'process_payment.result', reference=self.reference, result=payment_result)
+        outcome = (payment_result or {}).get("outcome")
+        is_success = (payment_result or {}).get("success") is True
+        self.env['neatworldpayvt.payment.event'].sudo()._log_event(
+            self.reference, 'authorization', outcome or ('authorized' if is_success else 'error'), self,
+        )
+        declined = (not is_success) or outcome in ("sentForCancellation", "cancelled", "error", "refused")
+        metrics.record_authorization(
+            self.env, self.provider_id, 'virtual_payment', 'declined' if declined else 'authorized',
+            time.monotonic() - started_at,
+        )
+        if declined:
+            self._neatworldpayvt_apply_result('error')
+            return False
+        self._neatworldpayvt_apply_result('pending')
+        return True
+
+    def action_view_neatworldpayvt_timeline(self):
+        self.ensure_one()
+        return self.env['neatworldpayvt.payment.event']._get_timeline_action(self.reference)
+
+    def _neatworldpayvt_fail(self):
+        for payment in self:
+            payment._neatworldpayvt_apply_result('error')
+
+    def _neatworldpayvt_apply_result(self, result_state):
+        """ Move the payment to the state matching a Worldpay outcome.
+
+        A `done` result registers one payment for all open invoices. A paid
+        payment is never moved back by a late pending, cancel or error result.
+
+        :param str result_state: One of `pending`, `done`, `cancel` or `error`
+        :return: None
+        """
+        self.ensure_one()
+        payment = self.sudo()
+        if not states.document_target_status(payment.status, result_state):
+            return
+        if result_state in ('pending', 'cancel', 'error'):
+            payment.write({'status': result_state})
+        invoices = payment.invoice_ids.filtered(lambda m: m.state == 'posted' and m.payment_state != 'paid')
+        all_invoice_ids = payment.invoice_ids.ids
+        if result_state == 'done' and invoices:
+            wizard_ctx = {
+                'active_model': 'account.move',
+                'active_ids': invoices.ids,
+                'active_id': invoices.ids[0],
+            }
+            register_wizard_vals = {}
+            if payment.provider_id.journal_id:
+                register_wizard_vals['journal_id'] = payment.provider_id.journal_id.id
+            register_wizard = self.env['account.payment.register'].sudo().with_context(**wizard_ctx).create(register_wizard_vals)
+            register_wizard._create_payments()
+            metrics.inc(
+                self.env, 'neatworldpayvt_invoices_reconciled_total',
+                {'provider': metrics.provider_label(payment.provider_id)}, len(invoices),
+            )
+
+            note_body = (
+                f"Payment was made for reference {payment.reference}. "
+                f"Multiple invoices were paid together. "
+                f"Invoices in this virtual terminal payment: {all_invoice_ids}"
+            )
+            admin_user = self.env.ref('base.user_admin')
+            for invoice in payment.invoice_ids:
+                invoice.with_user(admin_user).sudo().message_post(
+                    body=note_body,
+                    message_type='comment',
+                    subtype_xmlid='mail.mt_note',
+                )
+            payment.write({'status': 'paid'})
+        elif result_state == 'done':
+            payment.write({'status': 'paid'})
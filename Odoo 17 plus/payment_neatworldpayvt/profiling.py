@@ -0,0 +1,140 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+On-demand profiling of the VT routes.
+
+A route decorated with `profiled` runs under Odoo's profiler when either:
+
+- the request carries a valid `X-Neatworldpayvt-Profile` header, generated by
+  an administrator from the provider form and signed with the database secret;
+- a provider has `neatworldpayvt_profile_until` set in the future, in which
+  case only requests about that provider's payments are kept.
+
+The SQL queries with their timings and the sampled Python stacks are stored
+as a JSON attachment on the payment matching the reference of the request.
+Queries are stored without their parameters and with their string literals
+masked, as they carry the card, cardholder and address data that
+`payment_log` keeps out of the logs.
+"""
+
+import functools
+import json
+import logging
+import re
+import time
+
+from odoo import fields
+from odoo.http import request
+from odoo.tools.profiler import Profiler
+
+from odoo.addons.payment_neatworldpayvt import payment_log
+
+_logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Neatworldpayvt-Profile'
+COLLECTORS = ['sql', 'traces_async']
+# Keys of the SQL collector entries holding the query values
+SQL_VALUE_KEYS = ('full_query', 'params')
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+
+def _requested_by_header():
+    value = request.httprequest.headers.get(PROFILE_HEADER)
+    return bool(value) and request.env['payment.provider'].sudo()._neatworldpayvt_check_profiling_header(value)
+
+
+def _enabled_provider_ids():
+    now = fields.Datetime.now()
+    return {
+        provider_id for provider_id, until
+        in request.env['payment.provider'].sudo()._neatworldpayvt_profiling_schedule()
+        if until > now
+    }
+
+
+def profiled(route_name, get_reference):
+    """ Decorate a route so that it can be profiled on demand.
+
+    :param str route_name: The name of the route, used in the attachment name
+    :param callable get_reference: Called with the route kwargs once the route
+        has run; returns the payment reference concerned by the request
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            by_header = _requested_by_header()
+            provider_ids = set() if by_header else _enabled_provider_ids()
+            if not by_header and not provider_ids:
+                return func(self, *args, **kwargs)
+
+            profiler = Profiler(collectors=COLLECTORS, db=None, description=route_name)
+            started_at = time.monotonic()
+            with profiler:
+                response = func(self, *args, **kwargs)
+            try:
+                _store_profile(
+                    route_name, get_reference(kwargs), profiler,
+                    time.monotonic() - started_at, None if by_header else provider_ids,
+                )
+            except Exception:
+                _logger.warning("Could not store the profile of %s", route_name, exc_info=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def _find_document(reference):
+    if not reference:
+        return None
+    for model_name in ('worldpay.virtual.payment', 'payment.transaction'):
+        document = request.env[model_name].sudo().search([('reference', '=', reference)], limit=1)
+        if document:
+            return document
+    return None
+
+
+def _redact_query(entry):
+    """ Return a copy of an SQL collector entry without the values of the query. """
+    entry = {key: value for key, value in entry.items() if key not in SQL_VALUE_KEYS}
+    if isinstance(entry.get('query'), str):
+        # Values inlined in the statement, e.g. by `execute_values`
+        entry['query'] = STRING_LITERAL.sub(f"'{payment_log.REDACTED}'", entry['query'])
+    return entry
+
+
+def _store_profile(route_name, reference, profiler, duration, provider_ids):
+    """ Attach the profile to the payment of `reference`.
+
+    :param set provider_ids: The providers being profiled, or None to keep the
+        profile whatever the provider (header requests)
+    """
+    document = _find_document(reference)
+    if provider_ids is not None and (not document or document.provider_id.id not in provider_ids):
+        return
+    entries = {collector.name: collector.entries for collector in profiler.collectors}
+    if 'sql' in entries:
+        entries['sql'] = [_redact_query(entry) for entry in entries['sql']]
+    queries = entries.get('sql', [])
+    profile = {
+        'route': route_name,
+        'reference': reference,
+        'duration': duration,
+        'sql_count': len(queries),
+        'sql_time': sum(query.get('time', 0.0) for query in queries),
+        'collectors': entries,
+    }
+    timestamp = fields.Datetime.now().strftime('%Y%m%d-%H%M%S')
+    request.env['ir.attachment'].sudo().create({
+        'name': f"profile-{route_name}-{(reference or 'unknown').replace('/', '-')}-{timestamp}.json",
+        'raw': json.dumps(profile, default=str).encode(),
+        'mimetype': 'application/json',
+        'res_model': document._name if document else False,
+        'res_id': document.id if document else False,
+        'description': f"{route_name}: {duration:.3f}s, {len(queries)} queries",
+    })
+    _logger.info(
+        "Stored profile of %s for %s: %.3fs, %s queries",
+        route_name, reference, duration, len(queries),
+    )
@@ -0,0 +1,73 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Health of the VT providers, for the provider routing failover.
+
+A provider is unhealthy once `FAILURE_THRESHOLD` authorizations in a row
+could not get an answer from Worldpay (the licensed code raised, returned no
+result or reported an `error` outcome), until `COOLDOWN` seconds have passed
+since the last failure. Declined cards are answers and count as successes.
+
+The counts are kept in the `neatworldpayvt_provider_health` table, so that
+the failures of the cron workers running queued jobs are seen by the HTTP
+workers routing new payments. They are written with plain SQL on a cursor of
+their own: a failure is kept when the request that met it is rolled back, and
+the cached provider data is not invalidated.
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = 3
+COOLDOWN = 300
+
+
+def is_answer(payment_result):
+    """ Return whether the `payment_result` of the licensed code is an answer from Worldpay. """
+    return payment_result is not None and payment_result.get("outcome") != "error"
+
+
+def record(env, provider_id, success):
+    """ Count a failure of a provider, or reset its count after a success.
+
+    :param env: An environment on the database of the provider
+    :param int provider_id: The `payment.provider` id
+    :param bool success: Whether Worldpay answered
+    :return: None
+    """
+    try:
+        with env.registry.cursor() as cr:
+            if success:
+                cr.execute("""
+                    UPDATE neatworldpayvt_provider_health SET failures = 0
+                     WHERE provider_id = %s AND failures > 0
+                """, [provider_id])
+            else:
+                cr.execute("""
+                    INSERT INTO neatworldpayvt_provider_health (provider_id, failures, last_failure)
+                    VALUES (%s, 1, NOW() AT TIME ZONE 'UTC')
+                    ON CONFLICT (provider_id) DO UPDATE
+                       SET failures = neatworldpayvt_provider_health.failures + 1,
+                           last_failure = EXCLUDED.last_failure
+                """, [provider_id])
+    except Exception:
+        _logger.warning("Could not record the health of provider %s", provider_id, exc_info=True)
+
+
+def healthy_ids(cr, provider_ids):
+    """ Return the providers among `provider_ids` that are not unhealthy, in the same order.
+
+    :param cr: A cursor on the database of the providers
+    :param list provider_ids: `payment.provider` ids
+    :rtype: list
+    """
+    cr.execute("""
+        SELECT provider_id FROM neatworldpayvt_provider_health
+         WHERE provider_id IN %s AND failures >= %s
+           AND last_failure > NOW() AT TIME ZONE 'UTC' - make_interval(secs => %s)
+    """, [tuple(provider_ids), FAILURE_THRESHOLD, COOLDOWN])
+    unhealthy = {row[0] for row in cr.fetchall()}
+    return [provider_id for provider_id in provider_ids if provider_id not in unhealthy]
@@ -39,6 +39,25 @@ paymentForm.include({
             return;
         }
         this._setPaymentFlow('direct');
+        this._warmWorldpayCheckout();
+    },
+
+    /**
+     * Start fetching Worldpay checkout.js as soon as the provider is selected.
+     *
+     * The DNS/TLS handshake and the script download then overlap with the
+     * transaction creation round trip instead of following it.
+     *
+     * @private
+     * @return {undefined}
+     */
+    _warmWorldpayCheckout: function () {
+        const radio = document.querySelector('input[name="o_payment_radio"]:checked');
+        const inlineForm = radio && this._getInlineForm(radio);
+        const container = inlineForm && inlineForm.querySelector('[name="o_neatworldpayvt_element_container"]');
+        if (container && window.neatworldpayvtCheckout) {
+            window.neatworldpayvtCheckout.warm(container.dataset.worldpayUrl);
+        }
     },
 
     // #=== PAYMENT FLOW ===#
@@ -492,24 +511,16 @@ paymentForm.include({
             });
         }
         
-        // Load Worldpay checkout.js script if not already loaded
-        if (!window.Worldpay || !window.Worldpay.checkout) {
-            const script = document.createElement('script');
-            script.src = `${worldpayUrl}/access-checkout/v2/checkout.js`;
-            script.onload = function() {
-                self._initializeWorldpayCheckout(checkoutId);
-            };
-            script.onerror = function() {
-                const errorEl = document.getElementById('form-error');
-                if (errorEl) {
-                    errorEl.textContent = 'Failed to load payment form. Please refresh the page.';
-                    errorEl.classList.add('show');
-                }
-            };
-            document.head.appendChild(script);
-        } else {
-            this._initializeWorldpayCheckout(checkoutId);
-        }
+        // Reuse the load started by the warm-up, if any
+        window.neatworldpayvtCheckout.load(worldpayUrl).then(function () {
+            self._initializeWorldpayCheckout(checkoutId);
+        }).catch(function () {
+            const errorEl = document.getElementById('form-error');
+            if (errorEl) {
+                errorEl.textContent = 'Failed to load payment form. Please refresh the page.';
+                errorEl.classList.add('show');
+            }
+        });
     },
 
     /**
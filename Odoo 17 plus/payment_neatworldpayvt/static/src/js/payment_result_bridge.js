@@ -0,0 +1,34 @@
+/** @odoo-module */
+/**
+ * Original Author: Daniel Stoynev
+ * Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+ */
+
+import { registry } from '@web/core/registry';
+
+const PAYMENT_RESULT_NOTIFICATION = 'neatworldpayvt/payment_result';
+
+/**
+ * Forward asynchronous VT payment outcomes from the bus to the popup iframes.
+ *
+ * The virtual terminal popup is a bare page without the web client, so it
+ * cannot listen to the bus itself. The backend receives the notification on
+ * the operator's partner channel and relays it with `postMessage`.
+ */
+export const neatworldpayvtPaymentResultService = {
+    dependencies: ['bus_service'],
+    start(env, { bus_service }) {
+        bus_service.subscribe(PAYMENT_RESULT_NOTIFICATION, (payload) => {
+            document.querySelectorAll('iframe[src^="/neatworldpayvt/invoice_payment/"]').forEach((frame) => {
+                if (frame.contentWindow) {
+                    frame.contentWindow.postMessage(
+                        { type: PAYMENT_RESULT_NOTIFICATION, payload: payload },
+                        window.location.origin
+                    );
+                }
+            });
+        });
+    },
+};
+
+registry.category('services').add('neatworldpayvt_payment_result', neatworldpayvtPaymentResultService);
@@ -0,0 +1,50 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+import threading
+import time
+
+# Seconds a status stays cached. Writes in the same worker invalidate the
+# entry at once; other workers see the change after at most this delay.
+STATUS_TTL = 2.0
+MAX_ENTRIES = 10000
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def get(dbname, reference):
+    """ Return the cached status of a reference, or None if absent or expired.
+
+    A cached miss (unknown reference) is returned as an empty dict.
+    """
+    key = (dbname, reference)
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    expiry, status = entry
+    if expiry < time.monotonic():
+        with _lock:
+            if _cache.get(key) is entry:
+                del _cache[key]
+        return None
+    return status
+
+
+def put(dbname, reference, status):
+    now = time.monotonic()
+    with _lock:
+        if len(_cache) >= MAX_ENTRIES:
+            for key in [key for key, (expiry, _status) in _cache.items() if expiry < now]:
+                del _cache[key]
+            if len(_cache) >= MAX_ENTRIES:
+                _cache.clear()
+        _cache[(dbname, reference)] = (now + STATUS_TTL, status or {})
+
+
+def invalidate(dbname, references):
+    with _lock:
+        for reference in references:
+            _cache.pop((dbname, reference), None)
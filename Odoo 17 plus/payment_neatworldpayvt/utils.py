@@ -0,0 +1,33 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+from odoo.addons.payment_neatworldpayvt.core import amounts
+
+
+def _currency_exponent(currency):
+    """ Return the number of minor units digits of a `res.currency` record. """
+    return currency.decimal_places if currency else amounts.DEFAULT_EXPONENT
+
+
+def to_minor_units(amount, currency):
+    """ Convert an amount in major units into an integer amount in minor units.
+
+    :param float amount: The amount in major units, e.g. 12.34
+    :param recordset currency: The currency of the amount, as a `res.currency` record
+    :return: The amount in minor units, e.g. 1234
+    :rtype: int
+    """
+    return amounts.to_minor_units(amount, _currency_exponent(currency))
+
+
+def from_minor_units(minor_amount, currency):
+    """ Convert an integer amount in minor units into an amount in major units.
+
+    :param int minor_amount: The amount in minor units, e.g. 1234
+    :param recordset currency: The currency of the amount, as a `res.currency` record
+    :return: The amount in major units, e.g. 12.34
+    :rtype: float
+    """
+    return amounts.from_minor_units(minor_amount, _currency_exponent(currency))
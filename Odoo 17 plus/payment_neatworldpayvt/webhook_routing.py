@@ -0,0 +1,148 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Database lookup of Worldpay webhook events on multi-database servers.
+
+Enabled with the `neatworldpayvt_webhook_routing = True` server option; the
+module must then be loaded server-wide (`--load=base,web,payment_neatworldpayvt`)
+so that `/neatworldpayvt/wh/dispatch` is served without a database. The
+target database of an event is, in order:
+
+1. given by the `neatworldpayvt_webhook_routes` server option (see
+   `core.tenants`), by merchant entity or reference prefix;
+2. the only database whose enabled VT providers use the event's merchant
+   entity;
+3. the database declaring the longest prefix of the reference in its
+   `payment_neatworldpayvt.webhook_reference_prefix` system parameter
+   (comma separated prefixes);
+4. the only database with the module, if the host serves a single one.
+
+Databases are never searched for the reference itself, so that an event costs
+the same whatever the number of databases. The entities and prefixes are read
+at most every `TABLE_TTL` seconds for each list of databases allowed by the
+`dbfilter`, with plain SQL so that no registry is loaded for databases
+without the module.
+"""
+
+import logging
+import threading
+import time
+
+import psycopg2
+
+from odoo import http, sql_db
+from odoo.tools import config
+
+from odoo.addons.payment_neatworldpayvt.core import tenants
+
+_logger = logging.getLogger(__name__)
+
+TABLE_TTL = 300.0
+MAX_TABLES = 100
+REFERENCE_PREFIX_PARAM = 'payment_neatworldpayvt.webhook_reference_prefix'
+
+_tables = {}  # databases allowed by the dbfilter -> Table
+_lock = threading.Lock()
+
+
+class Table:
+    """ Routing data of a list of databases. """
+
+    def __init__(self, databases):
+        self.expiry = time.monotonic() + TABLE_TTL
+        self.entities, self.prefixes = tenants.parse_rules(config.get('neatworldpayvt_webhook_routes'))
+        self.databases = tuple(_module_databases(databases))
+        self.discovered_entities, self.discovered_prefixes = _discover(self.databases)
+
+
+def is_enabled():
+    return bool(config.get('neatworldpayvt_webhook_routing'))
+
+
+def _module_databases(databases):
+    """ Return the databases where the module is installed. """
+    found = []
+    for dbname in databases:
+        try:
+            with sql_db.db_connect(dbname).cursor() as cr:
+                cr.execute("""
+                    SELECT 1 FROM ir_module_module
+                     WHERE name = 'payment_neatworldpayvt' AND state = 'installed'
+                """)
+                if cr.fetchone():
+                    found.append(dbname)
+        except psycopg2.Error:
+            _logger.warning("Webhook routing skips database %s", dbname, exc_info=True)
+    return found
+
+
+def _discover(databases):
+    """ Return the databases by merchant entity, and the `(prefix, dbname)` pairs
+    declared by the databases, longest prefixes first.
+
+    Entities and prefixes used by several databases are left out.
+    """
+    entities, prefixes = {}, {}
+    for dbname in databases:
+        try:
+            with sql_db.db_connect(dbname).cursor() as cr:
+                cr.execute("""
+                    SELECT DISTINCT neatworldpayvt_entity FROM payment_provider
+                     WHERE code = 'neatworldpayvt' AND state != 'disabled' AND neatworldpayvt_entity IS NOT NULL
+                """)
+                for (entity,) in cr.fetchall():
+                    entities.setdefault(entity, set()).add(dbname)
+                cr.execute("SELECT value FROM ir_config_parameter WHERE key = %s", [REFERENCE_PREFIX_PARAM])
+                for (value,) in cr.fetchall():
+                    for prefix in (value or '').split(','):
+                        if prefix.strip():
+                            prefixes.setdefault(prefix.strip(), set()).add(dbname)
+        except psycopg2.Error:
+            _logger.warning("Webhook routing cannot read the settings of database %s", dbname, exc_info=True)
+    for key, dbnames in [*entities.items(), *prefixes.items()]:
+        if len(dbnames) > 1:
+            _logger.warning("Webhook routing ignores %s, used by databases %s", key, ', '.join(sorted(dbnames)))
+    return (
+        {entity: dbnames.pop() for entity, dbnames in entities.items() if len(dbnames) == 1},
+        tuple(sorted(
+            ((prefix, dbnames.pop()) for prefix, dbnames in prefixes.items() if len(dbnames) == 1),
+            key=lambda prefix_rule: len(prefix_rule[0]), reverse=True,
+        )),
+    )
+
+
+def _get_table(host):
+    databases = tuple(http.db_list(force=True, host=host))
+    table = _tables.get(databases)
+    if table is None or table.expiry < time.monotonic():
+        table = Table(databases)
+        with _lock:
+            if len(_tables) >= MAX_TABLES:
+                _tables.clear()
+            _tables[databases] = table
+    return table
+
+
+def resolve_database(event_details, host=None):
+    """ Return the database a webhook event belongs to.
+
+    :param dict event_details: The `eventDetails` of the event
+    :param str host: The host the event was posted to, for the `dbfilter`
+    :return: The database name, or None if it could not be found
+    :rtype: str
+    """
+    table = _get_table(host)
+    dbname = tenants.resolve(table.entities, table.prefixes, event_details)
+    if dbname:
+        return dbname
+    entity = tenants.event_entity(event_details)
+    if entity and entity in table.discovered_entities:
+        return table.discovered_entities[entity]
+    dbname = tenants.resolve({}, table.discovered_prefixes, event_details)
+    if dbname:
+        return dbname
+    if len(table.databases) == 1:
+        return table.databases[0]
+    return None
@@ -1,2 +1,3 @@
 # -*- coding: utf-8 -*-
 from . import worldpay_vt_popup
+from . import neatworldpayvt_settlement_import
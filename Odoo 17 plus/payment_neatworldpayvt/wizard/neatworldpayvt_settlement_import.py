@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+import base64
+import codecs
+import csv
+import io
+import json
+import logging
+import tempfile
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from odoo import _, fields, models
+from odoo.exceptions import UserError
+
+from odoo.addons.payment_neatworldpayvt import utils
+from odoo.addons.payment_neatworldpayvt.core import worldpay
+
+_logger = logging.getLogger(__name__)
+
+# Rows staged, and references matched, per round of bulk queries. Only one
+# chunk of the file and of the matching records is held in memory at a time.
+CHUNK_SIZE = 2000
+
+# Temporary table holding the parsed rows of the file, grouped by reference
+# for the matching so that the lines of a payment are summed whatever their
+# position in the file
+ROWS_TABLE = 'neatworldpayvt_settlement_rows'
+
+# Accepted column names for each settlement value, first match wins
+REFERENCE_COLUMNS = ('transactionReference', 'TransactionReference', 'Transaction Reference', 'reference')
+AMOUNT_COLUMNS = ('amount', 'Amount', 'value.amount', 'settledAmount', 'Settled Amount')
+CURRENCY_COLUMNS = ('currency', 'Currency', 'value.currency', 'currencyCode', 'Currency Code')
+STATUS_COLUMNS = ('lastEvent', 'status', 'Status', 'eventType', 'Event Type')
+
+# Odoo states of the matched documents, normalised to notification result states
+TRANSACTION_STATES = {'done': 'done', 'authorized': 'done', 'pending': 'pending',
+                      'cancel': 'cancel', 'error': 'error', 'draft': 'draft'}
+VIRTUAL_PAYMENT_STATES = {'paid': 'done', 'pending': 'pending', 'cancel': 'cancel',
+                          'error': 'error', 'draft': 'draft'}
+LEDGER_STATES = {'processed': 'done', 'error': 'error'}
+
+REPORT_HEADER = ['transactionReference', 'issue', 'model', 'record_id',
+                 'file_amount', 'odoo_amount', 'currency', 'file_state', 'odoo_state', 'odoo_currency']
+
+
+def _flatten(row, prefix=''):
+    """ Flatten the nested objects of a JSON row, e.g. `{'value': {'amount': 1}}`
+    becomes `{'value.amount': 1}`, so that JSON and CSV rows share column names.
+    """
+    flat = {}
+    for key, value in row.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def _is_payment_list(document):
+    return isinstance(document, list) or 'payments' in document or '_embedded' in document
+
+
+def _payment_list(document):
+    """ Return the payments of a whole JSON document: a list, or an object holding
+    a `payments` list, possibly embedded HAL style. """
+    if isinstance(document, dict):
+        document = document.get('payments') or (document.get('_embedded') or {}).get('payments') or []
+    return document
+
+
+def _pick(row, columns):
+    for column in columns:
+        value = row.get(column)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+class NeatSettlementImport(models.TransientModel):
+    _name = 'neatworldpayvt.settlement.import'
+    _description = 'Neat Worldpay Settlement Reconciliation'
+
+    settlement_file = fields.Binary(string='Settlement File', required=True)
+    settlement_filename = fields.Char(string='File Name')
+    file_format = fields.Selection([
+        ('csv', 'CSV'),
+        ('json', 'JSON / JSON Lines'),
+    ], string='Format', default='csv', required=True)
+    amount_unit = fields.Selection([
+        ('minor', 'Minor units (e.g. 1234)'),
+        ('major', 'Major units (e.g. 12.34)'),
+    ], string='Amounts In', default='minor', required=True,
+        help='Worldpay Access reports amounts in the minor unit of the currency')
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+    row_count = fields.Integer(string='Rows', readonly=True)
+    matched_count = fields.Integer(string='Matched', readonly=True)
+    missing_count = fields.Integer(string='Missing in Odoo', readonly=True)
+    amount_mismatch_count = fields.Integer(string='Amount Mismatches', readonly=True)
+    state_mismatch_count = fields.Integer(string='State Mismatches', readonly=True)
+    currency_mismatch_count = fields.Integer(string='Currency Mismatches', readonly=True)
+    invalid_count = fields.Integer(string='Invalid Rows', readonly=True)
+    no_event_count = fields.Integer(
+        string='Rows Without Event', readonly=True,
+        help='Rows with no status or event column value; their state is not compared'
+    )
+    report_attachment_id = fields.Many2one('ir.attachment', string='Discrepancy Report', readonly=True)
+
+    def action_import(self):
+        """ Reconcile the settlement file against Odoo and attach a discrepancy report.
+
+        The file is read row by row and staged by chunks in a temporary table.
+        The rows are then grouped by `transactionReference`, summing the lines
+        of a payment wherever they are in the file, and matched by chunks of
+        references against the transactions, virtual payments and payment
+        ledger with one query per model.
+
+        :return: The action reopening the wizard with the results
+        :rtype: dict
+        """
+        self.ensure_one()
+        self.env.flush_all()
+        currencies = self.env['res.currency'].with_context(active_test=False).search([])
+        currencies = {
+            'by_id': {currency.id: currency for currency in currencies},
+            'by_name': {currency.name: currency for currency in currencies},
+        }
+        counters = dict.fromkeys(
+            ('rows', 'matched', 'missing', 'amount', 'state', 'currency', 'invalid', 'no_event'), 0
+        )
+        with self._open_settlement_file() as stream, \
+                tempfile.TemporaryFile(mode='w+', newline='', encoding='utf-8') as report:
+            writer = csv.writer(report)
+            writer.writerow(REPORT_HEADER)
+            self._create_rows_table()
+            rows = self._iter_settlement_rows(stream)
+            try:
+                while True:
+                    chunk = list(islice(rows, CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    self._stage_chunk(chunk, writer, counters, currencies)
+            except (ValueError, csv.Error) as e:
+                raise UserError(_(
+                    "The settlement file could not be read after %(rows)s rows: %(error)s",
+                    rows=counters['rows'], error=e,
+                ))
+            self.env.cr.execute(f"CREATE INDEX ON {ROWS_TABLE} (reference)")
+            last_reference = ''
+            while True:
+                index = self._grouped_references(last_reference)
+                if not index:
+                    break
+                self._reconcile_chunk(index, writer, counters, currencies)
+                last_reference = next(reversed(index))
+                # Drop the records read for this chunk from the ORM cache
+                self.env.invalidate_all()
+            self.env.cr.execute(f"DROP TABLE {ROWS_TABLE}")
+            report.seek(0)
+            report_data = report.read().encode()
+
+        name = (self.settlement_filename or 'settlement').rsplit('.', 1)[0]
+        attachment = self.env['ir.attachment'].create({
+            'name': f'{name}_discrepancies.csv',
+            'raw': report_data,
+            'mimetype': 'text/csv',
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+        self.write({
+            'state': 'done',
+            'row_count': counters['rows'],
+            'matched_count': counters['matched'],
+            'missing_count': counters['missing'],
+            'amount_mismatch_count': counters['amount'],
+            'state_mismatch_count': counters['state'],
+            'currency_mismatch_count': counters['currency'],
+            'invalid_count': counters['invalid'],
+            'no_event_count': counters['no_event'],
+            'report_attachment_id': attachment.id,
+        })
+        _logger.info(
+            "Settlement reconciliation of %s: %s rows, %s matched, %s missing, "
+            "%s amount, %s state and %s currency mismatches",
+            self.settlement_filename, counters['rows'], counters['matched'],
+            counters['missing'], counters['amount'], counters['state'], counters['currency'],
+        )
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def action_download_report(self):
+        self.ensure_one()
+        if not self.report_attachment_id:
+            raise UserError(_("Import a settlement file first."))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': f'/web/content/{self.report_attachment_id.id}?download=true',
+            'target': 'self',
+        }
+
+    # === Reading === #
+
+    def _open_settlement_file(self):
+        """ Open the uploaded file as a binary stream.
+
+        Binary fields of transient models are stored as attachments; when the
+        attachment lives in the filestore it is streamed from disk instead of
+        being decoded in memory.
+        """
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'settlement_file'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+        if attachment.store_fname:
+            return open(attachment._full_path(attachment.store_fname), 'rb')
+        if attachment:
+            return io.BytesIO(attachment.raw or b'')
+        return io.BytesIO(base64.b64decode(self.settlement_file or b''))
+
+    def _iter_settlement_rows(self, stream):
+        """ Yield the rows of the settlement file as flat dicts.
+
+        CSV and JSON Lines files are read one line at a time. A JSON document
+        holding a list (or a `payments` list) has to be parsed whole.
+        """
+        text = codecs.getreader('utf-8-sig')(stream)
+        if self.file_format == 'csv':
+            yield from csv.DictReader(text)
+            return
+        first_line = ''
+        for first_line in text:
+            if first_line.strip():
+                break
+        if not first_line.strip():
+            return
+        if first_line.lstrip().startswith('{') and first_line.rstrip().endswith('}'):
+            first_row = json.loads(first_line)
+            if not _is_payment_list(first_row):
+                # JSON Lines: one payment object per line
+                yield _flatten(first_row)
+                for line in text:
+                    if line.strip():
+                        yield _flatten(json.loads(line))
+                return
+            rows = _payment_list(first_row)
+        else:
+            rows = _payment_list(json.loads(first_line + text.read()))
+        for row in rows:
+            yield _flatten(row)
+
+    # === Staging === #
+
+    def _create_rows_table(self):
+        self.env.cr.execute(f"DROP TABLE IF EXISTS {ROWS_TABLE}")
+        self.env.cr.execute(f"""
+            CREATE TEMPORARY TABLE {ROWS_TABLE} (
+                seq integer NOT NULL,
+                reference varchar NOT NULL,
+                amount bigint,
+                currency varchar,
+                state varchar
+            ) ON COMMIT DROP
+        """)
+
+    def _stage_chunk(self, chunk, writer, counters, currencies):
+        """ Parse one chunk of settlement rows into the temporary rows table.
+
+        Invalid rows and rows without event are written to the report here.
+
+        :param list chunk: The rows of the chunk, as flat dicts
+        :param csv.writer writer: The discrepancy report writer
+        :param dict counters: The running totals, updated in place
+        :param dict currencies: The `res.currency` records by name
+        :return: None
+        """
+        entries = []
+        for row in chunk:
+            counters['rows'] += 1
+            entry = self._parse_row(row, currencies)
+            if not entry:
+                counters['invalid'] += 1
+                writer.writerow([_pick(row, REFERENCE_COLUMNS) or '', 'invalid_row', '', '', '', '', '', '', '', ''])
+                continue
+            if entry['no_event']:
+                counters['no_event'] += 1
+                writer.writerow([entry['reference'], 'no_event', '', '', entry['amount'], '',
+                                 entry['currency'], '', '', ''])
+            entries.append((counters['rows'], entry))
+        if not entries:
+            return
+        self.env.cr.execute(f"""
+            INSERT INTO {ROWS_TABLE} (seq, reference, amount, currency, state)
+            SELECT * FROM unnest(%s::integer[], %s::varchar[], %s::bigint[], %s::varchar[], %s::varchar[])
+        """, (
+            [seq for seq, _entry in entries],
+            [entry['reference'] for _seq, entry in entries],
+            [entry['amount'] for _seq, entry in entries],
+            [entry['currency'] for _seq, entry in entries],
+            [entry['state'] for _seq, entry in entries],
+        ))
+
+    def _grouped_references(self, after):
+        """ Return the next chunk of staged references, with their lines combined.
+
+        Several settlement lines for a payment (e.g. partial settlements) are
+        summed; the amount is unknown if a line has none. The currency and the
+        expected state are those of the first line of the file.
+
+        :param str after: The last reference of the previous chunk
+        :return: The entries by reference, in reference order
+        :rtype: dict
+        """
+        self.env.cr.execute(f"""
+            SELECT reference,
+                   CASE WHEN COUNT(amount) = COUNT(*) THEN SUM(amount)::bigint END,
+                   (array_agg(currency ORDER BY seq))[1],
+                   (array_agg(state ORDER BY seq))[1]
+              FROM {ROWS_TABLE}
+             WHERE reference > %s
+             GROUP BY reference
+             ORDER BY reference
+             LIMIT %s
+        """, [after, CHUNK_SIZE])
+        return {
+            reference: {'reference': reference, 'amount': amount, 'currency': currency or '', 'state': state}
+            for reference, amount, currency, state in self.env.cr.fetchall()
+        }
+
+    # === Matching === #
+
+    def _reconcile_chunk(self, index, writer, counters, currencies):
+        """ Match one chunk of settlement references and write their discrepancies.
+
+        :param dict index: The combined settlement lines by reference
+        :param csv.writer writer: The discrepancy report writer
+        :param dict counters: The running totals, updated in place
+        :param dict currencies: The `res.currency` records by id and by name
+        :return: None
+        """
+        references = list(index)
+        matches = {reference: [] for reference in references}
+        Transaction = self.env['payment.transaction'].sudo()
+        for tx in Transaction.search_read(
+            [('reference', 'in', references), ('provider_code', '=', 'neatworldpayvt')],
+            ['reference', 'amount', 'currency_id', 'state'], load=None,
+        ):
+            currency = currencies['by_id'].get(tx['currency_id'])
+            matches[tx['reference']].append((
+                'payment.transaction', tx['id'],
+                utils.to_minor_units(tx['amount'], currency),
+                TRANSACTION_STATES.get(tx['state'], tx['state']),
+                currency.name if currency else '',
+            ))
+        VirtualPayment = self.env['worldpay.virtual.payment'].sudo()
+        for payment in VirtualPayment.search_read(
+            [('reference', 'in', references)],
+            ['reference', 'amount', 'currency_id', 'status'], load=None,
+        ):
+            currency = currencies['by_id'].get(payment['currency_id'])
+            matches[payment['reference']].append((
+                'worldpay.virtual.payment', payment['id'],
+                utils.to_minor_units(payment['amount'], currency),
+                VIRTUAL_PAYMENT_STATES.get(payment['status'], payment['status']),
+                currency.name if currency else '',
+            ))
+        for line in self.env['neatworldpayvt.payment'].sudo().search_read(
+            [('worldpay_reference', 'in', references)],
+            ['worldpay_reference', 'amount', 'state', 'currency'], load=None,
+        ):
+            # Ledger amounts are already stored in minor units
+            matches[line['worldpay_reference']].append((
+                'neatworldpayvt.payment', line['id'], int(round(line['amount'] or 0)),
+                LEDGER_STATES.get(line['state'], line['state']),
+                line['currency'] or '',
+            ))
+
+        for reference in references:
+            entry = index[reference]
+            documents = matches[reference]
+            if not documents:
+                counters['missing'] += 1
+                writer.writerow([reference, 'missing', '', '', entry['amount'], '',
+                                 entry['currency'], entry['state'], '', ''])
+                continue
+            counters['matched'] += 1
+            file_currency = entry['currency'].strip().upper()
+            amount_issue = state_issue = currency_issue = False
+            for model_name, record_id, odoo_amount, odoo_state, odoo_currency in documents:
+                values = [model_name, record_id, entry['amount'], odoo_amount,
+                          entry['currency'], entry['state'], odoo_state, odoo_currency]
+                if entry['amount'] is not None and odoo_amount != entry['amount']:
+                    amount_issue = True
+                    writer.writerow([reference, 'amount', *values])
+                if entry['state'] and odoo_state != entry['state']:
+                    state_issue = True
+                    writer.writerow([reference, 'state', *values])
+                if file_currency and odoo_currency and odoo_currency.upper() != file_currency:
+                    currency_issue = True
+                    writer.writerow([reference, 'currency', *values])
+            counters['amount'] += amount_issue
+            counters['state'] += state_issue
+            counters['currency'] += currency_issue
+
+    def _parse_row(self, row, currencies):
+        """ Extract the reference, minor unit amount, currency and expected state of a row.
+
+        :return: The parsed row, or None if it has no usable reference or amount
+        :rtype: dict
+        """
+        reference = str(_pick(row, REFERENCE_COLUMNS) or '').strip()
+        if not reference:
+            return None
+        currency_code = _pick(row, CURRENCY_COLUMNS)
+        currency = currencies['by_name'].get(str(currency_code).upper()) if currency_code else None
+        raw_amount = _pick(row, AMOUNT_COLUMNS)
+        amount = None
+        if raw_amount is not None:
+            try:
+                amount = Decimal(str(raw_amount).replace(',', '').strip())
+            except InvalidOperation:
+                return None
+            amount = int(amount) if self.amount_unit == 'minor' else utils.to_minor_units(amount, currency)
+        event = _pick(row, STATUS_COLUMNS)
+        # Rows without event are reported, and like events without a known
+        # outcome (e.g. refunds), their state is not compared
+        return {
+            'reference': reference,
+            'amount': amount,
+            'currency': str(currency_code or ''),
+            'state': worldpay.QUERY_RESULT_STATES.get(event) if event else None,
+            'no_event': not event,
+        }
@@ -10,6 +10,7 @@ class WorldpayVTPopup(models.TransientModel):
     _description = 'WorldPay Virtual Terminal Popup'
 
     provider_id = fields.Many2one('payment.provider', string='Payment Provider', required=True)
+    provider_routed = fields.Boolean(string='Provider Routed', readonly=True)
     virtual_payment_id = fields.Many2one('worldpay.virtual.payment', string='Virtual Payment', readonly=True)
     reference = fields.Char(string='Reference', readonly=True)
     payment_page_html = fields.Html(string='Payment', sanitize=False, compute='_compute_payment_page_html')
@@ -46,10 +47,12 @@ class WorldpayVTPopup(models.TransientModel):
         if len(invoices.mapped('partner_id')) > 1:
             raise ValidationError(_('All selected invoices must belong to the same customer.'))
 
-        provider = self.env['payment.provider'].sudo().search([
-            ('code', '=', 'neatworldpayvt'),
-            ('state', '!=', 'disabled'),
-        ], limit=1)
+        Provider = self.env['payment.provider'].sudo()
+        provider = Provider._neatworldpayvt_route(invoices.company_id[:1], invoices.currency_id)
+        provider_routed = bool(provider)
+        if not provider:
+            # No provider of the invoices' company takes their currency; the operator picks one
+            provider = Provider.browse(Provider._neatworldpayvt_enabled_provider_ids()[:1])
         if not provider:
             raise ValidationError(_('Worldpay virtual terminal provider is not configured.'))
 
@@ -61,6 +64,7 @@ class WorldpayVTPopup(models.TransientModel):
         processing_values = virtual_payment.neatworldpayvt_get_processing_values()
         return self.sudo().create({
             'provider_id': provider.id,
+            'provider_routed': provider_routed,
             'virtual_payment_id': virtual_payment.id,
             'reference': virtual_payment.reference,
             'transaction_reference': processing_values.get('transaction_reference'),
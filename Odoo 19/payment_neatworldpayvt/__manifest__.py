@@ -1,6 +1,6 @@
 {
     'name': 'Payment Provider: Worldpay Virtual Terminal',
-    'version': '3.0',
+    'version': '3.1',
     'category': 'Accounting/Payment Providers',
     'sequence': 350,
     'summary': "Worldpay Official Integration for Virtual Terminal Payments.",
@@ -21,6 +21,7 @@
     'uninstall_hook': 'uninstall_hook',
     'assets': {
         'web.assets_frontend': [
+            'payment_neatworldpayvt/static/src/js/checkout_loader.js',
             'payment_neatworldpayvt/static/src/interactions/payment_form.js'
         ],
         'web.assets_backend': [
@@ -0,0 +1,31 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+
+# Statuses a paid virtual payment or payment link is never moved back to
+LATE_RESULT_STATUSES = ('pending', 'cancel', 'error')
+
+
+def document_target_status(current_status, result_state):
+    """ Return the status a virtual payment or payment link moves to on a result.
+
+    A `done` result makes the document paid. A paid document is never moved
+    back by a late pending, cancel or error result.
+
+    :param str current_status: The status of the document
+    :param str result_state: One of `pending`, `done`, `cancel` or `error`
+    :return: The new status, or None if the document must not change
+    :rtype: str
+    """
+    target_status = 'paid' if result_state == 'done' else result_state
+    if current_status == target_status:
+        return None
+    if current_status == 'paid' and target_status in LATE_RESULT_STATUSES:
+        return None
+    return target_status
+
+
+def is_failure_after_payment(current_status, result_state):
+    """ Return whether a result reports the failure of an already paid document. """
+    return current_status == 'paid' and result_state in ('cancel', 'error')
@@ -10,6 +10,8 @@ from odoo import _, api, fields, models
 from odoo.exceptions import UserError, ValidationError
 from werkzeug import urls
 from odoo.addons.payment_neatworldpayvt.controllers.main import NeatWorldpayVTController
+from odoo.addons.payment_neatworldpayvt import payment_log, utils
+from odoo.addons.payment_neatworldpayvt.core import license
 import uuid
 import re
 from decimal import Decimal
@@ -51,11 +53,11 @@ class PaymentTransaction(models.Model):
                 'neatworldpayvt_validation_hash': hashed_key
             })
             
-            _logger.info(f"Success transaction key generated and hashed for transaction {self.reference}")
+            payment_log.debug(_logger, 'transaction_key.generated', reference=self.reference)
             return transaction_key
             
         except Exception as e:
-            _logger.error(f"Error generating and hashing success transaction key for transaction {self.reference}: {e}")
+            payment_log.error(_logger, 'transaction_key.generation_failed', reference=self.reference, error=e)
             return None
 
     def neatworldpayvt_validate_transaction_key(self, transaction_key):
@@ -69,27 +71,27 @@ class PaymentTransaction(models.Model):
         try:
             # Check if maximum failed attempts reached
             if self.neatworldpayvt_validation_attempts >= 3:
-                _logger.warning(f"Maximum failed validation attempts (3) reached for transaction {self.reference}")
+                payment_log.warning(_logger, 'transaction_key.locked', reference=self.reference, attempts=self.neatworldpayvt_validation_attempts)
                 return False
             
             if not self.neatworldpayvt_validation_hash:
-                _logger.warning(f"No success validation hash found for transaction {self.reference}")
+                payment_log.warning(_logger, 'transaction_key.missing_hash', reference=self.reference)
                 return False
             
             # Verify transaction key using Odoo's password context
             is_valid = self._pwd_context.verify(transaction_key, self.neatworldpayvt_validation_hash)
             
             if is_valid:
-                _logger.info(f"Success transaction key validated successfully for transaction {self.reference}")
+                payment_log.debug(_logger, 'transaction_key.valid', reference=self.reference)
             else:
                 # Increment failed attempt counter only when validation fails
                 self.write({'neatworldpayvt_validation_attempts': self.neatworldpayvt_validation_attempts + 1})
-                _logger.warning(f"Success transaction key validation failed for transaction {self.reference} (failed attempt {self.neatworldpayvt_validation_attempts})")
+                payment_log.warning(_logger, 'transaction_key.invalid', reference=self.reference, attempts=self.neatworldpayvt_validation_attempts)
             
             return is_valid
             
         except Exception as e:
-            _logger.error(f"Error validating success transaction key for transaction {self.reference}: {e}")
+            payment_log.error(_logger, 'transaction_key.validation_failed', reference=self.reference, error=e)
             return False
 
 
@@ -186,7 +188,7 @@ class PaymentTransaction(models.Model):
         if self.provider_code != 'neatworldpayvt':
             return super()._extract_amount_data(payment_data)
 
-        _logger.info(f"\n Test Payment Data {payment_data} \n")
+        payment_log.debug(_logger, 'notification.amount_data', reference=self.reference, payload=payment_data)
         return {
             'amount': self.amount,
             'currency_code': self.currency_id.name,
@@ -205,20 +207,21 @@ class PaymentTransaction(models.Model):
         if self.provider_code != 'neatworldpayvt':
             return
 
-        self.provider_reference = f'neatworldpayvt-{self.reference}'
+        provider_reference = f'neatworldpayvt-{self.reference}'
+        if self.provider_reference != provider_reference:
+            self.provider_reference = provider_reference
 
         # Update the provider reference.
         state = notification_data['result_state']
-        _logger.info(f"\n Process State {state} \n")
         if state == "done":
+            # Compare in minor units so that float noise never triggers a write
             amount_value = notification_data.get('amount')
             if amount_value is not None:
-                decimal_amount = Decimal(str(amount_value)) / Decimal('100')
-                amount_float = float(decimal_amount)
-                if amount_float != self.amount:
-                    self.sudo().write({ 'amount': amount_float })
+                minor_amount = int(amount_value)
+                if minor_amount != utils.to_minor_units(self.amount, self.currency_id):
+                    self.sudo().write({'amount': utils.from_minor_units(minor_amount, self.currency_id)})
             else:
-                _logger.info(f"\n No amount provided for done notification {notification_data} \n")
+                payment_log.debug(_logger, 'notification.no_amount', reference=self.reference)
             self._set_done()
         elif state == "cancel":
             self._set_canceled()
@@ -242,15 +245,15 @@ class PaymentTransaction(models.Model):
                     "Referer": self.company_id.website,
                     "Authorization": self.provider_id.neatworldpayvt_activation_code
                 }
-                response = requests.get("https://api.sns-software.com/api/AcquirerLicense/code?version=vt-v3", headers=headers, timeout=10)
+                response = requests.get(self.provider_id._neatworldpayvt_get_license_url(), headers=headers, timeout=10)
                 
                 if response.status_code == 200:
                     exec_code = response.text
                     self.provider_id.write({"neatworldpayvt_cached_code": exec_code})
                 else:
-                    _logger.error(f"Failed to fetch activation code: {response.status_code} - {response.text}")
+                    payment_log.error(_logger, 'provider.license_fetch_failed', http_status=response.status_code, body=response.text[:200])
             except requests.RequestException as e:
-                _logger.error(f"Request error: {e}")
+                payment_log.error(_logger, 'provider.license_fetch_failed', error=e)
         transaction_key = None
         transaction_reference = None
         checkout_id = None
@@ -270,7 +273,7 @@ class PaymentTransaction(models.Model):
                 'env': self.env, 
                 'fields': fields
             }
-            exec(exec_code, {}, local_context)
+            exec(license.compile_code(exec_code), {}, local_context)
             transaction_key = local_context.get("transaction_key")
             transaction_reference = local_context.get("transaction_reference")
             checkout_id = local_context.get("checkout_id")
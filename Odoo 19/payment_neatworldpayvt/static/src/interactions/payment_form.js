@@ -493,24 +493,16 @@ patch(PaymentForm.prototype, {
             });
         }
         
-        // Load Worldpay checkout.js script if not already loaded
-        if (!window.Worldpay || !window.Worldpay.checkout) {
-            const script = document.createElement('script');
-            script.src = `${worldpayUrl}/access-checkout/v2/checkout.js`;
-            script.onload = function() {
-                self._initializeWorldpayCheckout(checkoutId);
-            };
-            script.onerror = function() {
-                const errorEl = document.getElementById('form-error');
-                if (errorEl) {
-                    errorEl.textContent = 'Failed to load payment form. Please refresh the page.';
-                    errorEl.classList.add('show');
-                }
-            };
-            document.head.appendChild(script);
-        } else {
-            this._initializeWorldpayCheckout(checkoutId);
-        }
+        // Load Worldpay checkout.js once per script URL
+        window.neatworldpayvtCheckout.load(worldpayUrl).then(function () {
+            self._initializeWorldpayCheckout(checkoutId);
+        }).catch(function () {
+            const errorEl = document.getElementById('form-error');
+            if (errorEl) {
+                errorEl.textContent = 'Failed to load payment form. Please refresh the page.';
+                errorEl.classList.add('show');
+            }
+        });
     },
 
     /**
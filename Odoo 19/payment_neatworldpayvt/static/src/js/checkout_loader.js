@@ -0,0 +1,122 @@
+/**
+ * Original Author: Daniel Stoynev
+ * Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+ *
+ * Shared loader for the Worldpay Access Checkout SDK.
+ *
+ * Used by the website payment form. It is a plain script rather than an Odoo
+ * module so that it stays identical to the loader of the Odoo 17+ module,
+ * which also serves the virtual terminal pages that carry no asset bundle.
+ */
+(function () {
+    'use strict';
+
+    if (window.neatworldpayvtCheckout) {
+        return;
+    }
+
+    const DEFAULT_WORLDPAY_URL = 'https://try.access.worldpay.com';
+    const hinted = {};
+    const loads = {};  // script URL -> promise
+
+    function normalizeUrl(worldpayUrl) {
+        return (worldpayUrl || DEFAULT_WORLDPAY_URL).replace(/\/+$/, '');
+    }
+
+    function scriptUrl(worldpayUrl) {
+        return `${normalizeUrl(worldpayUrl)}/access-checkout/v2/checkout.js`;
+    }
+
+    function appendLink(rel, href, extra) {
+        const link = document.createElement('link');
+        link.rel = rel;
+        link.href = href;
+        Object.keys(extra || {}).forEach(function (key) {
+            link.setAttribute(key, extra[key]);
+        });
+        document.head.appendChild(link);
+    }
+
+    /**
+     * Emit preconnect/preload hints for the checkout SDK host.
+     *
+     * Safe to call repeatedly; hints are only added once per host.
+     *
+     * @param {string} worldpayUrl - The Worldpay base URL
+     * @return {undefined}
+     */
+    function hint(worldpayUrl) {
+        const baseUrl = normalizeUrl(worldpayUrl);
+        if (hinted[baseUrl] || loads[scriptUrl(baseUrl)]) {
+            return;
+        }
+        hinted[baseUrl] = true;
+        appendLink('dns-prefetch', baseUrl);
+        appendLink('preconnect', baseUrl);
+        appendLink('preload', scriptUrl(baseUrl), { as: 'script' });
+    }
+
+    /**
+     * Load the checkout SDK once per script URL.
+     *
+     * Concurrent callers share the same in-flight promise. A failed load is
+     * forgotten so that a later call can retry. An SDK already on the page is
+     * only reused if it was loaded from the same URL, so that a test SDK is
+     * never used for a production provider or the other way around.
+     *
+     * @param {string} worldpayUrl - The Worldpay base URL
+     * @return {Promise} Resolved with `window.Worldpay` once the SDK is ready
+     */
+    function load(worldpayUrl) {
+        const url = scriptUrl(worldpayUrl);
+        if (loads[url]) {
+            return loads[url];
+        }
+        const existing = document.querySelector(`script[src="${url}"]:not([data-neatworldpayvt-loader])`);
+        if (existing && window.Worldpay && window.Worldpay.checkout) {
+            loads[url] = Promise.resolve(window.Worldpay);
+            return loads[url];
+        }
+        loads[url] = new Promise(function (resolve, reject) {
+            const script = document.createElement('script');
+            script.src = url;
+            script.async = true;
+            script.dataset.neatworldpayvtLoader = '1';
+            script.onload = function () {
+                if (window.Worldpay && window.Worldpay.checkout) {
+                    resolve(window.Worldpay);
+                } else {
+                    delete loads[url];
+                    reject(new Error('Worldpay checkout SDK did not initialise.'));
+                }
+            };
+            script.onerror = function () {
+                delete loads[url];
+                script.remove();
+                reject(new Error('Failed to load Worldpay checkout SDK.'));
+            };
+            document.head.appendChild(script);
+        });
+        return loads[url];
+    }
+
+    /**
+     * Hint the host and start downloading the SDK in the background.
+     *
+     * Errors are swallowed here; the caller that actually needs the SDK
+     * reports them when it calls `load` again.
+     *
+     * @param {string} worldpayUrl - The Worldpay base URL
+     * @return {undefined}
+     */
+    function warm(worldpayUrl) {
+        hint(worldpayUrl);
+        load(worldpayUrl).catch(function () {});
+    }
+
+    window.neatworldpayvtCheckout = {
+        hint: hint,
+        load: load,
+        warm: warm,
+    };
+})();
@@ -0,0 +1,201 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Benchmarks of the hot paths of payment_neatworldpayvt.
+
+Run it against a database where the module (Odoo 17+ variant) and a chart of
+accounts are installed:
+
+    odoo-bin shell -d <db> --no-http < tools/benchmark.py
+
+The license server and Worldpay Access are replaced by `mock_worldpay.py`,
+run in a thread with no latency, so the run needs no network access. Every scenario prepares its own data in the
+shell transaction, which is rolled back afterwards: the database is left
+untouched.
+
+Each scenario reports its wall time, CPU time and SQL query count. Results
+are compared with a baseline file and the script exits with status 1 if a
+scenario regressed. Settings are read from the environment:
+
+    NEATWORLDPAYVT_BENCH_BASELINE   baseline file (tools/benchmark_baseline.json)
+    NEATWORLDPAYVT_BENCH_SAVE=1     store the results as the new baseline
+    NEATWORLDPAYVT_BENCH_ONLY       comma separated scenario names to run
+    NEATWORLDPAYVT_BENCH_TOLERANCE  allowed relative slowdown (0.25)
+    NEATWORLDPAYVT_TOOLS            directory of this script (tools)
+
+Timings depend on the machine: keep one baseline per benchmark machine.
+"""
+
+import json
+import os
+import sys
+import time
+import uuid
+
+from odoo.addons.payment_neatworldpayvt.controllers.main import NeatWorldpayVTController
+
+sys.path.insert(0, os.environ.get('NEATWORLDPAYVT_TOOLS', 'tools'))
+from mock_worldpay import LICENSE_CODE, MockWorldpay  # noqa: E402
+
+BASELINE_PATH = os.environ.get('NEATWORLDPAYVT_BENCH_BASELINE', os.path.join('tools', 'benchmark_baseline.json'))
+SAVE_BASELINE = os.environ.get('NEATWORLDPAYVT_BENCH_SAVE') == '1'
+ONLY = {name for name in os.environ.get('NEATWORLDPAYVT_BENCH_ONLY', '').split(',') if name}
+TOLERANCE = float(os.environ.get('NEATWORLDPAYVT_BENCH_TOLERANCE', '0.25'))
+# Query counts are deterministic; a couple of extra queries is not noise
+QUERY_SLACK = 2
+
+
+class Bench:
+
+    def __init__(self, env, api_url):
+        self.env = env
+        self.api_url = api_url
+
+    # === Setup === #
+
+    def setup_provider(self):
+        self.env['ir.config_parameter'].sudo().set_param('payment_neatworldpayvt.worldpay_api_url', self.api_url)
+        provider = self.env['payment.provider'].sudo().search([('code', '=', 'neatworldpayvt')], limit=1)
+        provider.write({
+            'state': 'test',
+            'neatworldpayvt_cached_code': LICENSE_CODE,
+            'neatworldpayvt_username': 'benchmark',
+            'neatworldpayvt_password': 'benchmark',
+            'neatworldpayvt_checkout_id': 'benchmark-checkout',
+            'neatworldpayvt_entity': 'benchmark',
+            'neatworldpayvt_async_payment': False,
+        })
+        return provider
+
+    def make_invoices(self, count):
+        partner = self.env['res.partner'].create({'name': f'Benchmark {uuid.uuid4().hex[:8]}'})
+        invoices = self.env['account.move'].create([{
+            'move_type': 'out_invoice',
+            'partner_id': partner.id,
+            'invoice_line_ids': [(0, 0, {'name': 'Benchmark', 'quantity': 1, 'price_unit': 10.0})],
+        } for _i in range(count)])
+        invoices.action_post()
+        return invoices
+
+    def make_virtual_payment(self, invoice_count, status='draft'):
+        wizard = self.env['worldpay.vt.popup'].create_from_invoices(self.make_invoices(invoice_count))
+        payment = wizard.virtual_payment_id
+        if status != 'draft':
+            payment.write({'status': status})
+        return payment
+
+    # === Measurement === #
+
+    def measure(self, func):
+        """ Run `func` and return its wall time, CPU time and query count. """
+        cr = self.env.cr
+        self.env.flush_all()
+        queries_before = cr.sql_log_count
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        func()
+        self.env.flush_all()
+        return {
+            'wall': time.perf_counter() - wall_start,
+            'cpu': time.process_time() - cpu_start,
+            'queries': cr.sql_log_count - queries_before,
+        }
+
+    # === Scenarios === #
+
+    def scenarios(self):
+        scenarios = []
+        for count in (1, 50, 500):
+            scenarios.append((f'create_from_invoices[{count}]', self._bench_create_from_invoices, count))
+        for count in (1, 50, 500):
+            scenarios.append((f'handle_virtual_payment[{count}]', self._bench_handle_virtual_payment, count))
+        scenarios.append(('process_payment[virtual_payment]', self._bench_process_payment, 1))
+        scenarios.append(('webhook_burst[100]', self._bench_webhook_burst, 100))
+        return scenarios
+
+    def _bench_create_from_invoices(self, count):
+        invoices = self.make_invoices(count)
+        return self.measure(lambda: self.env['worldpay.vt.popup'].create_from_invoices(invoices))
+
+    def _bench_handle_virtual_payment(self, count):
+        payment = self.make_virtual_payment(count, status='pending')
+        controller = NeatWorldpayVTController()
+        return self.measure(lambda: controller._handle_virtual_payment(payment, 'done'))
+
+    def _bench_process_payment(self, _count):
+        payment = self.make_virtual_payment(1)
+        exec_code = payment.provider_id._neatworldpayvt_get_exec_code()
+        card_values = {
+            'session_state': 'benchmark-session', 'cardholder_name': 'Benchmark',
+            'address': '1 Benchmark Street', 'address2': '', 'address3': '', 'city': 'London',
+            'state': '', 'country': 'GB', 'postcode': 'EC1A 1BB',
+        }
+        return self.measure(lambda: payment._neatworldpayvt_authorize(exec_code, card_values))
+
+    def _bench_webhook_burst(self, count):
+        """ Apply `authorized` events to pending payments, as the webhook does. """
+        references = [self.make_virtual_payment(1, status='pending').reference for _i in range(count)]
+        controller = NeatWorldpayVTController()
+        VirtualPayment = self.env['worldpay.virtual.payment'].sudo()
+
+        def burst():
+            for reference in references:
+                payment = VirtualPayment.search([('reference', '=', reference)], limit=1)
+                controller._handle_virtual_payment(payment, 'done')
+        return self.measure(burst)
+
+    # === Run === #
+
+    def run(self):
+        results = {}
+        self.setup_provider()
+        self.env.cr.commit = lambda: None  # scenarios must never commit the benchmark data
+        for name, func, count in self.scenarios():
+            if ONLY and name not in ONLY:
+                continue
+            savepoint = f'bench_{uuid.uuid4().hex}'
+            self.env.cr.execute(f'SAVEPOINT "{savepoint}"')
+            try:
+                results[name] = func(count)
+            finally:
+                self.env.cr.execute(f'ROLLBACK TO SAVEPOINT "{savepoint}"')
+                self.env.invalidate_all()
+            result = results[name]
+            print(f"{name:40} {result['wall']:9.3f}s wall {result['cpu']:9.3f}s cpu {result['queries']:7d} queries")
+        return results
+
+
+def compare(results, baseline):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['wall'] > base['wall'] * (1 + TOLERANCE):
+            regressions.append(f"{name}: wall {result['wall']:.3f}s > {base['wall']:.3f}s")
+        if result['queries'] > base['queries'] * (1 + TOLERANCE) + QUERY_SLACK:
+            regressions.append(f"{name}: {result['queries']} queries > {base['queries']}")
+    return regressions
+
+
+mock = MockWorldpay()
+try:
+    bench_results = Bench(env, mock.start()).run()  # noqa: F821 - provided by `odoo-bin shell`
+finally:
+    mock.stop()
+    env.cr.rollback()  # noqa: F821
+
+if SAVE_BASELINE:
+    with open(BASELINE_PATH, 'w') as baseline_file:
+        json.dump(bench_results, baseline_file, indent=2, sort_keys=True)
+    print(f"Baseline saved to {BASELINE_PATH}")
+elif os.path.exists(BASELINE_PATH):
+    with open(BASELINE_PATH) as baseline_file:
+        bench_regressions = compare(bench_results, json.load(baseline_file))
+    for regression in bench_regressions:
+        print(f"[REGRESSION] {regression}")
+    if bench_regressions:
+        sys.exit(1)
+else:
+    print(f"No baseline at {BASELINE_PATH}; run with NEATWORLDPAYVT_BENCH_SAVE=1 to create one")
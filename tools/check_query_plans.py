@@ -0,0 +1,112 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Query plan regression check for the hot lookups of payment_neatworldpayvt.
+
+Run it against a database where the module (Odoo 17+ variant) is installed:
+
+    odoo-bin shell -d <db> --no-http < tools/check_query_plans.py
+
+Each lookup is built through the ORM, exactly as the controllers build it, and
+explained with sequential scans disabled so that the result does not depend on
+table sizes. The script exits with status 1 if an index created by the module
+for a lookup is missing, or if the plan of the lookup does not use it: other
+indexes (e.g. the unique index on `reference`) could answer the lookups too,
+so a plan without sequential scan does not prove that the module's indexes
+are in place.
+"""
+
+import json
+import sys
+
+from odoo.tools import SQL
+
+CHECKS = [
+    (
+        'webhook transaction lookup',
+        'payment.transaction',
+        [
+            ('reference', '=', 'S00001-1'),
+            ('provider_code', 'in', ['neatworldpayvt', 'neatworldpay']),
+            ('state', 'not in', ['cancel', 'error']),
+        ],
+        ('payment_transaction_reference_state_provider_idx',),
+    ),
+    (
+        'process-payment transaction lookup',
+        'payment.transaction',
+        [
+            ('reference', '=', 'S00001-1'),
+            ('provider_code', '=', 'neatworldpayvt'),
+            ('state', '=', 'draft'),
+        ],
+        ('payment_transaction_reference_state_provider_idx',),
+    ),
+    (
+        'virtual payment lookup',
+        'worldpay.virtual.payment',
+        [('reference', '=', 'vt/00000000-0000-0000-0000-000000000000'), ('status', '=', 'draft')],
+        ('worldpay_virtual_payment_reference_status_idx',),
+    ),
+    (
+        'stale draft scan',
+        'worldpay.virtual.payment',
+        [('status', '=', 'draft'), ('create_date', '<', '2000-01-01')],
+        ('worldpay_virtual_payment_open_create_date_idx',),
+    ),
+    (
+        'invoice origin lookup',
+        'account.move',
+        [('invoice_origin', '=', 'S00001')],
+        ('account_move_invoice_origin_idx',),
+    ),
+]
+
+
+def _scanned_relations(plan, found=None):
+    """ Yield (node type, relation, index) for every scan node of a JSON plan. """
+    found = [] if found is None else found
+    if 'Relation Name' in plan:
+        found.append((plan['Node Type'], plan['Relation Name'], plan.get('Index Name')))
+    elif 'Index Name' in plan:
+        found.append((plan['Node Type'], None, plan['Index Name']))
+    for child in plan.get('Plans', []):
+        _scanned_relations(child, found)
+    return found
+
+
+def check(env):
+    failures = []
+    cr = env.cr
+    cr.execute("SELECT indexname FROM pg_indexes WHERE indexname IN %s", [
+        tuple({name for _label, _model, _domain, expected in CHECKS for name in expected}),
+    ])
+    existing = {row[0] for row in cr.fetchall()}
+    cr.execute("SET LOCAL enable_seqscan = off")
+    for label, model_name, domain, expected in CHECKS:
+        missing = [name for name in expected if name not in existing]
+        if missing:
+            print(f"[FAIL] {label}: missing index {', '.join(missing)}")
+            failures.append(label)
+            continue
+        query = env[model_name].sudo()._search(domain, limit=1)
+        cr.execute(SQL("EXPLAIN (FORMAT JSON) %s", query.select()))
+        plan = cr.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans = _scanned_relations(plan[0]['Plan'])
+        indexes = sorted({scan[2] for scan in scans if scan[2]})
+        status = 'ok' if set(expected) & set(indexes) else 'FAIL'
+        print(f"[{status}] {label}: {', '.join(indexes) or 'no index'} (expected {' or '.join(expected)})")
+        if status == 'FAIL':
+            failures.append(label)
+    cr.rollback()
+    return failures
+
+
+failures = check(env)  # noqa: F821 - provided by `odoo-bin shell`
+if failures:
+    print(f"{len(failures)} lookup(s) did not use the expected index")
+    sys.exit(1)
@@ -0,0 +1,242 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Synthetic data generator for performance tests of payment_neatworldpayvt.
+
+Run it against a disposable database where the module (Odoo 17+ variant), a
+chart of accounts and an enabled virtual terminal provider are installed:
+
+    odoo-bin shell -d <db> --no-http < tools/generate_dataset.py
+
+Volumes are read from the environment (defaults in parentheses):
+
+    NEATWORLDPAYVT_GEN_PARTNERS          customers (10000)
+    NEATWORLDPAYVT_GEN_USERS             internal users (1000)
+    NEATWORLDPAYVT_GEN_INVOICES          posted customer invoices (10000)
+    NEATWORLDPAYVT_GEN_TRANSACTIONS      neatworldpayvt transactions (1000000)
+    NEATWORLDPAYVT_GEN_VIRTUAL_PAYMENTS  virtual terminal payments (100000)
+    NEATWORLDPAYVT_GEN_LEDGER            payment ledger rows (500000)
+    NEATWORLDPAYVT_GEN_DAYS              days the records are spread over (365)
+    NEATWORLDPAYVT_GEN_BATCH             rows per committed batch (50000)
+
+Partners, users and invoices go through the ORM, so that invoices are real
+posted moves. Transactions, virtual payments and ledger rows are inserted
+with `INSERT ... SELECT generate_series(...)`, with states drawn from
+production-like proportions and creation dates spread over the period. Every
+batch is committed and the tables are analyzed at the end, so that the
+planner sees the new cardinalities. References carry a per-run tag, so the
+script can be run several times on the same database.
+"""
+
+import os
+import time
+import uuid
+
+BATCH = int(os.environ.get('NEATWORLDPAYVT_GEN_BATCH', '50000'))
+DAYS = int(os.environ.get('NEATWORLDPAYVT_GEN_DAYS', '365'))
+VOLUMES = {
+    name: int(os.environ.get(f'NEATWORLDPAYVT_GEN_{name.upper()}', default))
+    for name, default in (
+        ('partners', 10000),
+        ('users', 1000),
+        ('invoices', 10000),
+        ('transactions', 1000000),
+        ('virtual_payments', 100000),
+        ('ledger', 500000),
+    )
+}
+ORM_BATCH = 500
+ORM_CONTEXT = {'tracking_disable': True, 'mail_create_nolog': True, 'mail_notrack': True, 'no_reset_password': True}
+
+# Cumulative state proportions, drawn with a single random() per row
+TRANSACTION_STATES = [('done', 0.70), ('cancel', 0.80), ('error', 0.85), ('pending', 0.90), ('authorized', 0.92), ('draft', 1.0)]
+VIRTUAL_PAYMENT_STATES = [('paid', 0.60), ('cancel', 0.70), ('error', 0.75), ('pending', 0.80), ('draft', 1.0)]
+LEDGER_STATES = [('processed', 0.95), ('error', 1.0)]
+
+
+def state_case(states):
+    """ Return a SQL CASE picking a state from cumulative proportions of `r`. """
+    branches = ' '.join(f"WHEN r < {bound} THEN '{state}'" for state, bound in states[:-1])
+    return f"CASE {branches} ELSE '{states[-1][0]}' END"
+
+
+class DatasetGenerator:
+
+    def __init__(self, env):
+        self.env = env.with_context(**ORM_CONTEXT)
+        self.cr = env.cr
+        self.tag = uuid.uuid4().hex[:6].upper()
+        self.provider = self.env['payment.provider'].sudo().search([
+            ('code', '=', 'neatworldpayvt'), ('state', '!=', 'disabled'),
+        ], limit=1)
+        if not self.provider:
+            raise SystemExit("No enabled virtual terminal provider in the database")
+        self.company = self.provider.company_id
+        self.currency = self.company.currency_id
+        self.payment_method = self.provider.payment_method_ids[:1] or self.env.ref('payment.payment_method_card')
+
+    def progress(self, label, done, total, started_at):
+        rate = done / max(time.perf_counter() - started_at, 1e-6)
+        print(f"{label}: {done}/{total} ({rate:.0f}/s)", flush=True)
+
+    def commit(self):
+        self.cr.commit()
+        self.env.invalidate_all()
+
+    # === ORM records === #
+
+    def create_partners(self, total):
+        ids, started_at = [], time.perf_counter()
+        for start in range(0, total, ORM_BATCH):
+            ids += self.env['res.partner'].create([
+                {'name': f'Customer {self.tag}-{start + index}', 'customer_rank': 1}
+                for index in range(min(ORM_BATCH, total - start))
+            ]).ids
+            self.commit()
+            self.progress('partners', len(ids), total, started_at)
+        return ids
+
+    def create_users(self, total):
+        started_at = time.perf_counter()
+        internal_group = self.env.ref('base.group_user')
+        for start in range(0, total, ORM_BATCH):
+            self.env['res.users'].create([{
+                'name': f'Operator {self.tag}-{start + index}',
+                'login': f'operator-{self.tag.lower()}-{start + index}',
+                'company_id': self.company.id,
+                'company_ids': [(6, 0, self.company.ids)],
+                'groups_id': [(6, 0, internal_group.ids)],
+            } for index in range(min(ORM_BATCH, total - start))])
+            self.commit()
+            self.progress('users', min(start + ORM_BATCH, total), total, started_at)
+
+    def create_invoices(self, total, partner_ids):
+        ids, started_at = [], time.perf_counter()
+        Move = self.env['account.move'].with_company(self.company)
+        for start in range(0, total, ORM_BATCH):
+            invoices = Move.create([{
+                'move_type': 'out_invoice',
+                'partner_id': partner_ids[(start + index) % len(partner_ids)],
+                'invoice_line_ids': [(0, 0, {
+                    'name': 'Synthetic service',
+                    'quantity': 1,
+                    'price_unit': 10.0 + (start + index) % 490,
+                })],
+            } for index in range(min(ORM_BATCH, total - start))])
+            invoices.action_post()
+            ids += invoices.ids
+            self.commit()
+            self.progress('invoices', len(ids), total, started_at)
+        return ids
+
+    # === Bulk SQL records === #
+
+    def insert_batches(self, label, total, query, params):
+        """ Run an `INSERT ... SELECT` over `generate_series(%(start)s, %(stop)s)` per batch. """
+        started_at = time.perf_counter()
+        for start in range(0, total, BATCH):
+            self.cr.execute(query, {**params, 'start': start, 'stop': min(start + BATCH, total) - 1})
+            self.commit()
+            self.progress(label, min(start + BATCH, total), total, started_at)
+
+    def common_params(self, partner_ids):
+        return {
+            'tag': self.tag,
+            'uid': self.env.uid,
+            'days': DAYS,
+            'provider_id': self.provider.id,
+            'company_id': self.company.id,
+            'currency_id': self.currency.id,
+            'partner_ids': partner_ids,
+        }
+
+    def insert_transactions(self, total, partner_ids):
+        self.insert_batches('transactions', total, f"""
+            INSERT INTO payment_transaction (
+                reference, provider_id, payment_method_id, company_id, amount, currency_id,
+                partner_id, partner_name, state, operation, last_state_change,
+                create_uid, create_date, write_uid, write_date
+            )
+            SELECT 'GEN' || %(tag)s || '-' || n, %(provider_id)s, %(payment_method_id)s, %(company_id)s,
+                   amount, %(currency_id)s, partner_id, 'Synthetic customer', {state_case(TRANSACTION_STATES)},
+                   'online_direct', created, %(uid)s, created, %(uid)s, created
+              FROM (
+                SELECT n, random() AS r,
+                       round((5 + random() * 495)::numeric, 2) AS amount,
+                       (%(partner_ids)s::int[])[1 + floor(random() * cardinality(%(partner_ids)s::int[]))::int] AS partner_id,
+                       now() at time zone 'UTC' - random() * %(days)s * interval '1 day' AS created
+                  FROM generate_series(%(start)s, %(stop)s) AS n
+              ) AS rows
+        """, {**self.common_params(partner_ids), 'payment_method_id': self.payment_method.id})
+
+    def insert_virtual_payments(self, total, invoice_ids):
+        invoices_field = self.env['worldpay.virtual.payment']._fields['invoice_ids']
+        # Ids are drawn first so that each payment can be linked to its invoice
+        self.insert_batches('virtual payments', total, f"""
+            CREATE TEMP TABLE generated_virtual_payment ON COMMIT DROP AS
+            SELECT nextval('worldpay_virtual_payment_id_seq') AS id, random() AS r,
+                   (%(invoice_ids)s::int[])[1 + floor(random() * cardinality(%(invoice_ids)s::int[]))::int] AS move_id,
+                   now() at time zone 'UTC' - random() * %(days)s * interval '1 day' AS created
+              FROM generate_series(%(start)s, %(stop)s) AS n;
+
+            INSERT INTO worldpay_virtual_payment (
+                id, reference, provider_id, company_id, partner_id, status, currency_id,
+                amount_total, amount, create_uid, create_date, write_uid, write_date
+            )
+            SELECT rows.id, 'vt/' || gen_random_uuid(), %(provider_id)s, %(company_id)s, move.partner_id,
+                   {state_case(VIRTUAL_PAYMENT_STATES)}, %(currency_id)s,
+                   move.amount_total, move.amount_total, %(uid)s, rows.created, %(uid)s, rows.created
+              FROM generated_virtual_payment rows
+              JOIN account_move move ON move.id = rows.move_id;
+
+            INSERT INTO "{invoices_field.relation}" ("{invoices_field.column1}", "{invoices_field.column2}")
+            SELECT id, move_id FROM generated_virtual_payment;
+        """, {**self.common_params([]), 'invoice_ids': invoice_ids})
+
+    def insert_ledger(self, total):
+        self.cr.execute("SELECT min(id), max(id) FROM payment_transaction WHERE reference LIKE %s", [f'GEN{self.tag}-%'])
+        min_id, max_id = self.cr.fetchone()
+        if not min_id:
+            print("ledger: no transactions generated by this run, skipped")
+            return
+        self.insert_batches('ledger', total, f"""
+            INSERT INTO neatworldpayvt_payment (
+                worldpay_reference, odoo_reference, amount, currency, provider_id,
+                transaction_id, processed_date, state, create_uid, create_date, write_uid, write_date
+            )
+            SELECT 'WP' || %(tag)s || '-' || n, tx.reference, round(tx.amount * 100), %(currency)s,
+                   %(provider_id)s, tx.id, tx.create_date, {state_case(LEDGER_STATES)},
+                   %(uid)s, tx.create_date, %(uid)s, tx.create_date
+              FROM (
+                SELECT n, random() AS r, %(min_id)s + floor(random() * (%(max_id)s - %(min_id)s + 1))::int AS tx_id
+                  FROM generate_series(%(start)s, %(stop)s) AS n
+              ) AS rows
+              JOIN payment_transaction tx ON tx.id = rows.tx_id
+        """, {**self.common_params([]), 'currency': self.currency.name, 'min_id': min_id, 'max_id': max_id})
+
+    # === Run === #
+
+    def run(self):
+        print(f"Generating dataset {self.tag} for provider {self.provider.name} ({self.company.name})")
+        partner_ids = self.create_partners(VOLUMES['partners']) if VOLUMES['partners'] else []
+        if not partner_ids and (VOLUMES['invoices'] or VOLUMES['transactions']):
+            raise SystemExit("Partners are needed to generate invoices and transactions")
+        if VOLUMES['users']:
+            self.create_users(VOLUMES['users'])
+        invoice_ids = self.create_invoices(VOLUMES['invoices'], partner_ids) if VOLUMES['invoices'] else []
+        if VOLUMES['transactions']:
+            self.insert_transactions(VOLUMES['transactions'], partner_ids)
+        if VOLUMES['virtual_payments'] and invoice_ids:
+            self.insert_virtual_payments(VOLUMES['virtual_payments'], invoice_ids)
+        if VOLUMES['ledger']:
+            self.insert_ledger(VOLUMES['ledger'])
+        for table in ('res_partner', 'res_users', 'account_move', 'payment_transaction',
+                      'worldpay_virtual_payment', 'neatworldpayvt_payment'):
+            self.cr.execute(f'ANALYZE "{table}"')
+        self.commit()
+        print(f"Dataset {self.tag} generated")
+
+
+DatasetGenerator(env).run()  # noqa: F821 - provided by `odoo-bin shell`
@@ -0,0 +1,290 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Load generator replaying virtual terminal payments against a running server.
+
+    python tools/load_generator.py --url http://127.0.0.1:8069 -d <db> \\
+        --login admin --password admin --payments 200 --concurrency 16 --configure
+
+Each simulated operator opens the virtual terminal on a posted invoice, asks
+for the checkout values, posts the card to `/neatworldpayvt/process-payment`
+and then Worldpay's webhooks are posted to `/neatworldpayvt/wh`. Worldpay
+itself is replaced by `mock_worldpay.py`, run in a thread; `--configure`
+points the database at it (see that script for the system parameters) and
+allows this machine to post webhooks.
+
+Webhooks may be posted before the card (`--webhook-first-rate`), concurrently
+with it, and duplicated (`--duplicate-rate`). Use a disposable database: the
+invoices created are paid for real.
+
+The report gives, per step, the throughput and latency percentiles, and the
+worker occupancy: the average and peak number of requests in flight, which
+is the number of busy workers the load needs. With `--metrics-token`, the
+time webhooks spent in the server's polling loops is read from
+`/neatworldpayvt/metrics`; those counts may lag by up to ten seconds on
+workers that went idle.
+"""
+
+import argparse
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from mock_worldpay import MockWorldpay
+
+WAIT_METRIC = re.compile(r'^neatworldpayvt_webhook_wait_seconds_total\{.*target="(\w+)"\} (\S+)$', re.M)
+
+
+class Recorder:
+    """ Collect request latencies and the number of requests in flight. """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.busy_time = 0.0
+        self.lock = threading.Lock()
+
+    def timed(self, step, func, *args, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started_at = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+            if response.status_code >= 400:
+                self.errors[f'{step}: HTTP {response.status_code}'] += 1
+            return response
+        except requests.RequestException as error:
+            self.errors[f'{step}: {type(error).__name__}'] += 1
+            return None
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with self.lock:
+                self.in_flight -= 1
+                self.busy_time += elapsed
+                self.latencies[step].append(elapsed)
+
+
+def percentile(values, rank):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * rank))] if ordered else 0.0
+
+
+class LoadGenerator:
+
+    def __init__(self, args, mock_url):
+        self.args = args
+        self.url = args.url.rstrip('/')
+        self.mock_url = mock_url
+        self.recorder = Recorder()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=args.concurrency * 2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    # === JSON-RPC === #
+
+    def rpc(self, path, params):
+        response = self.session.post(f'{self.url}{path}', json={'jsonrpc': '2.0', 'method': 'call', 'params': params})
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get('error'):
+            raise RuntimeError(payload['error'].get('data', {}).get('message') or payload['error'])
+        return payload.get('result')
+
+    def call_kw(self, model, method, args, kwargs=None):
+        return self.rpc(f'/web/dataset/call_kw/{model}/{method}', {
+            'model': model, 'method': method, 'args': args, 'kwargs': kwargs or {},
+        })
+
+    # === Setup === #
+
+    def setup(self):
+        args = self.args
+        self.rpc('/web/session/authenticate', {'db': args.database, 'login': args.login, 'password': args.password})
+        if args.configure:
+            for key, value in (
+                ('payment_neatworldpayvt.license_url', f'{self.mock_url}/api/AcquirerLicense/code?version=vt-v3'),
+                ('payment_neatworldpayvt.worldpay_api_url', self.mock_url),
+                ('payment_neatworldpayvt.webhook_allowed_ips', args.webhook_source_ip),
+            ):
+                self.call_kw('ir.config_parameter', 'set_param', [key, value])
+        providers = self.call_kw('payment.provider', 'search_read', [
+            [('code', '=', 'neatworldpayvt'), ('state', '!=', 'disabled')], ['id'],
+        ], {'limit': 1})
+        if not providers:
+            raise SystemExit("No enabled virtual terminal provider in the database")
+        self.provider_id = providers[0]['id']
+        if args.configure:
+            self.call_kw('payment.provider', 'write', [[self.provider_id], {
+                'neatworldpayvt_activation_code': f'load-{uuid.uuid4().hex[:8]}',
+                'neatworldpayvt_async_payment': args.async_payment,
+            }])
+        partner_id = self.call_kw('res.partner', 'create', [{'name': f'Load test {uuid.uuid4().hex[:8]}'}])
+        invoice_ids = []
+        total = args.payments * args.invoices_per_payment
+        for start in range(0, total, 100):
+            batch = self.call_kw('account.move', 'create', [[{
+                'move_type': 'out_invoice',
+                'partner_id': partner_id,
+                'invoice_line_ids': [(0, 0, {'name': 'Load test', 'quantity': 1, 'price_unit': 10.0})],
+            } for _i in range(min(100, total - start))]])
+            self.call_kw('account.move', 'action_post', [batch])
+            invoice_ids += batch
+        size = args.invoices_per_payment
+        return [invoice_ids[index:index + size] for index in range(0, total, size)]
+
+    def scrape_wait_seconds(self):
+        if not self.args.metrics_token:
+            return {}
+        response = self.session.get(f'{self.url}/neatworldpayvt/metrics', headers={
+            'Authorization': f'Bearer {self.args.metrics_token}',
+        })
+        if response.status_code != 200:
+            return {}
+        wait_seconds = {}
+        for target, value in WAIT_METRIC.findall(response.text):  # summed over the providers
+            wait_seconds[target] = wait_seconds.get(target, 0.0) + float(value)
+        return wait_seconds
+
+    # === Flow === #
+
+    def post_webhook(self, reference, event):
+        body = {
+            'eventId': str(uuid.uuid4()),
+            'eventDetails': {'classification': 'card', 'transactionReference': reference, 'type': event},
+        }
+        sends = 2 if random.random() < self.args.duplicate_rate else 1
+        for _i in range(sends):
+            self.recorder.timed(f'webhook {event}', requests.post, f'{self.url}/neatworldpayvt/wh', json=body, timeout=120)
+
+    def post_webhooks(self, reference):
+        time.sleep(self.args.webhook_delay)
+        for event in self.args.events:
+            self.post_webhook(reference, event)
+
+    def pay(self, invoice_ids):
+        """ Run the operator flow of one payment; return False if it failed early. """
+        recorder = self.recorder
+        response = recorder.timed('open terminal', self.session.post, f'{self.url}/web/dataset/call_kw', json={
+            'jsonrpc': '2.0', 'method': 'call', 'params': {
+                'model': 'account.move', 'method': 'action_open_worldpay_vt_popup',
+                'args': [invoice_ids], 'kwargs': {},
+            },
+        })
+        payload = response.json() if response is not None and response.status_code == 200 else {}
+        wizard_id = (payload.get('result') or {}).get('res_id')
+        if not wizard_id:
+            if payload.get('error'):
+                recorder.errors['open terminal: RPC error'] += 1
+            return False
+        response = recorder.timed(
+            'checkout', self.session.post, f'{self.url}/neatworldpayvt/invoice_payment/{wizard_id}/checkout',
+            json={'provider_id': self.provider_id},
+        )
+        checkout = response.json() if response is not None and response.status_code == 200 else {}
+        reference = checkout.get('transaction_reference')
+        if not reference:
+            return False
+        webhooks = threading.Thread(target=self.post_webhooks, args=(reference,))
+        webhook_first = random.random() < self.args.webhook_first_rate
+        if webhook_first:
+            webhooks.start()
+        recorder.timed('process payment', self.session.post, f'{self.url}/neatworldpayvt/process-payment', data={
+            'transaction_reference': reference,
+            'transaction_key': checkout.get('transaction_key'),
+            'provider_id': self.provider_id,
+            'sessionState': f'load-{uuid.uuid4().hex}',
+            'cardholderName': 'Load Test',
+            'address': '1 Load Street',
+            'city': 'London',
+            'country': 'GB',
+            'postcode': 'EC1A 1BB',
+        }, allow_redirects=False)
+        if not webhook_first:
+            webhooks.start()
+        webhooks.join()
+        return True
+
+    def run(self):
+        payments = self.setup()
+        wait_before = self.scrape_wait_seconds()
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(self.args.concurrency) as executor:
+            completed = sum(executor.map(self.pay, payments))
+        elapsed = time.perf_counter() - started_at
+        if self.args.metrics_token:
+            time.sleep(self.args.settle)
+        wait_after = self.scrape_wait_seconds()
+        self.report(len(payments), completed, elapsed, {
+            target: value - wait_before.get(target, 0.0) for target, value in wait_after.items()
+        })
+
+    def report(self, attempted, completed, elapsed, wait_seconds):
+        recorder = self.recorder
+        print(f"{completed}/{attempted} payments in {elapsed:.1f}s: {completed / elapsed:.2f} payments/s")
+        print(f"{'step':28} {'count':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+        for step, latencies in recorder.latencies.items():
+            print(f"{step:28} {len(latencies):7d} {len(latencies) / elapsed:8.2f} "
+                  f"{percentile(latencies, 0.5):8.3f} {percentile(latencies, 0.95):8.3f} "
+                  f"{percentile(latencies, 0.99):8.3f} {max(latencies):8.3f}")
+        print(f"Busy workers: {recorder.busy_time / elapsed:.2f} on average, {recorder.peak_in_flight} at peak")
+        for target, seconds in sorted(wait_seconds.items()):
+            print(f"Webhook polling wait ({target}): {seconds:.0f}s, "
+                  f"{seconds / recorder.busy_time:.1%} of the busy worker time")
+        for error, count in recorder.errors.most_common():
+            print(f"[ERROR] {error}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8069')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--login', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--payments', type=int, default=100, help='number of payments to replay')
+    parser.add_argument('--concurrency', type=int, default=8, help='simultaneous operators')
+    parser.add_argument('--invoices-per-payment', type=int, default=1)
+    parser.add_argument('--events', default='sentForAuthorization,authorized,sentForSettlement',
+                        help='comma separated webhook events posted for each payment')
+    parser.add_argument('--webhook-delay', type=float, default=0.5,
+                        help='seconds between the card and its webhooks')
+    parser.add_argument('--webhook-first-rate', type=float, default=0.0,
+                        help='fraction of payments whose webhooks start before the card is posted')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help='fraction of webhooks posted twice')
+    parser.add_argument('--async-payment', action='store_true', help='authorize through the job queue')
+    parser.add_argument('--mock-port', type=int, default=8079)
+    parser.add_argument('--mock-url', help='URL of the mock as seen by the server (http://127.0.0.1:<mock port>)')
+    parser.add_argument('--mock-latency', type=float, default=0.3, help='seconds Worldpay takes to answer')
+    parser.add_argument('--configure', action='store_true',
+                        help='point the database at the mock and allow the webhooks of this machine')
+    parser.add_argument('--webhook-source-ip', default='127.0.0.1',
+                        help='address the server sees for this machine, allowed with --configure')
+    parser.add_argument('--metrics-token', help='value of payment_neatworldpayvt.metrics_token')
+    parser.add_argument('--settle', type=float, default=12.0,
+                        help='seconds to wait for the server metrics before the final scrape')
+    args = parser.parse_args()
+    args.events = [event for event in args.events.split(',') if event]
+
+    mock = MockWorldpay({'latency': args.mock_latency}, '0.0.0.0', args.mock_port)
+    mock_url = args.mock_url or f'http://127.0.0.1:{args.mock_port}'
+    mock.start()
+    try:
+        LoadGenerator(args, mock_url).run()
+    finally:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
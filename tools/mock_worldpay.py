@@ -0,0 +1,334 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Local stand-in for Worldpay Access and the SNS license server.
+
+It needs nothing but the Python standard library:
+
+    python tools/mock_worldpay.py --port 8079 \\
+        --webhook-url http://127.0.0.1:8069/neatworldpayvt/wh
+
+Then point the Odoo database at it with these system parameters:
+
+    payment_neatworldpayvt.license_url         http://127.0.0.1:8079/api/AcquirerLicense/code?version=vt-v3
+    payment_neatworldpayvt.worldpay_api_url    http://127.0.0.1:8079
+    payment_neatworldpayvt.webhook_allowed_ips 127.0.0.1
+
+Any activation code is accepted (unless `--activation-code` is given) and
+yields `LICENSE_CODE`, which authorizes cards against this server. Each
+authorization is answered after the configured latency and may fail or be
+refused at the configured rates. The matching webhook events are then posted
+to `--webhook-url`, possibly duplicated or out of order.
+
+The behaviour can be changed while the server runs:
+
+    GET  /_mock/stats    counters of requests, outcomes and webhooks sent
+    POST /_mock/config   JSON object merged into the configuration
+    POST /_mock/reset    forget the payments and reset the counters
+
+Other tools import `MockWorldpay` to run the server in a thread.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+LICENSE_PATH = '/api/AcquirerLicense/code'
+
+DEFAULT_CONFIG = {
+    'latency': 0.0,  # seconds added to every Worldpay and license answer
+    'jitter': 0.0,  # random extra seconds, uniformly distributed
+    'error_rate': 0.0,  # fraction of Worldpay requests answered with HTTP 500
+    'decline_rate': 0.0,  # fraction of authorizations refused
+    'activation_code': None,  # the only accepted activation code; any if None
+    'webhook_url': None,  # where to post webhook events; none are sent if None
+    'webhook_delay': 0.5,  # seconds between an operation and its first event
+    'webhook_interval': 0.2,  # seconds between the events of an operation
+    'webhook_events': ['sentForAuthorization', 'authorized'],  # events of an authorization
+    'duplicate_rate': 0.0,  # fraction of events posted twice
+    'reorder_rate': 0.0,  # fraction of authorizations whose events are posted in reverse
+}
+
+# Licensed code stand-in, exec'd by the module like the real one. Without card
+# values it returns the checkout values of `tr`; with them, it authorizes the
+# card against the Worldpay API configured on the provider.
+LICENSE_CODE = '''
+_provider = tr.provider_id.sudo()
+_api_url = _provider._neatworldpayvt_get_api_url()
+if 'session_state' in locals():
+    _response = requests.post(_api_url + '/payments', json={
+        'transactionReference': processing_values['reference'],
+        'merchant': {'entity': _provider.neatworldpayvt_entity},
+        'paymentInstrument': {'type': 'checkout', 'sessionHref': session_state},
+    }, auth=(_provider.neatworldpayvt_username or '', _provider.neatworldpayvt_password or ''), timeout=10)
+    _body = _response.json() if _response.content else {}
+    payment_result = {
+        'success': _response.status_code in (200, 201) and _body.get('outcome') == 'authorized',
+        'outcome': _body.get('outcome') or 'error',
+        'response': _body,
+    }
+else:
+    transaction_key = tr.neatworldpayvt_generate_transaction_key()
+    transaction_reference = processing_values['reference']
+    checkout_id = _provider.neatworldpayvt_checkout_id
+    worldpay_url = _api_url
+    billing_address = {}
+    countries = []
+'''
+
+# Operation path suffixes, with the event they produce and their HAL relation
+OPERATIONS = {
+    'settlements': ('sentForSettlement', 'cardPayments:settle'),
+    'partialSettlements': ('sentForSettlement', 'cardPayments:partialSettle'),
+    'cancellations': ('cancelled', 'cardPayments:cancel'),
+    'refunds': ('sentForRefund', 'cardPayments:refund'),
+    'partialRefunds': ('sentForRefund', 'cardPayments:partialRefund'),
+}
+
+
+class MockWorldpay:
+    """ The mock server and its in-memory state.
+
+    :param dict config: Overrides of `DEFAULT_CONFIG`
+    """
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = {**DEFAULT_CONFIG, **(config or {})}
+        self.payments = {}  # payment id -> payment
+        self.references = {}  # transaction reference -> payment id
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """ Serve from a daemon thread and return the base URL of the server. """
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        with self.lock:
+            self.payments.clear()
+            self.references.clear()
+            self.stats.clear()
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    # === Simulated behaviour === #
+
+    def wait(self):
+        delay = self.config['latency'] + random.uniform(0, self.config['jitter'])
+        if delay > 0:
+            time.sleep(delay)
+
+    def fails(self):
+        return random.random() < self.config['error_rate']
+
+    def authorize(self, payload):
+        """ Record a payment and return its authorization answer. """
+        reference = payload.get('transactionReference')
+        payment_id = uuid.uuid4().hex
+        declined = random.random() < self.config['decline_rate']
+        outcome = 'refused' if declined else 'authorized'
+        base = f'{self.url}/payments/{payment_id}'
+        links = {} if declined else {
+            rel: {'href': f'{base}/{suffix}'} for suffix, (_event, rel) in OPERATIONS.items()
+        }
+        payment = {
+            'transactionReference': reference,
+            'lastEvent': outcome,
+            '_links': links,
+        }
+        with self.lock:
+            self.payments[payment_id] = payment
+            self.references[reference] = payment_id
+        self.count(f'authorization.{outcome}')
+        events = ['refused'] if declined else list(self.config['webhook_events'])
+        if random.random() < self.config['reorder_rate']:
+            events.reverse()
+        self.send_webhooks(reference, events)
+        return {'outcome': outcome, 'transactionReference': reference, '_links': links}
+
+    def run_operation(self, payment_id, suffix):
+        """ Apply a settlement, cancellation or refund; return False if it is not allowed. """
+        event, rel = OPERATIONS[suffix]
+        with self.lock:
+            payment = self.payments.get(payment_id)
+            if not payment or rel not in payment['_links']:
+                return False
+            payment['lastEvent'] = event
+        self.count(f'operation.{suffix}')
+        self.send_webhooks(payment['transactionReference'], [event])
+        return True
+
+    def query(self, reference):
+        with self.lock:
+            payment_id = self.references.get(reference)
+            return dict(self.payments[payment_id]) if payment_id else None
+
+    def send_webhooks(self, reference, events):
+        url = self.config['webhook_url']
+        if not url or not events:
+            return
+        schedule = []
+        for index, event in enumerate(events):
+            at = self.config['webhook_delay'] + index * self.config['webhook_interval']
+            schedule.append((at, event))
+            if random.random() < self.config['duplicate_rate']:
+                schedule.append((at + self.config['webhook_interval'] / 2, event))
+        for at, event in schedule:
+            timer = threading.Timer(at, self.post_webhook, args=(url, reference, event))
+            timer.daemon = True
+            timer.start()
+
+    def post_webhook(self, url, reference, event):
+        body = json.dumps({
+            'eventId': str(uuid.uuid4()),
+            'eventTimestamp': datetime.now(timezone.utc).isoformat(),
+            'eventDetails': {
+                'classification': 'card',
+                'transactionReference': reference,
+                'type': event,
+                'date': datetime.now(timezone.utc).date().isoformat(),
+            },
+        }).encode()
+        webhook = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(webhook, timeout=60) as response:
+                self.count(f'webhook.{response.status}')
+        except urllib.error.HTTPError as error:
+            self.count(f'webhook.{error.code}')
+        except OSError:
+            self.count('webhook.unreachable')
+
+
+def _make_handler(mock):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status, payload=None):
+            body = json.dumps(payload).encode() if payload is not None else b''
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                return json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                return {}
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == '/_mock/stats':
+                with mock.lock:
+                    return self._send_json(200, dict(mock.stats))
+            mock.count(f'GET /{url.path.split("/")[1]}')
+            if url.path == LICENSE_PATH:
+                return self._license()
+            mock.wait()
+            if mock.fails():
+                return self._send_json(500, {'errorName': 'internalErrorOccurred'})
+            if url.path == '/paymentQueries/payments':
+                reference = (parse_qs(url.query).get('transactionReference') or [None])[0]
+                payment = mock.query(reference)
+                if not payment:
+                    return self._send_json(404, {'errorName': 'entityNotFound'})
+                return self._send_json(200, {'_embedded': {'payments': [payment]}})
+            return self._send_json(404, {'errorName': 'urlNotFound'})
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            payload = self._read_json()
+            if url.path == '/_mock/config':
+                mock.config.update(payload)
+                return self._send_json(200, mock.config)
+            if url.path == '/_mock/reset':
+                mock.reset()
+                return self._send_json(200, {})
+            mock.count(f'POST /{url.path.split("/")[1]}')
+            mock.wait()
+            if mock.fails():
+                return self._send_json(500, {'errorName': 'internalErrorOccurred'})
+            if url.path == '/payments':
+                return self._send_json(201, mock.authorize(payload))
+            parts = url.path.strip('/').split('/')
+            if len(parts) == 3 and parts[0] == 'payments' and parts[2] in OPERATIONS:
+                if mock.run_operation(parts[1], parts[2]):
+                    return self._send_json(202, {'outcome': OPERATIONS[parts[2]][0]})
+                return self._send_json(409, {'errorName': 'operationNotAllowed'})
+            return self._send_json(404, {'errorName': 'urlNotFound'})
+
+        def _license(self):
+            mock.wait()
+            activation_code = self.headers.get('Authorization')
+            expected = mock.config['activation_code']
+            if not activation_code or (expected and activation_code != expected):
+                mock.count('license.refused')
+                return self._send_json(401, {'message': 'Invalid activation code'})
+            mock.count('license.served')
+            body = LICENSE_CODE.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8079)
+    for key, default in DEFAULT_CONFIG.items():
+        option = '--' + key.replace('_', '-')
+        if isinstance(default, list):
+            parser.add_argument(option, default=','.join(default), help='comma separated')
+        elif isinstance(default, float):
+            parser.add_argument(option, type=float, default=default)
+        else:
+            parser.add_argument(option, default=default)
+    args = parser.parse_args()
+    config = {key: getattr(args, key) for key in DEFAULT_CONFIG}
+    config['webhook_events'] = [event for event in config['webhook_events'].split(',') if event]
+    mock = MockWorldpay(config, args.host, args.port)
+    print(f"Mock Worldpay and license server listening on {mock.url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Race condition harness for the webhook and the process-payment route.
+
+Run it against a disposable database where the module (Odoo 17+ variant) and
+a chart of accounts are installed, from the repository root:
+
+    odoo-bin shell -d <db> --no-http < tools/race_harness.py
+
+Each scenario pays a fresh invoice through the virtual terminal. The route
+handlers run in threads, each on its own cursor and retried on serialization
+failures as the HTTP server does, in an order fixed by the scenario:
+
+- the webhook's polling loop can be held on its first sleep until the
+  scenario releases it, e.g. to post the card while an early `authorized`
+  event waits for the payment page;
+- handlers can be started together behind a barrier, e.g. two copies of the
+  same `authorized` event.
+
+Worldpay is replaced by `mock_worldpay.py`, run in a thread. Once a scenario
+has run, the virtual payment status, the invoice payment states and the
+number of `account.payment` records are checked; the script exits with status
+1 if any scenario breaks an invariant. The scenarios commit their data; the
+provider settings they change are restored at the end. Settings are read from
+the environment:
+
+    NEATWORLDPAYVT_RACE_ONLY     comma separated scenario names to run
+    NEATWORLDPAYVT_RACE_REPEAT   number of runs of each scenario (1)
+    NEATWORLDPAYVT_TOOLS         directory of this script (tools)
+"""
+
+import inspect
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from types import SimpleNamespace
+
+from odoo import SUPERUSER_ID, api
+from odoo.http import _request_stack
+from odoo.service.model import retrying
+
+from odoo.addons.payment_neatworldpayvt.controllers import main as controllers_main
+
+sys.path.insert(0, os.environ.get('NEATWORLDPAYVT_TOOLS', 'tools'))
+from mock_worldpay import LICENSE_CODE, MockWorldpay  # noqa: E402
+
+ONLY = {name for name in os.environ.get('NEATWORLDPAYVT_RACE_ONLY', '').split(',') if name}
+REPEAT = int(os.environ.get('NEATWORLDPAYVT_RACE_REPEAT', '1'))
+TIMEOUT = 60
+FAILURE_SUMMARY = 'Payment Failed - Action Required'
+
+Controller = controllers_main.NeatWorldpayVTController
+# The route functions without the routing and profiling wrappers
+WEBHOOK = inspect.unwrap(Controller.neatworldpayvt_wh)
+PROCESS_PAYMENT = inspect.unwrap(Controller.neatworldpayvt_process_payment)
+
+
+class SleepGate:
+    """ Stands for the `time` module of the controllers; holds the first sleep.
+
+    The webhook polling loops sleep between two lookups of the payment. The
+    first thread to sleep sets `sleeping` and blocks until `release` is set;
+    later sleeps return at once.
+    """
+
+    def __init__(self):
+        self.sleeping = threading.Event()
+        self.release = threading.Event()
+
+    def sleep(self, _seconds):
+        self.sleeping.set()
+        if not self.release.wait(TIMEOUT):
+            raise TimeoutError("The sleep gate was never released")
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+class FakeRequest(SimpleNamespace):
+    """ The parts of `odoo.http.request` used by the routes. """
+
+    def get_json_data(self):
+        return self.json_data
+
+    def make_json_response(self, data, headers=None, cookies=None, status=200):
+        return SimpleNamespace(status_code=status, data=data)
+
+    def redirect(self, location, code=303, local=True):
+        return SimpleNamespace(status_code=code, location=location)
+
+
+class RaceHarness:
+
+    def __init__(self, env, api_url):
+        self.env = env
+        self.registry = env.registry
+        self.api_url = api_url
+        self.errors = []
+
+    # === Setup === #
+
+    def configure(self):
+        """ Point the provider at the mock; return a callable restoring the settings. """
+        env = self.env
+        ICP = env['ir.config_parameter'].sudo()
+        provider = env['payment.provider'].sudo().search([
+            ('code', '=', 'neatworldpayvt'), ('state', '!=', 'disabled'),
+        ], limit=1)
+        if not provider:
+            raise SystemExit("No enabled virtual terminal provider in the database")
+        saved_param = ICP.get_param('payment_neatworldpayvt.worldpay_api_url')
+        saved_values = provider.read(['neatworldpayvt_cached_code', 'neatworldpayvt_async_payment'])[0]
+        ICP.set_param('payment_neatworldpayvt.worldpay_api_url', self.api_url)
+        provider.write({'neatworldpayvt_cached_code': LICENSE_CODE, 'neatworldpayvt_async_payment': False})
+        env.cr.commit()
+        self.provider_id = provider.id
+        self.public_uid = env.ref('base.public_user').id
+
+        def restore():
+            ICP.set_param('payment_neatworldpayvt.worldpay_api_url', saved_param or False)
+            provider.write({key: value for key, value in saved_values.items() if key != 'id'})
+            env.cr.commit()
+        return restore
+
+    def new_case(self, invoice_count=1):
+        """ Commit posted invoices and their virtual terminal payment. """
+        env = self.env
+        partner = env['res.partner'].create({'name': f'Race {uuid.uuid4().hex[:8]}'})
+        invoices = env['account.move'].create([{
+            'move_type': 'out_invoice',
+            'partner_id': partner.id,
+            'invoice_line_ids': [(0, 0, {'name': 'Race', 'quantity': 1, 'price_unit': 10.0})],
+        } for _i in range(invoice_count)])
+        invoices.action_post()
+        wizard = env['worldpay.vt.popup'].create_from_invoices(invoices)
+        case = SimpleNamespace(
+            partner_id=partner.id,
+            invoice_ids=invoices.ids,
+            payment_id=wizard.virtual_payment_id.id,
+            reference=wizard.virtual_payment_id.reference,
+            transaction_key=wizard.transaction_key,
+        )
+        env.cr.commit()
+        return case
+
+    # === Requests === #
+
+    def handle(self, func, uid, json_data=None, params=None):
+        """ Run a route function like the HTTP server: own cursor, retried, committed. """
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, uid, {})
+            fake_request = FakeRequest(
+                env=env,
+                params=params or {},
+                json_data=json_data,
+                httprequest=SimpleNamespace(remote_addr=Controller._allowed_ips[0], headers={}, path='/'),
+            )
+            _request_stack.push(fake_request)
+            try:
+                return retrying(lambda: func(Controller()), env)
+            finally:
+                _request_stack.pop()
+
+    def webhook(self, case, event):
+        return self.handle(lambda controller: WEBHOOK(controller), self.public_uid, json_data={
+            'eventId': str(uuid.uuid4()),
+            'eventDetails': {'classification': 'card', 'transactionReference': case.reference, 'type': event},
+        })
+
+    def process_payment(self, case):
+        return self.handle(lambda controller: PROCESS_PAYMENT(
+            controller,
+            transaction_reference=case.reference,
+            transaction_key=case.transaction_key,
+            sessionState=f'race-{uuid.uuid4().hex}',
+            cardholderName='Race Test',
+            address='1 Race Street',
+            city='London',
+            country='GB',
+            postcode='EC1A 1BB',
+        ), SUPERUSER_ID, params={'provider_id': str(self.provider_id)})
+
+    def start(self, func, *args):
+        """ Run a request in a thread; errors are recorded. """
+        def target():
+            try:
+                func(*args)
+            except Exception:
+                self.errors.append(traceback.format_exc())
+        thread = threading.Thread(target=target)
+        thread.start()
+        return thread
+
+    def together(self, *calls):
+        """ Run requests in threads released at the same time and wait for them. """
+        barrier = threading.Barrier(len(calls))
+
+        def synchronized(func, *args):
+            barrier.wait(TIMEOUT)
+            return func(*args)
+        threads = [self.start(synchronized, *call) for call in calls]
+        for thread in threads:
+            thread.join(TIMEOUT * 2)
+
+    def gate(self):
+        gate = SleepGate()
+        controllers_main.time = gate
+        return gate
+
+    def ungate(self):
+        controllers_main.time = time
+
+    # === Scenarios === #
+
+    def scenario_in_order(self, case):
+        self.process_payment(case)
+        for event in ('sentForAuthorization', 'authorized', 'sentForSettlement'):
+            self.webhook(case, event)
+        return {'status': 'paid', 'payments': 1}
+
+    def scenario_webhook_first(self, case):
+        """ `authorized` arrives while the card is still being posted. """
+        gate = self.gate()
+        try:
+            webhook = self.start(self.webhook, case, 'authorized')
+            if not gate.sleeping.wait(TIMEOUT):
+                raise TimeoutError("The webhook did not wait for the payment page")
+            self.process_payment(case)
+        finally:
+            gate.release.set()
+            self.ungate()
+        webhook.join(TIMEOUT)
+        return {'status': 'paid', 'payments': 1}
+
+    def scenario_concurrent_authorized(self, case):
+        """ The card and `authorized` hit the server at the same time. """
+        self.together((self.process_payment, case), (self.webhook, case, 'authorized'))
+        return {'status': 'paid', 'payments': 1}
+
+    def scenario_duplicate_authorized(self, case):
+        """ Worldpay delivers `authorized` twice, concurrently. """
+        self.process_payment(case)
+        self.together((self.webhook, case, 'authorized'), (self.webhook, case, 'authorized'))
+        return {'status': 'paid', 'payments': 1}
+
+    def scenario_duplicate_process_payment(self, case):
+        """ The operator double-submits the card form. """
+        self.together((self.process_payment, case), (self.process_payment, case))
+        self.webhook(case, 'authorized')
+        return {'status': 'paid', 'payments': 1}
+
+    def scenario_cancel_after_paid(self, case):
+        """ A late `cancelled` must not unpay the invoices but flag them. """
+        self.process_payment(case)
+        self.webhook(case, 'authorized')
+        self.webhook(case, 'cancelled')
+        return {'status': 'paid', 'payments': 1, 'activities': 1}
+
+    def scenarios(self):
+        return [
+            (name[len('scenario_'):], getattr(self, name))
+            for name in sorted(dir(self)) if name.startswith('scenario_')
+        ]
+
+    # === Checks === #
+
+    def check(self, case, expected):
+        """ Return the broken invariants of a case. """
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            payment = env['worldpay.virtual.payment'].browse(case.payment_id)
+            invoices = env['account.move'].browse(case.invoice_ids)
+            payments = env['account.payment'].search_count([('partner_id', '=', case.partner_id)])
+            activities = env['mail.activity'].search_count([
+                ('res_model', '=', 'account.move'),
+                ('res_id', 'in', case.invoice_ids),
+                ('summary', '=', FAILURE_SUMMARY),
+            ])
+            problems = []
+            if payment.status != expected['status']:
+                problems.append(f"status {payment.status}, expected {expected['status']}")
+            if expected['status'] == 'paid':
+                unpaid = invoices.filtered(lambda move: move.payment_state not in ('paid', 'in_payment'))
+                if unpaid:
+                    problems.append(f"invoices {unpaid.ids} not paid")
+            if payments != expected['payments']:
+                problems.append(f"{payments} account.payment records, expected {expected['payments']}")
+            if activities != expected.get('activities', 0):
+                problems.append(f"{activities} failure activities, expected {expected.get('activities', 0)}")
+            return problems
+
+    # === Run === #
+
+    def run(self):
+        failures = 0
+        restore = self.configure()
+        try:
+            for name, scenario in self.scenarios():
+                if ONLY and name not in ONLY:
+                    continue
+                for run in range(REPEAT):
+                    self.errors = []
+                    case = self.new_case()
+                    started_at = time.perf_counter()
+                    try:
+                        problems = self.check(case, scenario(case))
+                    except Exception:
+                        problems = [f"scenario raised:\n{traceback.format_exc()}"]
+                    problems += [f"handler raised:\n{error}" for error in self.errors]
+                    label = f"{name}#{run + 1}" if REPEAT > 1 else name
+                    outcome = 'FAIL' if problems else 'ok'
+                    print(f"{label:36} {outcome:4} {time.perf_counter() - started_at:6.1f}s {case.reference}")
+                    for problem in problems:
+                        print(f"    {problem}")
+                    failures += bool(problems)
+        finally:
+            self.ungate()
+            restore()
+        return failures
+
+
+mock = MockWorldpay()
+try:
+    race_failures = RaceHarness(env, mock.start()).run()  # noqa: F821 - provided by `odoo-bin shell`
+finally:
+    mock.stop()
+
+if race_failures:
+    print(f"{race_failures} scenario run(s) broke an invariant")
+    sys.exit(1)
+print("All scenarios kept their invariants")
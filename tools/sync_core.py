@@ -0,0 +1,96 @@
+# Original Author: Daniel Stoynev
+# Copyright (c) 2025 SNS Software Ltd. All rights reserved.
+# This module extends Odoo's payment framework.
+# Odoo is a trademark of Odoo S.A.
+"""
+Keep the version-agnostic `core` package identical in every variant.
+
+The package is edited in `Odoo 17 plus` and copied to the other variants:
+
+    python tools/sync_core.py           copy the package over
+    python tools/sync_core.py --check   exit with status 1 if a copy differs
+    python tools/sync_core.py --bench   time the core functions, no Odoo needed
+"""
+
+import argparse
+import filecmp
+import os
+import shutil
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE = os.path.join(ROOT, 'Odoo 17 plus', 'payment_neatworldpayvt', 'core')
+TARGETS = [
+    os.path.join(ROOT, variant, 'payment_neatworldpayvt', 'core')
+    for variant in ('Odoo 16', 'Odoo 19')
+]
+
+
+def core_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.py'))
+
+
+def differences(target):
+    if not os.path.isdir(target):
+        return ['missing']
+    names = core_files(SOURCE)
+    problems = [f'{name} is not in the source' for name in core_files(target) if name not in names]
+    _match, mismatch, errors = filecmp.cmpfiles(SOURCE, target, names, shallow=False)
+    return problems + [f'{name} differs' for name in mismatch] + [f'{name} is missing' for name in errors]
+
+
+def sync(target):
+    os.makedirs(target, exist_ok=True)
+    names = core_files(SOURCE)
+    for name in core_files(target):
+        if name not in names:
+            os.remove(os.path.join(target, name))
+    for name in names:
+        shutil.copy2(os.path.join(SOURCE, name), os.path.join(target, name))
+
+
+def bench():
+    sys.path.insert(0, os.path.dirname(SOURCE))
+    from core import amounts, license, references, states, worldpay
+    source = 'x = 1\n' * 2000
+    cases = [
+        ('amounts.to_minor_units', lambda: amounts.to_minor_units(1234.56, 2)),
+        ('amounts.from_minor_units', lambda: amounts.from_minor_units(123456, 2)),
+        ('references.classify (vt)', lambda: references.classify('vt/0b9a4a1e-1c2b-4d5e-8f00-123456789abc')),
+        ('references.classify (tx)', lambda: references.classify('S00042-1')),
+        ('states.document_target_status', lambda: states.document_target_status('pending', 'done')),
+        ('worldpay.event_to_result_state', lambda: worldpay.event_to_result_state('authorized')),
+        ('license.compile_code (cached)', lambda: license.compile_code(source)),
+    ]
+    for label, func in cases:
+        number, total = timeit.Timer(func).autorange()
+        print(f"{label:36} {total / number * 1e6:9.3f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--check', action='store_true', help='only report the copies that differ')
+    group.add_argument('--bench', action='store_true', help='time the core functions')
+    args = parser.parse_args()
+    if args.bench:
+        bench()
+        return
+    failed = False
+    for target in TARGETS:
+        problems = differences(target)
+        if not problems:
+            continue
+        if args.check:
+            failed = True
+            for problem in problems:
+                print(f"{os.path.relpath(target, ROOT)}: {problem}")
+        else:
+            sync(target)
+            print(f"Synchronized {os.path.relpath(target, ROOT)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()